@@ -0,0 +1,210 @@
+"""
+This module is an asyncio counterpart to Environment, so a test can wait for several conditions at the same time,
+against one deadline, instead of one after another with a timeout each.
+
+The conditions are evaluated on the event loop, whenever the watcher of the environment sees a capture change.
+Commands to the containers run on a thread of their own, in the order they were given, without blocking the loop.
+One loop can drive several environments.
+
+Example of usage :
+
+    async def switchover(aenv):
+        await aenv.open_squelch("remote2")
+        assert await all_within(2, aenv.wait_for_ptt(True),
+                                aenv.wait_for_remote_state("remote2", "active", True),
+                                aenv.wait_for_remote_by_tone("remote2"))
+
+    asyncio.run(switchover(AsyncEnvironment(env)))
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import logging
+from time import monotonic
+
+
+async def all_within(timeout, *waits):
+    """
+    wait for all conditions at the same time
+    :param timeout: in seconds, for all of them together
+    :param waits: awaitables that return True when their condition is met, like AsyncEnvironment.wait_for_ptt()
+    :return: True when all conditions were met in time
+    """
+    tasks = [asyncio.ensure_future(wait) for wait in waits]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+    finally:
+        for task in tasks:
+            task.cancel()
+    return not pending and all(task.result() for task in done)
+
+
+async def any_within(timeout, *waits):
+    """
+    wait for the first of several conditions
+    :param timeout: in seconds
+    :param waits: awaitables that return True when their condition is met
+    :return: the index of the first condition that was met, or None
+    """
+    tasks = [asyncio.ensure_future(wait) for wait in waits]
+    deadline = monotonic() + timeout
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=max(0, deadline - monotonic()),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                return None
+            met = [tasks.index(task) for task in done if task.result()]
+            if met:
+                return min(met)
+        return None
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def in_order_within(timeout, *waits):
+    """
+    wait for conditions one after another: this, then that, all within one deadline
+    :param timeout: in seconds, for all of them together
+    :param waits: awaitables that return True when their condition is met, each is only started after the one before
+    :return: True when all conditions were met in order and in time
+    """
+    deadline = monotonic() + timeout
+    waits = list(waits)
+    try:
+        while waits:
+            wait = waits.pop(0)
+            try:
+                if not await asyncio.wait_for(wait, max(0, deadline - monotonic())):
+                    return False
+            except asyncio.TimeoutError:
+                return False
+        return True
+    finally:
+        for wait in waits:
+            # never awaited, close them so they don't warn
+            if asyncio.iscoroutine(wait):
+                wait.close()
+
+
+class AsyncEnvironment:
+    """
+    Wraps an Environment for use from asyncio.
+
+    The waits have an optional timeout, without one they wait until they are cancelled,
+    like all_within() does when its deadline passes.
+    """
+
+    def __init__(self, env):
+        self.log = logging.getLogger(__class__.__name__)
+        self.env = env
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aioenv-" + env.stack.name)
+        self._loop = None
+        self._waiters = set()
+        self.env.watcher.add_listener(self._on_change)
+
+    def close(self):
+        self.env.watcher.remove_listener(self._on_change)
+        self._executor.shutdown(wait=True)
+
+    def _on_change(self, name):
+        """
+        called from the watcher thread, wakes up the waiters on the loop
+        """
+        loop = self._loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            # the loop was closed, the next wait sets the new one
+            pass
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, set()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def run(self, function, *args, **kwargs):
+        """
+        call a function of the environment on its command thread, after the commands before it
+        :return: what the function returned
+        """
+        self._loop = asyncio.get_running_loop()
+        return await self._loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def wait_for(self, predicate, timeout=None):
+        """
+        wait until predicate() returns True, evaluating it only when a capture has changed
+        :param predicate: function without arguments, evaluated on the loop
+        :param timeout: in seconds, or None to wait until cancelled
+        :return: True when the predicate became True, False on timeout
+        """
+        self._loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            if predicate():
+                return True
+            remaining = None if deadline is None else deadline - monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if not self.env.watcher.running:
+                # nothing will wake us, so check again after a poll interval
+                remaining = min(remaining or self.env.watcher.poll_interval, self.env.watcher.poll_interval)
+            waiter = self._loop.create_future()
+            self._waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters.discard(waiter)
+
+    async def wait_for_ptt(self, state: bool, timeout=None):
+        return await self.wait_for(lambda: self.env.ptt_state == state, timeout)
+
+    async def wait_for_ptt_off(self, timeout=None):
+        return await self.wait_for(lambda: self.env.ptt_state is not True, timeout)
+
+    async def wait_for_idle(self, timeout=None):
+        return await self.wait_for(lambda: self.env.idle, timeout)
+
+    async def wait_for_remote_state(self, name: str, state: str, expected: any, timeout=None):
+        return await self.wait_for(lambda: self.env.voter_state.get(name, {}).get(state) == expected, timeout)
+
+    async def wait_for_remote_by_tone(self, name: str, timeout=None):
+        return await self.wait_for(lambda: self.env.active_remote_by_tone == name, timeout)
+
+    async def start(self):
+        return await self.run(self.env.start)
+
+    async def stop(self):
+        return await self.run(self.env.stop)
+
+    async def open_squelch(self, name, state=True):
+        return await self.run(self.env.open_squelch, name, state)
+
+    async def enable_remote(self, name):
+        return await self.run(self.env.enable_remote, name)
+
+    async def disable_remote(self, name):
+        return await self.run(self.env.disable_remote, name)
+
+    async def reset(self):
+        return await self.run(self.env.reset)
+
+    async def fast_reset(self, timeout: float = 10):
+        """
+        like Environment.fast_reset, waiting for the voter to go idle on the loop
+        :param timeout: in seconds
+        :return: True when the stack is idle
+        """
+        await self.reset()
+        if not await self.wait_for_idle(timeout):
+            self.log.error("voter didn't go idle after reset")
+            return False
+        await self.run(self.env.truncate_captures, idle=True)
+        return True
@@ -0,0 +1,284 @@
+"""
+This module benchmarks the hot paths of the harness, without docker: the tone detection in goertzel.py,
+parsing the state and ptt captures, and reading the audio ring, on synthetic data.
+
+The results can be saved as a baseline, later runs fail when a benchmark got slower than the baseline by more than
+the threshold. Baselines depend on the machine, so they are kept under runs/ by default.
+
+Usage:
+    python benchmark.py --save              # record a baseline
+    python benchmark.py                     # compare against it, exit code 1 on a regression
+    python benchmark.py --quick -k goertzel # skip the 100 MB captures, only run matching benchmarks
+"""
+import argparse
+from collections import OrderedDict
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from time import perf_counter
+
+import numpy as np
+
+from environment import Environment
+from goertzel import (AudioRing, SignatureDecoder, SpectrumAnalyzer, ToneTracker, convert_interleaved_to_windowed,
+                      decode_pcm, find_closest_number, goertzel, tone_bank)
+from stack import ROOT, Stack
+from stateparser import StateHistory
+from topology import Topology
+
+BASELINE = os.path.join(ROOT, "runs", "benchmarks", "baseline.json")
+SAMPLE_RATE = 16000
+KB = 1024
+MB = 1024 * KB
+CAPTURE_SIZES = [KB, MB, 100 * MB]
+# how much slower than the baseline a benchmark may get, microbenchmarks on a busy machine easily vary by 30%
+THRESHOLD = 1.5
+
+STATE_LINES = [
+    '{:.3f} Voter:sql_state [{{"active": true, "enabled": true, "id": "?", "name": "remote1", "siglev": 1000, '
+    '"sql_open": true}}, {{"active": false, "enabled": true, "id": "?", "name": "remote2", "siglev": 30, '
+    '"sql_open": true}}]\n',
+    '{:.3f} Voter:sql_state [{{"active": false, "enabled": true, "id": "?", "name": "remote1", "siglev": 1000, '
+    '"sql_open": false}}, {{"active": true, "enabled": true, "id": "?", "name": "remote2", "siglev": 30, '
+    '"sql_open": true}}]\n',
+]
+OLD_STATE = "remote1*+1000 remote2:+030"
+
+
+def measure(function, repeat=5, min_time=0.05):
+    """
+    time a function like timeit does: call it often enough to take at least `min_time`, a few times over
+    :param function: without arguments
+    :param repeat: the number of rounds
+    :param min_time: in seconds, per round
+    :return: the best time per call, in seconds
+    """
+    start = perf_counter()
+    function()
+    single = perf_counter() - start
+    if single > 1.0:
+        # slow enough to measure every call on its own
+        return min([single] + [timed(function, 1) for _ in range(min(repeat, 2) - 1)])
+    number = max(1, int(min_time / max(single, 1e-7)))
+    return min(timed(function, number) for _ in range(repeat))
+
+
+def timed(function, number):
+    start = perf_counter()
+    for _ in range(number):
+        function()
+    return (perf_counter() - start) / number
+
+
+def pcm(frames, freq=600):
+    """
+    16 bit, 2 channel interleaved audio with a tone on the first channel
+    """
+    samples = np.zeros((frames, 2), dtype="<i2")
+    samples[:, 0] = 10000 * np.sin(2 * np.pi * freq * np.arange(frames) / SAMPLE_RATE)
+    return samples.tobytes()
+
+
+def size_name(size):
+    if size >= MB:
+        return "{}MB".format(size // MB)
+    return "{}KB".format(size // KB)
+
+
+class BenchEnvironment(Environment):
+    """
+    an environment on capture files only, without docker
+    """
+    backend = "bench"
+
+    def connect(self):
+        return None
+
+
+def detection_benchmarks():
+    benchmarks = OrderedDict()
+    ranges = {"26bins": ((200, 400), (500, 700)), "250bins": ((100, 4000),)}
+    for window_size in (256, 1024, 4096):
+        samples = np.hamming(window_size) * np.frombuffer(pcm(window_size), dtype="<i2")[::2]
+        for name, freqs in ranges.items():
+            benchmarks["goertzel[{}-{}]".format(window_size, name)] = \
+                lambda samples=samples, freqs=freqs: goertzel(samples, SAMPLE_RATE, *freqs)
+    for count in (2, 16, 64):
+        bank = tone_bank(SAMPLE_RATE, 1024, tuple(sorted(Topology.generate(count).tones)))
+        windowed = convert_interleaved_to_windowed(pcm(1024), 1024)
+        benchmarks["tone_bank[{}]".format(count)] = lambda bank=bank, windowed=windowed: bank.dominant(windowed)
+        tones = sorted(Topology.generate(count).tones)
+        benchmarks["find_closest_number[{}]".format(count)] = lambda tones=tones: find_closest_number(612.5, tones)
+        decoder = SignatureDecoder(SAMPLE_RATE, {tone: (tone,) for tone in tones})
+        window = np.frombuffer(pcm(decoder.window_size), dtype="<i2")[::2]
+        benchmarks["SignatureDecoder.decode[{}]".format(count)] = lambda decoder=decoder, window=window: \
+            decoder.decode(window)
+    datagram = np.frombuffer(pcm(320), dtype="<i2")[::2]
+    for hop in (1, 16):
+        tracker = ToneTracker(SAMPLE_RATE, 512, (300, 600), hop=hop)
+        benchmarks["ToneTracker.feed[hop{}]".format(hop)] = lambda tracker=tracker: tracker.feed(datagram)
+    analyzer = SpectrumAnalyzer(SAMPLE_RATE, 1024, (300, 600))
+    second = decode_pcm(pcm(16 * 1024), None).T.reshape(2, -1, 1024)
+    benchmarks["SpectrumAnalyzer.analyze[1s]"] = lambda: analyzer.analyze(second)
+    for size in (256, 4 * KB, 64 * KB):
+        data = pcm(size // 4)
+        out = np.empty(size // 4, dtype=np.float32)
+        benchmarks["convert_interleaved_to_windowed[{}B]".format(size)] = \
+            lambda data=data, out=out: convert_interleaved_to_windowed(data, len(out), out=out)
+    return benchmarks
+
+
+def write_captures(directory, size):
+    """
+    write state and ptt captures of about `size` bytes each, and fill the audio ring
+    """
+    unit = "".join(line.format(1690000000.0 + index) for index, line in enumerate(STATE_LINES))
+    with open(os.path.join(directory, "state"), "w") as state:
+        state.write(unit * max(1, size // len(unit)))
+    with open(os.path.join(directory, "ptt"), "w") as ptt:
+        ptt.write("TR" * max(1, size // 2))
+    ring = AudioRing(os.path.join(directory, "audio"))
+    ring.create((300, 600))
+    for index in range(len(ring.records)):
+        ring.publish((300, 600)[index % 2], np.array([2.0, 1.0]))
+    return ring
+
+
+def capture_benchmarks(directory, sizes):
+    """
+    the environment properties the tests wait on, over captures of each size:
+    cold reads the whole capture, tail only what was appended since the last call
+    """
+    benchmarks = OrderedDict()
+    for size in sizes:
+        stack = Stack("bench")
+        stack.directory = os.path.join(directory, size_name(size))
+        os.makedirs(stack.directory, exist_ok=True)
+        ring = write_captures(stack.directory, size)
+        env = BenchEnvironment(stack)
+        readers = OrderedDict([
+            ("voter_state", (env.state_reader, STATE_LINES[0].format(1690000000.0))),
+            ("ptt_state", (env.ptt_reader, "T")),
+        ])
+        for prop, (reader, record) in readers.items():
+            def cold(env=env, reader=reader, prop=prop):
+                reader.reset()
+                return getattr(env, prop)
+
+            def tail(env=env, reader=reader, prop=prop, record=record):
+                with open(reader.path, "a") as capture:
+                    capture.write(record)
+                return getattr(env, prop)
+            benchmarks["{}[cold-{}]".format(prop, size_name(size))] = cold
+            benchmarks["{}[tail-{}]".format(prop, size_name(size))] = tail
+
+    # the audio ring has a fixed size, so there are no cold variants: publish a record, then read it
+    def ring_latest(env=env, ring=ring):
+        ring.publish(300, np.array([2.0, 1.0]))
+        return env.active_remote_by_tone
+
+    def ring_read(env=env, ring=ring):
+        ring.publish(300, np.array([2.0, 1.0]))
+        return env.audio_ring.read()
+    benchmarks["active_remote_by_tone[ring]"] = ring_latest
+    benchmarks["AudioRing.read[ring]"] = ring_read
+    env = BenchEnvironment(Stack("bench"))
+    line = STATE_LINES[0].format(1690000000.0).strip()
+    benchmarks["parse_old_state"] = lambda: env.parse_old_state(OLD_STATE)
+    benchmarks["parse_state_line[json]"] = lambda: env.parse_state_line(line)
+    state = os.path.join(directory, size_name(sizes[min(1, len(sizes) - 1)]), "state")
+    benchmarks["StateHistory.from_file[{}]".format(size_name(os.path.getsize(state)))] = \
+        lambda: StateHistory.from_file(state)
+    return benchmarks
+
+
+def run(benchmarks, keyword=None, log=print):
+    """
+    :return: the best time per call in seconds, per benchmark name
+    """
+    results = OrderedDict()
+    for name, function in benchmarks.items():
+        if keyword and keyword not in name:
+            continue
+        results[name] = measure(function)
+        log("{:48} {:>12}".format(name, format_time(results[name])))
+    return results
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.2f}{}".format(seconds / scale, unit)
+    return "{:.0f}ns".format(seconds / 1e-9)
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    :return: the benchmarks that got slower than the baseline by more than the threshold, with their ratio
+    """
+    regressions = OrderedDict()
+    for name, seconds in results.items():
+        if name in baseline and seconds > baseline[name] * threshold:
+            regressions[name] = seconds / baseline[name]
+    return regressions
+
+
+def save(results, path):
+    """
+    add the results to the baseline, keeping those of benchmarks that didn't run
+    """
+    baseline = {}
+    if os.path.exists(path):
+        with open(path) as stored:
+            baseline = json.load(stored)
+    baseline.update(results)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as output:
+        json.dump(baseline, output, indent=2)
+    print("saved {} results to {}".format(len(results), path))
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="benchmark the detection and parsing hot paths")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help="allowed slowdown, as a ratio")
+    parser.add_argument("--quick", action="store_true", help="skip the 100 MB captures")
+    parser.add_argument("-k", dest="keyword", help="only run benchmarks with this in their name")
+    args = parser.parse_args()
+
+    sizes = [size for size in CAPTURE_SIZES if not args.quick or size < 100 * MB]
+    if not args.save and not os.path.exists(args.baseline):
+        # without a baseline nothing can be compared, that shouldn't pass for a run without regressions
+        print("no baseline at {}, nothing was checked: run with --save first".format(args.baseline), file=sys.stderr)
+        sys.exit(2)
+    directory = tempfile.mkdtemp(prefix="svx-bench-")
+    try:
+        benchmarks = detection_benchmarks()
+        if not args.keyword or not any(args.keyword in name for name in benchmarks):
+            benchmarks.update(capture_benchmarks(directory, sizes))
+        results = run(benchmarks, args.keyword)
+        if args.save:
+            save(results, args.baseline)
+            return
+        with open(args.baseline) as stored:
+            baseline = json.load(stored)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            # measure once more, to rule out noise
+            print("measuring {} slower benchmarks again".format(len(regressions)))
+            again = run(OrderedDict((name, benchmarks[name]) for name in regressions))
+            regressions = compare({name: min(results[name], again[name]) for name in again}, baseline, args.threshold)
+    finally:
+        shutil.rmtree(directory)
+    for name, ratio in regressions.items():
+        print("REGRESSION {}: {:.2f}x slower than the baseline".format(name, ratio))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+This module reads the capture files (state, ptt, audio) incrementally.
+The files grow for the whole run, so instead of reading them completely, only the bytes written since the last read
+are parsed, and the latest record is kept in memory.
+"""
+import logging
+import os
+from threading import Lock
+
+from tracing import tracer
+
+
+class TailReader:
+    """
+    Follows a capture file, remembering how far it has been read.
+
+    In line mode, only complete lines are returned, a partial trailing line is kept until the rest of it is written.
+    In character mode (lines=False), every character is a record, which is how svxlink writes the PTT state.
+    When the file is truncated or replaced (like scripts/create-IO.sh does), reading starts over from the beginning.
+
+    Example of usage :
+
+        reader = TailReader("state", parse=parse_state_line)
+        new_lines = reader.poll()
+        state = reader.latest
+    """
+
+    def __init__(self, path, parse=None, lines=True, on_records=None):
+        self.log = logging.getLogger(__class__.__name__)
+        self.path = path
+        self.parse = parse or (lambda record: record)
+        self.lines = lines
+        self.on_records = on_records
+        self.lock = Lock()
+        self.latest = None
+        self.bytes_read = 0
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+
+    def reset(self):
+        """
+        forget everything read so far, the next poll starts at the beginning of the file
+        :return:
+        """
+        with self.lock:
+            self._close()
+            self.latest = None
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if self._file:
+            self._file.close()
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+
+    def _open(self):
+        """
+        (re)open the file when it was replaced, and start over when it was truncated
+        :return: True when the file can be read
+        """
+        try:
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            self._close()
+            return False
+        if info.st_ino != self._inode:
+            self._close()
+            self._file = open(self.path, "rb")
+            self._inode = info.st_ino
+        elif info.st_size < self._offset:
+            self.log.debug("%s was truncated, reading from the start", self.path)
+            self._offset = 0
+            self._partial = b""
+        return True
+
+    def poll(self):
+        """
+        read the data written since the last poll, and update `latest`
+        :return: a list of new records: complete lines, or characters in character mode
+        """
+        with self.lock, tracer().span("read " + os.path.basename(self.path), "read") as span:
+            if not self._open():
+                return []
+            self._file.seek(self._offset)
+            data = self._file.read()
+            self._offset += len(data)
+            self.bytes_read += len(data)
+            span.args["bytes"] = len(data)
+            if not data:
+                return []
+
+            if not self.lines:
+                records = list(data.decode(errors="replace"))
+            else:
+                data = self._partial + data
+                end = data.rfind(b"\n") + 1
+                self._partial = data[end:]
+                records = [line for line in data[:end].decode(errors="replace").splitlines() if line]
+            if records:
+                self.latest = self.parse(records[-1])
+                if self.on_records:
+                    # still under the lock, so records are handed over in order, whichever thread polls
+                    self.on_records(records)
+            return records
@@ -0,0 +1,171 @@
+"""
+This module keeps handles to the containers and a long-lived shell in each of them,
+so controlling the squelch of a remote or sending a command to the voter is a single write,
+instead of listing the containers and starting a new exec for every command.
+"""
+import logging
+import re
+from threading import Condition, Lock, Thread
+
+from tracing import tracer
+
+
+class ContainerCache:
+    """
+    Container handles by name, kept until a docker event says the container changed.
+
+    Example of usage :
+
+        cache = ContainerCache(client, events)
+        cache["svxlink"].exec_run("ls")
+    """
+    invalidating_actions = ("create", "start", "restart", "die", "kill", "stop", "destroy", "rename")
+
+    def __init__(self, client, events=None):
+        self.log = logging.getLogger(__class__.__name__)
+        self.client = client
+        self.lock = Lock()
+        self._containers = None
+        if events:
+            events.add_listener(self.on_event)
+
+    def on_event(self, action, name):
+        if action in self.invalidating_actions:
+            self.invalidate()
+
+    def invalidate(self):
+        with self.lock:
+            self._containers = None
+
+    def all(self):
+        """
+        a dict of running containers, indexed by their names
+        :return:
+        """
+        with self.lock:
+            if self._containers is None:
+                with tracer().span("containers.list", "docker"):
+                    self._containers = {container.name: container for container in self.client.containers.list()}
+            return dict(self._containers)
+
+    def __getitem__(self, name):
+        containers = self.all()
+        if name not in containers:
+            # started after the last invalidation, or not running
+            self.invalidate()
+            containers = self.all()
+        return containers[name]
+
+
+class ControlChannel:
+    """
+    A shell running in a container, that reads commands from its stdin.
+    Several commands can be sent in one write, and the output of the shell is logged.
+    Every write ends with an echo of a numbered marker, and send() returns once the shell printed it, so commands
+    sent to different containers happen in the order they were sent, like with a synchronous exec.
+
+    Example of usage :
+
+        channel = ControlChannel(client, container)
+        channel.send("echo O > /tmp/sql")
+        channel.send("echo ENABLE remote1 > /dev/shm/voter", "echo ENABLE remote2 > /dev/shm/voter")
+    """
+
+    marker = re.compile(rb"__done_(\d+)")
+    # seconds to wait for the shell to run the commands of a write
+    timeout = 5.0
+
+    def __init__(self, client, container, shell="/bin/sh"):
+        self.log = logging.getLogger(__class__.__name__).getChild(container.name)
+        self.client = client
+        self.container = container
+        self.shell = shell
+        self.lock = Lock()
+        self._socket = None
+        self._reader = None
+        # the number of the last write, and of the last write the shell finished
+        self._sent = 0
+        self._done = 0
+        self._finished = Condition()
+
+    @property
+    def connected(self):
+        return self._socket is not None
+
+    def open(self):
+        with tracer().span("exec_start " + self.shell, "docker", container=self.container.name):
+            exec_id = self.client.api.exec_create(self.container.id, [self.shell], stdin=True, tty=False)
+            sock = self.client.api.exec_start(exec_id, socket=True)
+        # docker hands out a SocketIO wrapper, writes go to the raw socket
+        self._socket = getattr(sock, "_sock", sock)
+        self._reader = Thread(target=self._read, args=(self._socket,), name="control-{}".format(self.container.name), daemon=True)
+        self._reader.start()
+        self.log.debug("control channel open")
+
+    def _read(self, sock):
+        """
+        drain the (multiplexed) output of the shell, so it can't block on a full pipe
+        :param sock:
+        :return:
+        """
+        tail = b""
+        try:
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                self.log.debug("output: %r", data)
+                # a marker can be split over two reads, keep the end of the last one
+                output = tail + data
+                done = [int(number) for number in self.marker.findall(output)]
+                tail = output[-16:]
+                if done:
+                    with self._finished:
+                        self._done = max(self._done, *done)
+                        self._finished.notify_all()
+        except OSError:
+            pass
+        with self.lock:
+            if self._socket is sock:
+                self._socket = None
+        with self._finished:
+            self._finished.notify_all()
+
+    def send(self, *commands):
+        """
+        send one or more commands in a single write, opening the channel if needed, and wait for the shell to run them
+        :param commands: shell command lines
+        :return: True when the shell ran them within the timeout
+        """
+        with tracer().span("send", "control", container=self.container.name) as span:
+            with self.lock:
+                self._sent += 1
+                number = self._sent
+                data = "".join(command + "\n" for command in commands + ("echo __done_{}".format(number),)).encode()
+                span.args["bytes"] = len(data)
+                if self._socket is None:
+                    self.open()
+                try:
+                    self._socket.sendall(data)
+                except OSError as e:
+                    # the shell went away, try once more with a new one
+                    self.log.warning("control channel broken (%s), reopening", e)
+                    self.open()
+                    self._socket.sendall(data)
+            with self._finished:
+                finished = self._finished.wait_for(lambda: self._done >= number or not self.connected, self.timeout)
+            if not finished or self._done < number:
+                self.log.warning("shell didn't finish %s within %.1fs", commands, self.timeout)
+                return False
+            return True
+
+    def close(self):
+        with self.lock:
+            if self._socket is None:
+                return
+            try:
+                self._socket.sendall(b"exit\n")
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
@@ -2,44 +2,97 @@
 This module wraps around docker-compose and the various svxlink interfaces.
 It allows to control the remotes and voter, get statuses, and stop and start the containers.
 """
+from concurrent.futures import TimeoutError
 from datetime import datetime
 import docker
 import json
 import os
 import logging
-import re
-import select
-from subprocess import check_output, PIPE, Popen
-from threading import Thread
-from time import sleep
+from subprocess import check_output
+from time import sleep, time
+from capture import TailReader
+from control import ContainerCache, ControlChannel
+from logbus import LogBus
+from orchestrator import DockerEvents, ListenProbe, LogProbe, Orchestrator, PathProbe, Service
+from goertzel import SIGNATURE_VALUES, AudioRing, signature_label
+from latency import LatencyRecorder
+from stack import REMOTE_LISTEN_PORT, Stack
+from stateparser import StateHistory, StateParser, parse_old
+from timeline import Timeline
+from tracing import tracer
+from watcher import FileWatcher
 
 
 class Environment:
-    remote_tones = {
-        300: "remote1",
-        600: "remote2",
-    }
-    compose_logger_process = None
+    backend = "docker"
 
-    def __init__(self):
+    def __init__(self, stack=None):
         self.log = logging.getLogger(__class__.__name__)
-        self.client = docker.from_env()
+        self.client = self.connect()
         self.branch = os.environ.get("BRANCH", "hobbyscoop")
+        self.stack = stack or Stack.from_env()
+        self.remotes = self.stack.topology.names
+        self.remote_tones = self.stack.topology.tones
+        self.watcher = FileWatcher(self.stack.directory, ["state", "ptt", "audio"])
+        self.logs = LogBus()
+        self.events = DockerEvents(self.client)
+        self.events.add_listener(self.on_container_event)
+        self.container_cache = ContainerCache(self.client, self.events)
+        self.channels = {}
+        self.startup_timings = {}
+        self.state_parser = StateParser()
+        self.latency = LatencyRecorder(self.backend)
+        self.state_reader = TailReader(self.stack.capture_path("state"), parse=self.parse_state_line,
+                                       on_records=self.on_state_records)
+        self.ptt_reader = TailReader(self.stack.capture_path("ptt"), parse=self.parse_ptt, lines=False,
+                                     on_records=self.on_ptt_records)
+        self.audio_ring = AudioRing(self.stack.capture_path("audio"))
+        self.spectrum_reader = TailReader(self.stack.capture_path("spectrum"), on_records=self.on_spectrum_records)
+        self.tone_events_reader = TailReader(self.stack.capture_path("tone_events"),
+                                             on_records=self.on_tone_event_records)
+        # what was read since the captures were truncated, for the timeline: the PTT edges with the time they were
+        # read, as the capture has no timestamps, and the audio records, as the ring wraps around
+        self.ptt_edges = []
+        self.audio_records = []
+        self.spectrum = []
+        self.tracked = []
+        # the voter was idle when the captures were truncated, so it still is until it reports a state
+        self.idle_at_truncate = False
+        self.watcher.add_listener(self.on_capture_changed)
 
-    def compose_logger(self):
+    def connect(self):
         """
-        prints the output of the containers into the log
+        returns the docker client to control the containers with
         :return:
         """
-        with Popen(["docker-compose", "logs", "-f", "--no-color"], stdout=PIPE, universal_newlines=True) as proc:
-            self.log.info("Started log tailing")
-            while proc.poll() is None:
-                # use select to check if there is data available to read
-                readable, _, _ = select.select([proc.stdout], [], [], 0)
-                if proc.stdout in readable:
-                    # read and print all available output
-                    for line in iter(proc.stdout.readline, ''):
-                        self.log.getChild("docker-compose").info(line.strip())
+        return docker.from_env()
+
+    @property
+    def compose_command(self):
+        return self.stack.compose_command(self.branch)
+
+    @property
+    def startup_waves(self):
+        """
+        the remotes are started first, so svxlink can connect to them right away
+        :return:
+        """
+        remotes = self.remotes
+        return [
+            [
+                Service(name, [ListenProbe(REMOTE_LISTEN_PORT)], self.stack.container_name(name))
+                for name in remotes
+            ],
+            [
+                Service("svxlink", [
+                    PathProbe("/dev/shm/state"),
+                    PathProbe("/dev/shm/ptt"),
+                ] + [
+                    LogProbe(self.logs, "172.17.0.1:{}: RemoteTrx protocol".format(self.stack.remote_port(name)))
+                    for name in remotes
+                ], self.stack.container_name("svxlink")),
+            ],
+        ]
 
     def start(self):
         """
@@ -50,66 +103,118 @@ class Environment:
         if self.running > 0:
             self.log.warning("instances already running, stopping them first")
             self.stop()
-        self.log.debug("running docker-compose up -d")
-        check_output(["docker-compose", "-f", "docker-compose.yaml", "-f", "docker-compose-{}.yaml".format(self.branch), "up", "-d", "remote1"])
-        check_output(["docker-compose", "-f", "docker-compose.yaml", "-f", "docker-compose-{}.yaml".format(self.branch), "up", "-d", "remote2"])
-        check_output(["docker-compose", "-f", "docker-compose.yaml", "-f", "docker-compose-{}.yaml".format(self.branch), "up", "-d", "svxlink"])
-        self.compose_logger_process = Thread(target=self.compose_logger)
-        self.compose_logger_process.start()
-        while self.running != 3:
-            self.log.debug("waiting for containers to start...")
-            sleep(1)
+        with tracer().span("render", "setup"):
+            self.stack.render(self.branch)
+        self.events.start()
+        self.watcher.start()
+        orchestrator = Orchestrator(self.client, self.events, self.logs, self.compose_command)
+        ready = orchestrator.up(self.startup_waves)
+        self.startup_timings = orchestrator.timings
+        if not ready:
+            self.log.error("timeout waiting for the containers to become ready")
+            return False
 
         # start sidecars
+        self.audio_ring.close()
         self.start_pty_forwarder("state")
         self.start_pty_forwarder("ptt")
-        self.containers["svxlink"].exec_run("/usr/bin/python3 /goertzel.py", detach=True)
-
-        self.log.info("waiting for remotes to connect")
-        if not self.wait_for_find_in_logs("svxlink", "172.17.0.1:5211: RemoteTrx protocol", 5):
-            self.log.error("timeout waiting for remote1 to connect to svxlink")
-            return False
-        if not self.wait_for_find_in_logs("svxlink", "172.17.0.1:5212: RemoteTrx protocol", 5):
-            self.log.error("timeout waiting for remote1 to connect to svxlink")
-            return False
+        tones = " ".join(str(tone) for tone in self.remote_tones)
+        with tracer().span("exec_run goertzel.py", "docker"):
+            self.container("svxlink").exec_run("/usr/bin/python3 /goertzel.py --track 16 --tones {}".format(tones),
+                                               detach=True)
         self.log.info("startup done")
         return True
 
     def find_in_logs(self, container: str, term: str):
-        logs = check_output(["docker-compose", "logs", "--no-color", "--no-log-prefix", container])
-        return logs.find(bytes(term, 'utf-8'))
+        """
+        check if a term was logged by a container, in the lines buffered by the log bus
+        :param container:
+        :param term:
+        :return:
+        """
+        return self.logs.find(self.stack.container_name(container), term)
 
-    def wait_for_find_in_logs(self, container: str, term: str, timeout: int):
-        start = datetime.now()
-        while (datetime.now() - start).seconds < timeout:
-            if self.find_in_logs(container, term):
-                return True
-        return False
+    def wait_for_find_in_logs(self, container: str, terms, timeout: float, regex=False):
+        """
+        wait for any of the terms to be logged by a container
+        :param container:
+        :param terms: a term, or a list of terms
+        :param timeout: in seconds
+        :param regex: treat the terms as regular expressions
+        :return: the LogMatch for the first matching line, or None on timeout
+        """
+        future = self.logs.expect(self.stack.container_name(container), terms, regex)
+        try:
+            with tracer().span("wait_for_find_in_logs", "wait", timeout=timeout):
+                match = future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            return None
+        self.log.debug("found in logs: %s", match)
+        return match
 
     @property
     def running(self):
         """
-        check for all containers to be running
+        check for all containers of this stack to be running
         :return: the number of containers with status running
         """
-        return sum([c[1].status == "running" for c in self.containers.items()])
+        with tracer().span("containers.list", "docker"):
+            containers = self.client.containers.list()
+        return sum([container.status == "running" for container in containers if self.stack.service_name(container.name)])
 
     def stop(self):
         self.log.info("stopping instances")
-        check_output(["docker-compose", "down"])
+        self.watcher.stop()
+        self.logs.stop()
+        self.close_channels()
+        with tracer().span("compose down", "subprocess"):
+            check_output(self.compose_command + ["down"])
+        self.events.stop()
 
     @property
     def containers(self):
         """
-        presents a dict of containers, indexed by their names
+        presents a dict of the containers of this stack, indexed by their service names
+        the handles are cached until docker events tell the containers changed
         :return:
         """
-        containers = self.client.containers.list()
         result = dict()
-        for container in containers:
-            result[container.name] = container
+        for name, container in self.container_cache.all().items():
+            service = self.stack.service_name(name)
+            if service:
+                result[service] = container
         return result
 
+    def container(self, name):
+        """
+        returns the container for a service name, like svxlink or remote1
+        :param name:
+        :return:
+        """
+        return self.container_cache[self.stack.container_name(name)]
+
+    def control(self, name):
+        """
+        returns the control channel of a container, a long-lived shell to send commands to
+        :param name: container name
+        :return:
+        """
+        if name not in self.channels:
+            self.channels[name] = ControlChannel(self.client, self.container(name))
+        return self.channels[name]
+
+    def close_channels(self, name=None):
+        for channel_name in list(self.channels):
+            if name is None or channel_name == name:
+                self.channels.pop(channel_name).close()
+
+    def on_container_event(self, action, container_name):
+        name = self.stack.service_name(container_name)
+        if action in ContainerCache.invalidating_actions and name in self.channels:
+            self.log.debug("%s: %s, closing its control channel", name, action)
+            self.close_channels(name)
+
     def start_pty_forwarder(self, name):
         """
         the PTY forwarder will read from the fifo and write to a normal file,
@@ -118,36 +223,221 @@ class Environment:
         :return:
         """
         self.log.debug("starting pty forwarder for {}".format(name))
-        self.containers["svxlink"].exec_run("/bin/bash -c \"cat /dev/shm/{name} > /{name}\"".format(name=name), detach=True)
+        # append, so the capture can be truncated from outside without the forwarder writing at its old offset
+        with tracer().span("exec_run forwarder " + name, "docker"):
+            self.container("svxlink").exec_run("/bin/bash -c \"cat /dev/shm/{name} >> /{name}\"".format(name=name),
+                                               detach=True)
+
+    @staticmethod
+    def squelch_command(state):
+        return "echo {state} > /tmp/sql".format(state="O" if state else "Z")
 
     def open_squelch(self, name, state=True):
-        if state:
-            state = "O"
+        self.log.info("setting squelch for {} to {}".format(name, "O" if state else "Z"))
+        self.latency.command("open_squelch" if state else "close_squelch", name)
+        self.control(name).send(self.squelch_command(state))
+
+    def voter_command(self, name, enable):
+        """
+        the command to enable or disable a remote, in the syntax of the branch
+        :param name: remote name
+        :param enable:
+        :return:
+        """
+        if self.branch == "old":
+            command = "{name}:{state}".format(name=name, state=1 if enable else 0)
         else:
-            state = "Z"
-        self.log.info("setting squelch for {} to {}".format(name, state))
-        self.containers[name].exec_run("/bin/bash -c \"echo {state} > /tmp/sql\"".format(state=state))
+            command = "{action} {name}".format(action="ENABLE" if enable else "MUTE", name=name)
+        return "echo {command} > /dev/shm/voter".format(command=command)
 
     def enable_remote(self, name):
         self.log.info("enabling {}".format(name))
-        if os.environ.get("BRANCH") == "old":
-            self.containers["svxlink"].exec_run("/bin/bash -c \"echo {name}:1 > /dev/shm/voter\"".format(name=name))
-        else:
-            self.containers["svxlink"].exec_run("/bin/bash -c \"echo ENABLE {name} > /dev/shm/voter\"".format(name=name))
+        self.latency.command("enable_remote", name)
+        self.control("svxlink").send(self.voter_command(name, True))
 
     def disable_remote(self, name):
         self.log.info("disabling {}".format(name))
-        if os.environ.get("BRANCH") == "old":
-            self.containers["svxlink"].exec_run("/bin/bash -c \"echo {name}:0 > /dev/shm/voter\"".format(name=name))
-        else:
-            self.containers["svxlink"].exec_run("/bin/bash -c \"echo MUTE {name} > /dev/shm/voter\"".format(name=name))
+        self.latency.command("disable_remote", name)
+        self.control("svxlink").send(self.voter_command(name, False))
 
     def reset(self):
         self.log.info("resetting test env")
-        self.open_squelch("remote1", False)
-        self.open_squelch("remote2", False)
-        self.enable_remote("remote1")
-        self.enable_remote("remote2")
+        for name in self.remotes:
+            self.open_squelch(name, False)
+        self.control("svxlink").send(*[self.voter_command(name, True) for name in self.remotes])
+
+    def truncate_captures(self, idle=False):
+        """
+        empty the state and ptt captures, and start reading them from the beginning.
+        The audio ring has a fixed size and is mapped by the detector, so only what is in it so far is skipped.
+        :param idle: the voter is idle, see idle, so it counts as idle until it prints a new state
+        :return:
+        """
+        for reader in (self.state_reader, self.ptt_reader, self.spectrum_reader, self.tone_events_reader):
+            os.truncate(reader.path, 0)
+            reader.reset()
+        self.audio_ring.reset()
+        self.latency.reset()
+        self.ptt_edges = []
+        self.audio_records = []
+        self.spectrum = []
+        self.tracked = []
+        self.idle_at_truncate = idle
+
+    def on_capture_changed(self, name):
+        """
+        read a capture as soon as it changes, so the effects of commands are timestamped when they happen,
+        not when a test happens to look
+        :param name: state, ptt or audio
+        :return:
+        """
+        if name == "audio":
+            with tracer().span("read audio ring", "read") as span:
+                records = self.audio_ring.read()
+                span.args["bytes"] = records.nbytes if records is not None else 0
+            self.on_audio_records(records)
+            return
+        reader = {"state": self.state_reader, "ptt": self.ptt_reader}.get(name)
+        if reader:
+            reader.poll()
+
+    def on_state_records(self, lines):
+        # only the lines up to the first measured effects matter, after that only the latest one does
+        for line in lines:
+            if not self.latency.waiting("state") and not self.latency.waiting("active"):
+                break
+            self.state_effects(line, self.latency.effect)
+        self.state_effects(lines[-1], lambda kind, value, reported: self.latency.settle(kind, value))
+
+    def state_effects(self, line, effect):
+        state = self.parse_state_line(line)
+        if not state:
+            return
+        remotes = [value for key, value in state.items() if key != "time"]
+        reported = state["time"].timestamp()
+        effect("state", tuple((remote.name, remote.enabled, remote.sql_open, remote.active) for remote in remotes),
+               reported)
+        effect("active", next((remote.name for remote in remotes if remote.active), None), reported)
+
+    def on_ptt_records(self, chars):
+        now = time()
+        for char in chars:
+            state = self.parse_ptt(char)
+            if state is not None and (not self.ptt_edges or self.ptt_edges[-1][1] != state):
+                self.ptt_edges.append((now, state))
+        for char in chars:
+            if not self.latency.waiting("ptt"):
+                break
+            state = self.parse_ptt(char)
+            if state is not None:
+                self.latency.effect("ptt", state)
+        state = self.parse_ptt(chars[-1])
+        if state is not None:
+            self.latency.settle("ptt", state)
+
+    def on_audio_records(self, records):
+        if records is None or not len(records):
+            return
+        self.audio_records.append(records[["time", "tone"]])
+        # only a remote being heard is an effect, the silence or mix around a switch isn't
+        for record in records:
+            if not self.latency.waiting("tone"):
+                break
+            remote = self.parse_tone(record["tone"])
+            if remote not in SIGNATURE_VALUES:
+                self.latency.effect("tone", remote, float(record["time"]))
+        self.latency.settle("tone", self.parse_tone(records[-1]["tone"]))
+
+    def on_spectrum_records(self, lines):
+        for line in lines:
+            try:
+                self.spectrum.append(json.loads(line))
+            except ValueError:
+                self.log.warning("can't parse spectrum summary: %s", line)
+
+    def spectrum_summaries(self, channel=None):
+        """
+        the spectrum summaries of the audio since the captures were truncated, one per second and channel
+        :param channel: 0 or 1, or None for both
+        :return: a list of dicts, see SpectrumAnalyzer
+        """
+        self.spectrum_reader.poll()
+        return [summary for summary in self.spectrum if channel is None or summary["channel"] == channel]
+
+    def on_tone_event_records(self, lines):
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                self.log.warning("can't parse tone event: %s", line)
+                continue
+            event["remotes"] = [self.remote_tones.get(tone, tone) for tone in event["tones"]]
+            self.tracked.append(event)
+
+    def tone_events(self, kind=None):
+        """
+        the tone changes the detector tracked since the captures were truncated, with wall clock start and end,
+        like the switches of the voter from one remote to another, to the millisecond
+        :param kind: start, stop, switch, gap or overlap, or None for all
+        :return: a list of dicts, see ToneEvent.as_dict, with the remote of each tone added as remotes
+        """
+        self.tone_events_reader.poll()
+        return [event for event in self.tracked if kind is None or event["kind"] == kind]
+
+    def fast_reset(self, timeout: float = 10):
+        """
+        bring a running stack back to a clean baseline, without restarting it:
+        all squelches closed, all remotes enabled, the transmitter off and empty captures
+        :param timeout: in seconds, to wait for the voter to go idle
+        :return: True when the stack is idle
+        """
+        self.reset()
+        # the commands are only written, wait for the voter to act on them before the captures are emptied
+        if not self.wait_for_idle(timeout):
+            self.log.error("voter didn't go idle after reset: %s, ptt %s", self.voter_state, self.ptt_state)
+            return False
+        self.truncate_captures(idle=True)
+        return True
+
+    @property
+    def idle(self):
+        """
+        True when the voter reports every remote enabled, with its squelch closed and not active,
+        and the transmitter isn't on.
+        svxlink only prints a state when something changes, so without a state since an idle truncation it still is.
+        """
+        state = self.voter_state
+        if not state and self.idle_at_truncate:
+            return self.ptt_state is not True
+        for name in self.remotes:
+            remote = state.get(name)
+            if remote is None or not remote.get("enabled") or remote.get("sql_open") or remote.get("active"):
+                return False
+        return self.ptt_state is not True
+
+    def wait_for_idle(self, timeout: float):
+        """
+        wait for the voter to be idle, see idle
+        :param timeout: in seconds
+        :return:
+        """
+        return self.watcher.wait_for(lambda: self.idle, timeout, "wait_for_idle")
+
+    def wait_for_ptt_off(self, timeout: float):
+        """
+        wait for the transmitter to be off, or to have no known state
+        :param timeout: in seconds
+        :return:
+        """
+        return self.watcher.wait_for(lambda: self.ptt_state is not True, timeout, "wait_for_ptt_off")
+
+    @staticmethod
+    def parse_ptt(char):
+        if char == "T":
+            return True
+        if char == "R":
+            return False
+        return None
 
     @property
     def ptt_state(self):
@@ -158,75 +448,49 @@ class Environment:
         - unknown: None
         :return:
         """
-        with open("ptt", "r") as ptt_file:
-            data = ptt_file.read()
-            if not data:
-                return None
-            state = data[-1]
-            if state == "T":
-                return True
-            if state == "R":
-                return False
-            return None
+        self.ptt_reader.poll()
+        return self.ptt_reader.latest
 
-    def wait_for_ptt(self, state: bool, timeout: int):
+    def wait_for_ptt(self, state: bool, timeout: float):
         """
         wait for a transmitter state, with a timeout
         :param state:
-        :param timeout:
+        :param timeout: in seconds
         :return:
         """
-        start = datetime.now()
-        while (datetime.now() - start).seconds < timeout:
-            if self.ptt_state == state:
-                return True
-        return False
+        return self.watcher.wait_for(lambda: self.ptt_state == state, timeout, "wait_for_ptt")
 
     def parse_old_state(self, data):
         """
         Try to parse the state info in the old format, or raise an exception
-        :param data:
+        :param data: like remote1*+1000 remote2_+030
+        :return: a list of dicts, one per remote
+        """
+        return [remote.as_dict() for remote in parse_old(data)]
+
+    def parse_state_line(self, line):
+        """
+        parses a line from the state file, in either the json or the old format
+        :param line: timestamp, source and state, separated by spaces
+        :return: the voter state as a dict of RemoteState by name, with an added timestamp field,
+                 or an empty dict if it can't be parsed
+        """
+        try:
+            timestamp, remotes = self.state_parser.parse_line(line)
+        except Exception as e:
+            self.log.error("failed parsing state with error: %s and data: %s", e, line)
+            return {}
+        result = {"time": datetime.fromtimestamp(timestamp)}
+        for remote in remotes:
+            result[remote.name] = remote
+        return result
+
+    def state_history(self):
+        """
+        parses the whole state capture at once, see StateHistory
         :return:
         """
-        status_options = {
-            "_": "closed",
-            ":": "open",
-            "*": "active",
-            "#": "off",
-        }
-        # old format support: remote1*+1000 remote2_+030
-        # "_": "closed",
-        # ":": "open",
-        # "*": "active",
-        # "#": "off",
-        # new format: {'active': False, 'enabled': True, 'id': '?', 'name': 'remote1', 'siglev': 0, 'sql_open': False}
-        states = []
-        for item in data.split(' '):
-            if len(item) < 4:
-                break
-            state = {"orig": item}
-            remote, info = re.split(r'[_:#*]', item)
-            state["name"] = remote
-            status = item[len(remote):len(remote)+1]
-            if status == "_":
-                state["enabled"] = True
-                state["sql_open"] = False
-                state["active"] = False
-            elif status == ":":
-                state["enabled"] = True
-                state["sql_open"] = True
-                state["active"] = False
-            elif status == "*":
-                state["enabled"] = True
-                state["sql_open"] = True
-                state["active"] = True
-            elif status == "#":
-                state["enabled"] = False
-            else:
-                raise ValueError("status wrong?", status)
-            state["siglev"] = int(info[1:])
-            states.append(state)
-        return states
+        return StateHistory.from_file(self.state_reader.path)
 
     @property
     def voter_state(self):
@@ -234,32 +498,10 @@ class Environment:
         returns the last complete(!) voter state as a dict, with an added timestamp field
         :return:
         """
+        self.state_reader.poll()
+        return self.state_reader.latest or {}
 
-        with open("state", "r") as state_file:
-            state_raw = state_file.read()
-            if len(state_raw) < 1:
-                # no data at all yet
-                return {}
-            if state_raw[-1] != '\n':
-                # last line isn't complete, take the one before
-                state_raw = state_raw.splitlines()[-2]
-            else:
-                state_raw = state_raw.splitlines()[-1]
-        timestamp, _, state_json = state_raw.split(' ', 2)
-        try:
-            state = json.loads(state_json)
-        except Exception as e:
-            try:
-                state = self.parse_old_state(state_json)
-            except Exception as e:
-                self.log.error("failed parsing state with error: %s and data: %s", e, state_json)
-                return {}
-        result = {"time": datetime.fromtimestamp(float(timestamp))}
-        for item in state:
-            result[item["name"]] = item
-        return result
-
-    def wait_for_remote_state(self, name: str, state: str, expected: any, timeout: int):
+    def wait_for_remote_state(self, name: str, state: str, expected: any, timeout: float):
         """
         wait for a remote to have state set to expected, with a timeout
         :param state: ["active", "enabled", "sql_open", "siglev", ]
@@ -268,41 +510,76 @@ class Environment:
         :param timeout: in seconds
         :return:
         """
-        start = datetime.now()
-        while (datetime.now() - start).seconds < timeout:
-            if self.voter_state.get(name, {}).get(state) == expected:
-                return True
-        return False
+        return self.watcher.wait_for(lambda: self.voter_state.get(name, {}).get(state) == expected, timeout,
+                                     "wait_for_remote_state")
+
+    def parse_tone(self, tone):
+        """
+        :param tone: a value from the audio ring
+        :return: the name of the remote with that tone, silence, mixed or unknown, or None for any other value
+        """
+        self.log.debug("Tone: %s", tone)
+        try:
+            label = signature_label(float(tone))
+        except ValueError:
+            return None
+        if label in SIGNATURE_VALUES:
+            return label
+        return self.remote_tones.get(int(round(label)), None)
 
     @property
     def active_remote_by_tone(self):
-        with open("audio", "r") as audio:
-            # ts, freq = audio.read().split(" ", 1)
-            try:
-                freq = audio.readlines()[-2]  # take the second last, so we're sure it's complete
-                self.log.debug("Tone: %s", freq)
-            except IndexError:
-                # self.log.warning("no audio data yet")
-                return None
-            return self.remote_tones.get(int(freq), None)
+        """
+        returns the name of the remote whose signature was decoded last in the audio ring,
+        or silence, mixed or unknown when no single remote was heard
+        :return:
+        """
+        with tracer().span("read audio ring", "read") as span:
+            record = self.audio_ring.latest()
+            span.args["bytes"] = record.nbytes if record is not None else 0
+        if record is None:
+            return None
+        return self.parse_tone(record["tone"])
+
+    def timeline(self, start=None, end=None):
+        """
+        the state, PTT and audio since the captures were truncated, merged in time to check properties over
+        :param start: wall clock time, defaults to the first thing recorded
+        :param end: wall clock time, defaults to the last thing recorded
+        :return: a Timeline
+        """
+        self.state_reader.poll()
+        self.ptt_reader.poll()
+        return Timeline.from_environment(self, start, end)
 
-    def wait_for_remote_by_tone(self, name: str, timeout: int):
+    def wait_for_remote_by_tone(self, name: str, timeout: float):
         """
         wait for a remote to be found by tone in the audio output
         :param name:
-        :param timeout:
+        :param timeout: in seconds
         :return:
         """
-        start = datetime.now()
-        while (datetime.now() - start).seconds < timeout:
-            if self.active_remote_by_tone == name:
-                return True
-        return False
+        return self.watcher.wait_for(lambda: self.active_remote_by_tone == name, timeout, "wait_for_remote_by_tone")
+
+
+def new_environment():
+    """
+    returns an environment for the backend in the BACKEND environment variable:
+    docker (the default) for the real containers, or sim for the pure-Python stand-in from simulator.py
+    :return:
+    """
+    backend = os.environ.get("BACKEND", "docker")
+    if backend == "sim":
+        from simulator import SimEnvironment
+        return SimEnvironment()
+    if backend != "docker":
+        raise ValueError("BACKEND should be docker or sim, not {}".format(backend))
+    return Environment()
 
 
 def main():
     logging.basicConfig(level=logging.INFO)
-    dc = Environment()
+    dc = new_environment()
     dc.start()
     dc.open_squelch("remote1")
     dc.wait_for_remote_by_tone("remote1", 5)
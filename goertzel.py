@@ -1,58 +1,86 @@
-from datetime import datetime
+import argparse
+import functools
+import json
 import logging
 import math
+import mmap
 import numpy as np
+import os
 import socket
-import struct
-from time import sleep
+from time import monotonic, time
 
-logging.basicConfig(filename="/log", level=logging.DEBUG)
 
-
-def convert_interleaved_to_windowed(raw_bytes, window_size):
+@functools.lru_cache(maxsize=8)
+def hamming_window(length):
     """
-    converts the 16 bit, 2 channel interleaved data from svxlink to a single windowed value array
-    :param raw_bytes: data coming from the socket
-    :param window_size: the window size to sample with
+    returns a read-only hamming window, cached per length so it's only computed once
+    :param length: the number of samples in the window
     :return:
     """
-    # convert the data stream into 2 byte samples
-    raw_data = struct.unpack('<%dh' % (len(raw_bytes) / 2), raw_bytes)
+    window = np.hamming(length).astype(np.float32)
+    window.flags.writeable = False
+    return window
 
-    # Reshape the interleaved samples into two separate channels
-    samples = np.array(raw_data).reshape((-1, 2))
 
-    # Extract the desired channel (e.g., left or right) - index 0 for left, 1 for right
-    channel = samples[:, 0]  # Modify the index if you want the other channel
+@functools.lru_cache(maxsize=4)
+def blackman_harris_window(length):
+    """
+    returns a read-only 4 term blackman-harris window, cached per length: its side lobes are 92 dB down,
+    so weak tones and harmonics next to a strong tone aren't buried in its leakage, as with the hamming window
+    :param length: the number of samples in the window
+    :return:
+    """
+    phase = 2.0 * np.pi * np.arange(length) / (length - 1)
+    window = (0.35875 - 0.48829 * np.cos(phase) + 0.14128 * np.cos(2 * phase) - 0.01168 * np.cos(3 * phase))
+    window = window.astype(np.float32)
+    window.flags.writeable = False
+    return window
 
-    # Apply a windowing function to the channel
-    window = np.hamming(len(channel))
-    window = np.pad(window, (0, max(0, window_size - len(window))), mode='constant')
-    windowed_signal = channel * window[:len(channel)]
 
-    return windowed_signal
+def decode_pcm(raw_bytes, channel=0):
+    """
+    views the 16 bit, 2 channel interleaved data from svxlink as samples, without copying it
+    :param raw_bytes: data coming from the socket, any bytes-like object
+    :param channel: 0 for left, 1 for right, None for both
+    :return: an int16 array of samples, with shape (frames, 2) when both channels are selected
+    """
+    frames = np.frombuffer(raw_bytes, dtype="<i2", count=len(raw_bytes) // 4 * 2).reshape((-1, 2))
+    if channel is None:
+        return frames
+    return frames[:, channel]
 
 
-def goertzel(samples, sample_rate, *freqs):
+def convert_interleaved_to_windowed(raw_bytes, window_size, channel=0, out=None):
     """
-    Implementation of the Goertzel algorithm, useful for calculating individual
-    terms of a discrete Fourier transform.
-
-    `samples` is a windowed one-dimensional signal originally sampled at `sample_rate`.
+    converts the 16 bit, 2 channel interleaved data from svxlink to a windowed value array
+    :param raw_bytes: data coming from the socket
+    :param window_size: the window size to sample with, the window always spans all received samples
+    :param channel: 0 for left, 1 for right, None for both
+    :param out: optional preallocated float32 array to write into, with room for all frames (and 2 rows for both channels)
+    :return: float32 windowed samples, with shape (2, frames) when both channels are selected
+    """
+    samples = decode_pcm(raw_bytes, channel)
+    if channel is None:
+        samples = samples.T
+    frames = samples.shape[-1]
+    window = hamming_window(frames)
+    if out is None:
+        out = np.empty(samples.shape, dtype=np.float32)
+    else:
+        out = out[..., :frames]
+    np.multiply(samples, window, out=out)
+    return out
 
-    The function returns 2 arrays, one containing the actual frequencies calculated,
-    the second the coefficients `(real part, imag part, power)` for each of those frequencies.
-    For simple spectral analysis, the power is usually enough.
 
-    Example of usage :
-        
-        freqs, results = goertzel(some_samples, 44100, (400, 500), (1000, 1100))
+def goertzel_bins(sample_rate, window_size, *freqs):
+    """
+    Calculate all the DFT bins we have to compute to include frequencies in `freqs`.
+    :param sample_rate: the sample rate of the signal
+    :param window_size: the number of samples per window
+    :param freqs: one or more (start, end) frequency ranges
+    :return: a sorted list of bin indexes
     """
-    window_size = len(samples)
     f_step = sample_rate / float(window_size)
-    f_step_normalized = 1.0 / window_size
-
-    # Calculate all the DFT bins we have to compute to include frequencies in `freqs`.
     bins = set()
     for f_range in freqs:
         f_start, f_end = f_range
@@ -61,27 +89,138 @@ def goertzel(samples, sample_rate, *freqs):
 
         if k_end > window_size - 1: raise ValueError('frequency out of range %s' % k_end)
         bins = bins.union(range(k_start, k_end))
+    return sorted(bins)
+
+
+class GoertzelBank:
+    """
+    Computes the Goertzel power of a fixed set of DFT bins for whole windows at once.
+
+    The Goertzel recurrence over a window ends in the same power as the DFT term for its bin,
+    so instead of running the recurrence sample by sample, the cosine and sine terms for every bin
+    are precomputed once, and the powers for all bins are a single matrix product.
+    This also works on a 2-D stack of windows, one window per row.
+
+    Example of usage :
+
+        bank = GoertzelBank(16000, 1024, (200, 400), (500, 700))
+        freq = bank.dominant(some_samples)
+    """
+
+    def __init__(self, sample_rate, window_size, *freqs):
+        self.sample_rate = sample_rate
+        self.window_size = window_size
+        self.bins = np.array(goertzel_bins(sample_rate, window_size, *freqs), dtype=np.float64)
+        self.frequencies = self.bins * sample_rate / float(window_size)
+        self._precompute()
+
+    def _precompute(self):
+        window_size = self.window_size
+        phase = 2.0 * np.pi * np.outer(self.bins, np.arange(window_size)) / window_size
+        # one row per bin, one column per sample; transposed so windows can be multiplied from the left
+        self._cos = np.ascontiguousarray(np.cos(phase).T)
+        self._sin = np.ascontiguousarray(np.sin(phase).T)
+        # float32 windows are multiplied in float32, so they don't need converting
+        self._cos32 = self._cos.astype(np.float32)
+        self._sin32 = self._sin.astype(np.float32)
+
+    def powers(self, samples):
+        """
+        calculate the power for every bin
+        :param samples: a window of `window_size` samples, or a 2-D stack of windows
+        :return: the power per bin, with an extra leading axis when a stack was passed in
+        """
+        samples = np.asarray(samples)
+        if samples.shape[-1] != self.window_size:
+            raise ValueError('expected windows of {} samples, got {}'.format(self.window_size, samples.shape[-1]))
+        if samples.dtype == np.float32:
+            real = samples @ self._cos32
+            imag = samples @ self._sin32
+        else:
+            samples = samples.astype(np.float64, copy=False)
+            real = samples @ self._cos
+            imag = samples @ self._sin
+        return real * real + imag * imag
 
-    # For all the bins, calculate the DFT term
-    n_range = range(0, window_size)
-    result = {}
-    for k in bins:
+    def dominant(self, samples):
+        """
+        find the frequency of the bin with the highest power
+        :param samples: a window of `window_size` samples, or a 2-D stack of windows
+        :return: the frequency, or an array of frequencies when a stack was passed in
+        """
+        powers = self.powers(samples)
+        index = np.argmax(powers, axis=-1)
+        if powers.ndim == 1:
+            return float(self.frequencies[index])
+        return self.frequencies[index]
 
-        # Bin frequency and coefficients for the computation
-        f = k * f_step_normalized
-        w_real = 2.0 * math.cos(2.0 * math.pi * f)
 
-        # Doing the calculation on the whole sample
-        d1, d2 = 0.0, 0.0
-        for n in n_range:
-            y = samples[n] + w_real * d1 - d2
-            d2, d1 = d1, y
+class ToneBank(GoertzelBank):
+    """
+    A GoertzelBank with exactly one bin per tone, centered on the tone instead of on a multiple of the bin width.
+    The dominant frequency is always one of the tones, so telling N tones apart is one matrix product with N columns,
+    instead of N ranges of bins and a search for the closest tone.
+
+    Example of usage :
 
-        # calculate the power for this bin
-        result[f * sample_rate] = d2 ** 2 + d1 ** 2 - w_real * d1 * d2
+        bank = ToneBank(16000, 1024, (300, 600, 900))
+        tone = bank.dominant(some_samples)
+    """
+
+    def __init__(self, sample_rate, window_size, tones):
+        self.sample_rate = sample_rate
+        self.window_size = window_size
+        self.tones = tuple(tones)
+        self.frequencies = np.array(self.tones, dtype=np.float64)
+        self.bins = self.frequencies * window_size / float(sample_rate)
+        if np.any(self.bins >= window_size / 2):
+            raise ValueError('tone above the nyquist frequency: %s' % max(self.tones))
+        self._precompute()
 
-    # return the frequency for the bucket with the highest power
-    return max(result, key=lambda x: result[x])
+    def dominant(self, samples):
+        """
+        find the tone with the highest power
+        :param samples: a window of `window_size` samples, or a 2-D stack of windows
+        :return: the tone as it was passed in, or an array of tones when a stack was passed in
+        """
+        index = np.argmax(self.powers(samples), axis=-1)
+        if np.ndim(index) == 0:
+            return self.tones[index]
+        return self.frequencies[index]
+
+
+@functools.lru_cache(maxsize=16)
+def tone_bank(sample_rate, window_size, tones):
+    """
+    returns a cached ToneBank
+    """
+    return ToneBank(sample_rate, window_size, tones)
+
+
+@functools.lru_cache(maxsize=16)
+def goertzel_bank(sample_rate, window_size, *freqs):
+    """
+    returns a cached GoertzelBank, so the coefficients are only computed once per configuration
+    """
+    return GoertzelBank(sample_rate, window_size, *freqs)
+
+
+def goertzel(samples, sample_rate, *freqs):
+    """
+    Implementation of the Goertzel algorithm, useful for calculating individual
+    terms of a discrete Fourier transform.
+
+    `samples` is a windowed one-dimensional signal originally sampled at `sample_rate`.
+
+    The function returns the frequency of the bin with the highest power, out of all bins in `freqs`.
+    The work is done by a cached `GoertzelBank`, which can also take a 2-D stack of windows.
+
+    Example of usage :
+        
+        freq = goertzel(some_samples, 44100, (400, 500), (1000, 1100))
+    """
+    freqs = tuple(tuple(f_range) for f_range in freqs)
+    return goertzel_bank(sample_rate, len(samples), *freqs).dominant(samples)
 
 
 def find_closest_number(target, numbers):
@@ -89,33 +228,972 @@ def find_closest_number(target, numbers):
     return closest_number
 
 
-if __name__ == '__main__':
-    SAMPLE_RATE = 16000
-    WINDOW_SIZE = 1024
+# what a SignatureDecoder reports when no single signature was heard, and how those are published in the audio ring
+SILENCE = "silence"
+MIXED = "mixed"
+UNKNOWN = "unknown"
+SIGNATURE_VALUES = {SILENCE: 0.0, MIXED: -1.0, UNKNOWN: -2.0}
+# the shortest window decoded, 8 ms at 16 kHz
+MIN_SIGNATURE_WINDOW = 128
+
+
+def signature_window(sample_rate, tones):
+    """
+    the shortest window in which the hamming window tells all tones apart: its main lobe is 4 bins wide
+    :param sample_rate:
+    :param tones: all tones of all signatures
+    :return: the number of samples
+    """
+    tones = sorted(set(tones))
+    spacing = min((high - low for low, high in zip(tones, tones[1:])), default=None)
+    if not spacing:
+        return MIN_SIGNATURE_WINDOW
+    return max(MIN_SIGNATURE_WINDOW, int(math.ceil(4 * sample_rate / float(spacing))))
+
+
+def signature_value(label):
+    """
+    :return: the value a decoded label is published as in the audio ring: the label itself for a remote's tone
+    """
+    return SIGNATURE_VALUES.get(label, label)
+
+
+def signature_label(value):
+    """
+    :return: silence, mixed or unknown for the values these are published as, otherwise the value itself
+    """
+    for label, published in SIGNATURE_VALUES.items():
+        if value == published:
+            return label
+    return value
+
+
+class SignatureDecoder:
+    """
+    Tells which remote is audible from a short window of audio, by the signature of each remote: a set of tones that
+    are all present, like a single tone or a pair of tones out of two groups, as DTMF does.
+    A pair out of two groups of N tones gives N * N signatures, so many remotes don't need closely spaced tones,
+    which would need long windows to tell apart.
+
+    Instead of the nearest signature, it reports:
+    - silence: the window has less than `level` RMS
+    - mixed: the tones of more than one signature are present, like while the voter switches remotes
+    - unknown: the tones present don't make a signature, or most of the energy is not in the tones (noise, speech)
+
+    Amplitudes are relative to that of a sine with all the energy of the window. A tone is present when its relative
+    amplitude is at least `presence`, and the present tones explain the window when their relative amplitudes add up
+    to at least `explained`. Adding up amplitudes instead of powers also explains a window in which one tone stops and
+    another starts: their amplitudes each scale with the part of the window they fill.
+
+    Example of usage :
+
+        decoder = SignatureDecoder(16000, {"remote1": (300,), "remote2": (600,)})
+        decoder.decode(some_samples)   # "remote1", or silence, mixed or unknown
+    """
+
+    def __init__(self, sample_rate, codes, window_size=None, level=300.0, presence=0.25, explained=0.75):
+        self.sample_rate = sample_rate
+        self.codes = {label: tuple(tones) for label, tones in codes.items()}
+        if not self.codes or not all(self.codes.values()):
+            raise ValueError("every signature needs at least one tone")
+        # the tones in the order they first appear, so single tone signatures keep the order they were given in
+        self.tones = tuple(dict.fromkeys(tone for tones in self.codes.values() for tone in tones))
+        column = {tone: index for index, tone in enumerate(self.tones)}
+        self._masks = {}
+        for label, tones in self.codes.items():
+            mask = sum(1 << column[tone] for tone in set(tones))
+            if mask in self._masks:
+                raise ValueError("signatures {} and {} have the same tones".format(self._masks[mask], label))
+            self._masks[mask] = label
+        shortest = signature_window(sample_rate, self.tones)
+        self.window_size = window_size or shortest
+        if self.window_size < shortest:
+            raise ValueError("a window of {} samples can't tell the tones apart, it needs {}".format(
+                self.window_size, shortest))
+        self.level = level
+        self.presence = presence
+        self.explained = explained
+        self.bank = tone_bank(sample_rate, self.window_size, self.tones)
+        self.window = hamming_window(self.window_size)
+        # a sine of amplitude A gives a power of (A * sum(w) / 2)^2, and an energy of A^2 / 2 * sum(w^2)
+        self._gain = float(np.sum(self.window, dtype=np.float64)) / 2.0
+        self._energy_gain = float(np.sum(self.window.astype(np.float64) ** 2))
+
+    def classify(self, powers, energy):
+        """
+        :param powers: the power per tone of a windowed window, from `bank`
+        :param energy: the sum of the squares of the windowed samples
+        :return: the label of the signature, or silence, mixed or unknown
+        """
+        mean_square = energy / self._energy_gain
+        if mean_square < self.level * self.level:
+            return SILENCE
+        relative = np.sqrt(powers / (2.0 * mean_square)) / self._gain
+        present = relative >= self.presence
+        if not present.any() or np.sum(relative[present]) < self.explained:
+            return UNKNOWN
+        mask = sum(1 << int(index) for index in np.flatnonzero(present))
+        if mask in self._masks:
+            return self._masks[mask]
+        covered = [code for code in self._masks if code & mask == code]
+        if len(covered) > 1 and functools.reduce(lambda left, right: left | right, covered) == mask:
+            return MIXED
+        return UNKNOWN
+
+    def decode(self, samples):
+        """
+        :param samples: a window of `window_size` samples, or a 2-D stack of windows
+        :return: the label, or a list of labels when a stack was passed in
+        """
+        windowed = np.asarray(samples, dtype=np.float32) * self.window
+        powers = self.bank.powers(windowed)
+        energies = np.einsum("...i,...i->...", windowed, windowed, dtype=np.float64)
+        if windowed.ndim == 1:
+            return self.classify(powers, float(energies))
+        return [self.classify(row, float(energy)) for row, energy in zip(powers, energies)]
+
+
+class SpectrumAnalyzer:
+    """
+    Checks the health of the whole band instead of a few tones: a real FFT over stacks of windows of both channels at
+    once gives, per window and channel:
+    - level_db: RMS in dB relative to full scale, peak and clipped: the highest sample and the samples at full scale
+    - dominant: the strongest frequency, interpolated between bins, and secondary with secondary_db relative to it
+    - thd_db: the power of the harmonics of the dominant frequency relative to its own
+    - snr_db: the power of the dominant frequency relative to all else, except its harmonics and DC
+    - hum_db: the power below 150 Hz relative to the total, like mains hum
+    - leakage_db: the strongest of `tones` other than the dominant one, relative to it, like the inactive remote
+    The ratios are NaN in silent windows.
+
+    `feed` collects the audio of an `interval` and summarizes it per channel, in a few numbers: the worst value of
+    each measure over the interval, which is what is streamed to the host.
+
+    Example of usage :
+
+        analyzer = SpectrumAnalyzer(16000, tones=(300, 600))
+        windows = analyzer.analyze(decode_pcm(data, None).T.reshape(2, -1, 1024))
+        summaries = analyzer.feed(decode_pcm(data, None))
+    """
+    # the bins on either side of a peak that belong to it: the main lobe of the blackman-harris window is 8 bins wide
+    lobe = 5
+    harmonics = 5
+    hum = 150.0
+    full_scale = 32768.0
+    silence_db = -60.0
+
+    def __init__(self, sample_rate, window_size=1024, tones=(), interval=1.0):
+        self.sample_rate = sample_rate
+        self.window_size = window_size
+        self.tones = np.array(sorted(tones), dtype=np.float64)
+        self.interval = interval
+        self.window = blackman_harris_window(window_size)
+        self.bins = np.arange(window_size // 2 + 1)
+        self.step = sample_rate / float(window_size)
+        # the windows of an interval, filled frame by frame
+        self._frames = int(round(interval * sample_rate / window_size)) * window_size
+        self._pending = np.zeros((self._frames, 2), dtype=np.int16)
+        self._fill = 0
+
+    def analyze(self, windows):
+        """
+        :param windows: samples with shape (..., window_size), like (channels, windows, window_size)
+        :return: a dict of arrays with the shape of the windows without the last axis, one per measure
+        """
+        samples = np.asarray(windows, dtype=np.float32)
+        magnitude = np.abs(samples)
+        rms = np.sqrt(np.mean(np.square(samples, dtype=np.float64), axis=-1))
+        power = np.square(np.abs(np.fft.rfft(samples * self.window, axis=-1)))
+        # DC and what leaks from it don't count
+        power[..., :self.lobe] = 0.0
+        total = power.sum(axis=-1)
+
+        peak = np.argmax(power, axis=-1)
+        dominant = self._interpolate(power, peak)
+        near = np.abs(self.bins - peak[..., None]) <= self.lobe
+        fundamental = np.sum(power, axis=-1, where=near)
+        centers = np.rint(dominant[..., None] * np.arange(2, self.harmonics + 2) / self.step)
+        harmonic = (np.abs(self.bins - centers[..., None]) <= self.lobe).any(axis=-2) & ~near
+        harmonics = np.sum(power, axis=-1, where=harmonic)
+        rest = np.where(near | harmonic, 0.0, power)
+        second = np.argmax(rest, axis=-1)
+        secondary = self._interpolate(power, second)
+        secondary_power = np.take_along_axis(rest, second[..., None], axis=-1)[..., 0]
+        peak_power = np.take_along_axis(power, peak[..., None], axis=-1)[..., 0]
+        noise = np.maximum(total - fundamental - harmonics, 0.0)
+        hum = np.sum(power, axis=-1, where=self.bins * self.step < self.hum)
 
-    logging.info("starting loop")
-    while True:
+        level_db = 20 * np.log10(np.maximum(rms, 1e-3) / self.full_scale)
+        silent = level_db < self.silence_db
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = {
+                "thd_db": 10 * np.log10(harmonics / fundamental),
+                "snr_db": 10 * np.log10(fundamental / noise),
+                "hum_db": 10 * np.log10(hum / total),
+                "secondary_db": 10 * np.log10(secondary_power / peak_power),
+                "leakage_db": self._leakage(power, dominant, peak_power),
+            }
+        result = {
+            "level_db": level_db,
+            "peak": magnitude.max(axis=-1),
+            "clipped": np.count_nonzero(magnitude >= self.full_scale - 1, axis=-1),
+            "dominant": np.where(silent, np.nan, dominant),
+            "secondary": np.where(silent, np.nan, secondary),
+        }
+        for name, values in ratios.items():
+            result[name] = np.where(silent, np.nan, np.clip(values, -200.0, 200.0))
+        return result
+
+    def _interpolate(self, power, index):
+        """
+        the frequency of a peak, from a parabola through the log magnitudes of its bin and the bins next to it
+        """
+        index = np.clip(index, 1, power.shape[-1] - 2)
+        left, center, right = (0.5 * np.log(np.take_along_axis(power, (index + offset)[..., None], axis=-1)[..., 0]
+                                            + 1e-12) for offset in (-1, 0, 1))
+        curve = left - 2 * center + right
+        with np.errstate(divide="ignore", invalid="ignore"):
+            delta = np.where(curve < 0, 0.5 * (left - right) / curve, 0.0)
+        return (index + delta) * self.step
+
+    def _leakage(self, power, dominant, peak_power):
+        """
+        the power at the strongest of the tones that isn't the dominant frequency, relative to the dominant peak
+        """
+        if not len(self.tones):
+            return np.full(dominant.shape, np.nan)
+        columns = np.rint(self.tones / self.step).astype(np.int64)
+        at_tones = power[..., columns]
+        others = np.abs(self.tones - dominant[..., None]) > self.lobe * self.step
+        strongest = np.max(np.where(others, at_tones, 0.0), axis=-1)
+        return np.where(others.any(axis=-1), 10 * np.log10(strongest / peak_power), np.nan)
+
+    def feed(self, frames):
+        """
+        :param frames: int16 samples with shape (frames, 2), like decode_pcm(data, None)
+        :return: a summary per channel for every interval these frames completed
+        """
+        summaries = []
+        position = 0
+        while position < len(frames):
+            take = min(self._frames - self._fill, len(frames) - position)
+            self._pending[self._fill:self._fill + take] = frames[position:position + take]
+            self._fill += take
+            position += take
+            if self._fill == self._frames:
+                summaries += self.summarize(self._pending.T.reshape(2, -1, self.window_size))
+                self._fill = 0
+        return summaries
+
+    def summarize(self, windows):
+        """
+        :param windows: samples with shape (channels, windows, window_size)
+        :return: a dict per channel, with the worst value of every measure, rounded, and None where all were silent
+        """
+        measures = self.analyze(windows)
+        worst = {"level_db": np.max, "peak": np.max, "clipped": np.sum, "thd_db": np.nanmax, "snr_db": np.nanmin,
+                 "hum_db": np.nanmax, "secondary_db": np.nanmax, "leakage_db": np.nanmax,
+                 "dominant": np.nanmedian, "secondary": np.nanmedian}
+        summaries = []
+        now = time()
+        for channel in range(len(windows)):
+            summary = {"time": round(now, 3), "channel": channel, "windows": int(windows.shape[1]),
+                       "silent": int(np.count_nonzero(np.isnan(measures["dominant"][channel])))}
+            for name, reduce in worst.items():
+                values = measures[name][channel]
+                if np.isnan(values).all():
+                    summary[name] = None
+                elif name in ("peak", "clipped"):
+                    summary[name] = int(reduce(values))
+                else:
+                    summary[name] = round(float(reduce(values)), 1)
+            summaries.append(summary)
+        return summaries
+
+
+def socket_drops(sock):
+    """
+    look up how many datagrams the kernel dropped for this socket, because its receive buffer was full
+    :param sock: a bound UDP socket
+    :return: the number of dropped datagrams, or None if that can't be determined (e.g. not on Linux)
+    """
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    try:
+        with open("/proc/net/udp", "r") as udp:
+            for line in udp.readlines()[1:]:
+                fields = line.split()
+                if fields[9] == inode:
+                    return int(fields[-1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+class AudioRing:
+    """
+    A fixed-size ring of detection records in a memory-mapped file, written by the detector and read by the harness
+    through the bind mount of the audio capture. The file never grows, and readers never see half-written records.
+
+    The file starts with a header (magic, layout, the tones, and `head`: the number of records written so far),
+    followed by `capacity` records of: seq, time, tone, power and the power per tone.
+    A record is published like a seqlock: its seq is cleared, the record written, and then seq is set to its number.
+    A reader copies a record and checks seq is still the same afterwards, or skips it.
+
+    Example of usage :
+
+        writer = AudioRing("/audio")
+        writer.create((300, 600))
+        writer.publish(300, powers)
+
+        reader = AudioRing("audio")
+        record = reader.latest()   # record["tone"], record["time"]
+    """
+    magic = b"SVXRING1"
+    version = 1
+    header_size = 1024
+    max_tones = 128
+    header_dtype = np.dtype([
+        ("magic", "S8"), ("version", "<u4"), ("capacity", "<u4"), ("tone_count", "<u4"), ("record_size", "<u4"),
+        ("head", "<u8"), ("epoch", "<f8"), ("tones", "<f4", (max_tones,)),
+    ])
+
+    def __init__(self, path):
+        self.log = logging.getLogger(__class__.__name__)
+        self.path = path
+        self.header = None
+        self.records = None
+        self.tones = ()
+        self._file = None
+        self._map = None
+        self._inode = None
+        self._epoch = None
+        # records up to these sequence numbers have been skipped by reset(), and read by read()
+        self.start = 0
+        self.cursor = 0
+        self.overruns = 0
+
+    @classmethod
+    def record_dtype(cls, tone_count):
+        size = 24 + 4 * tone_count
+        return np.dtype({
+            "names": ["seq", "time", "tone", "power", "powers"],
+            "formats": ["<u8", "<f8", "<f4", "<f4", ("<f4", (tone_count,))],
+            "offsets": [0, 8, 16, 20, 24],
+            # keep seq 8 byte aligned in every record
+            "itemsize": (size + 7) // 8 * 8,
+        })
+
+    def _map_file(self, size):
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self.header = np.frombuffer(self._map, dtype=self.header_dtype, count=1)[0]
+
+    def create(self, tones, capacity=4096):
+        """
+        set up the ring for writing, the file is only ever made bigger, never smaller, so readers can't fault on it
+        :param tones: the tones the detector reports, their powers are stored with every record
+        :param capacity: the number of records
+        :return:
+        """
+        if len(tones) > self.max_tones:
+            raise ValueError("at most {} tones are supported".format(self.max_tones))
+        self.close()
+        dtype = self.record_dtype(len(tones))
+        size = self.header_size + capacity * dtype.itemsize
+        self._file = open(self.path, "r+b" if os.path.exists(self.path) else "w+b")
+        if os.fstat(self._file.fileno()).st_size < size:
+            os.ftruncate(self._file.fileno(), size)
+        self._map_file(size)
+        self.header["magic"] = b""
+        self.header["version"] = self.version
+        self.header["capacity"] = capacity
+        self.header["tone_count"] = len(tones)
+        self.header["record_size"] = dtype.itemsize
+        self.header["head"] = 0
+        self.header["epoch"] = time()
+        self.header["tones"][:] = 0
+        self.header["tones"][:len(tones)] = tones
+        self.records = np.frombuffer(self._map, dtype=dtype, count=capacity, offset=self.header_size)
+        self.records["seq"] = 0
+        self.header["magic"] = self.magic
+        self.tones = tuple(tones)
+
+    def publish(self, tone, powers, timestamp=None):
+        """
+        write a record, overwriting the oldest one when the ring is full
+        :param tone: the detected tone
+        :param powers: the power per tone
+        :param timestamp: seconds since the epoch, defaults to now
+        :return: the sequence number of the record
+        """
+        seq = int(self.header["head"]) + 1
+        record = self.records[(seq - 1) % len(self.records)]
+        record["seq"] = 0
+        record["time"] = time() if timestamp is None else timestamp
+        record["tone"] = tone
+        record["powers"] = powers
+        record["power"] = np.max(powers) if len(powers) else 0.0
+        record["seq"] = seq
+        self.header["head"] = seq
+        # writes through a mapping don't generate inotify events, this wakes up the watchers
+        os.utime(self._file.fileno())
+        return seq
+
+    def attach(self):
+        """
+        map the ring for reading, when it has been set up by a writer; remap it when it was replaced or re-created
+        :return: True when the ring can be read
+        """
         try:
-            # start over every loop, so we don't queue up data
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.bind(("127.0.0.1", 10000))
-
-            # fetch 2 ch, 2 byte samples
-            data, _ = sock.recvfrom(SAMPLE_RATE * 2 * 2 * WINDOW_SIZE)
-            logging.debug("got {} bytes".format(len(data)))
-            samples = convert_interleaved_to_windowed(data, WINDOW_SIZE)
-
-            result = goertzel(samples, SAMPLE_RATE, (200, 400), (500, 700))
-            freq = find_closest_number(result, [300, 600])
-            logging.debug("writing to file: {}".format(freq))
-            with open("/audio", "a") as output:
-                # output.write("{} {}\n".format(datetime.now().timestamp(), freq))
-                output.write(str(freq)+"\n")
-            # print(freq)
-            sock.close()
-
-            # rate limit
-            logging.info("sleeping")
-            sleep(0.1)
-        except Exception as e:
-            logging.error(e)
+            info = os.stat(self.path)
+        except FileNotFoundError:
+            self.close()
+            return False
+        if self._map is not None and info.st_ino == self._inode and info.st_size >= len(self._map):
+            if self.header["epoch"] == self._epoch and self.header["magic"] == self.magic:
+                return True
+        self.close()
+        if info.st_size < self.header_size:
+            return False
+        self._file = open(self.path, "rb")
+        self._inode = info.st_ino
+        self._map = mmap.mmap(self._file.fileno(), info.st_size, prot=mmap.PROT_READ)
+        self.header = np.frombuffer(self._map, dtype=self.header_dtype, count=1)[0]
+        dtype = self.record_dtype(int(self.header["tone_count"]))
+        capacity = int(self.header["capacity"])
+        if (self.header["magic"] != self.magic or self.header["version"] != self.version
+                or self.header["record_size"] != dtype.itemsize
+                or info.st_size < self.header_size + capacity * dtype.itemsize):
+            # not set up yet, or being set up
+            self.close()
+            return False
+        self.records = np.frombuffer(self._map, dtype=dtype, count=capacity, offset=self.header_size)
+        self.tones = tuple(int(tone) if tone == int(tone) else float(tone)
+                           for tone in self.header["tones"][:int(self.header["tone_count"])])
+        if self._epoch != self.header["epoch"]:
+            # a new ring, everything in it is new
+            self._epoch = self.header["epoch"]
+            self.start = self.cursor = 0
+        return True
+
+    def close(self):
+        self.header = None
+        self.records = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._inode = None
+
+    @property
+    def head(self):
+        return int(self.header["head"]) if self.attach() else 0
+
+    def reset(self):
+        """
+        skip everything written so far, like truncating a capture
+        :return:
+        """
+        self.start = self.cursor = self.head
+
+    def _valid(self, copy, seqs):
+        """
+        the records of a copy that weren't being written while they were copied
+        """
+        live = self.records["seq"][(seqs - 1) % len(self.records)]
+        return copy[(copy["seq"] == seqs) & (live == seqs)]
+
+    def latest(self):
+        """
+        :return: a copy of the newest record since the last reset, or None
+        """
+        head = self.head
+        if head <= self.start:
+            return None
+        for seq in range(head, max(self.start, head - len(self.records)), -1):
+            copy = self.records[(seq - 1) % len(self.records)].copy()
+            valid = self._valid(np.array([copy]), np.array([seq], dtype=np.uint64))
+            if len(valid):
+                return valid[0]
+        return None
+
+    def read(self):
+        """
+        :return: a copy of the records written since the last read, oldest first
+        """
+        head = self.head
+        if head <= self.cursor:
+            return self.records[:0].copy() if self.records is not None else None
+        start = max(self.cursor, head - len(self.records))
+        if start > self.cursor:
+            self.overruns += start - self.cursor
+        seqs = np.arange(start + 1, head + 1, dtype=np.uint64)
+        copy = self.records[(seqs - 1) % len(self.records)]
+        self.cursor = head
+        return self._valid(copy, seqs)
+
+
+class SlidingGoertzel:
+    """
+    The DFT of a few tones over a sliding rectangular window, updated every `hop` samples instead of once per block.
+
+    The DFT of the window ending at sample n is a running sum: S(n) = w^n * sum(x(i) * w^-i) for the last
+    `window_size` samples, with w = e^(j*2*pi*f/sample_rate). So the powers at every hop of a block come from one
+    cumulative sum over the block and the window before it, for any tone, not only those on a bin.
+
+    Example of usage :
+
+        sliding = SlidingGoertzel(16000, 512, (300, 600))
+        positions, amplitudes = sliding.feed(some_samples, hop=16)
+    """
+
+    def __init__(self, sample_rate, window_size, tones):
+        self.sample_rate = sample_rate
+        self.window_size = window_size
+        self.tones = tuple(tones)
+        if max(self.tones) >= sample_rate / 2:
+            raise ValueError('tone above the nyquist frequency: %s' % max(self.tones))
+        self.omega = 2.0 * np.pi * np.array(self.tones, dtype=np.float64) / sample_rate
+        # the samples of the last window, silence before the stream started, and the number of samples fed so far
+        self._history = np.zeros(window_size, dtype=np.float64)
+        self.position = 0
+        self._next = 0
+
+    def feed(self, samples, hop=1):
+        """
+        add samples, and evaluate the tones every `hop` samples
+        :param samples: mono samples
+        :param hop: samples between evaluations
+        :return: the sample index of the last sample of every evaluated window,
+            and the amplitude per tone of every window, like that of a sine wave of that amplitude
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        size = self.window_size
+        start = self.position - size
+        signal = np.concatenate((self._history, samples))
+        # the phase is taken modulo the period per tone, so it stays precise on long streams
+        indexes = np.arange(start, start + len(signal), dtype=np.float64)
+        phasors = np.exp(-1j * np.mod(np.outer(indexes, self.omega), 2 * np.pi))
+        sums = np.zeros((len(signal) + 1, len(self.tones)), dtype=np.complex128)
+        np.cumsum(signal[:, None] * phasors, axis=0, out=sums[1:])
+        positions = np.arange(self._next, self.position + len(samples), hop)
+        local = positions - start + 1
+        amplitudes = 2.0 * np.abs(sums[local] - sums[local - size]) / size
+
+        self.position += len(samples)
+        self._history = signal[-size:]
+        self._next = positions[-1] + hop if len(positions) else self._next
+        return positions, amplitudes
+
+
+class ToneEvent:
+    """
+    Something the ToneTracker found in the audio, with positions in samples since the start of the stream:
+    - start, stop: a tone started or stopped, at `start`
+    - gap: no tone from `start` until `end`
+    - overlap: more than one tone from `start` until `end`
+    - switch: the only tone changed from tones[0] to tones[1], the first stopped at `start` and the second started
+      at `end`. The duration is the silence in between, negative when they overlapped.
+    """
+    __slots__ = ("kind", "tones", "start", "end", "sample_rate")
+
+    def __init__(self, kind, tones, start, end, sample_rate):
+        self.kind = kind
+        self.tones = tuple(tones)
+        self.start = start
+        self.end = end
+        self.sample_rate = sample_rate
+
+    @property
+    def time(self):
+        """
+        :return: the start in seconds since the start of the stream
+        """
+        return self.start / self.sample_rate
+
+    @property
+    def duration(self):
+        return (self.end - self.start) / self.sample_rate
+
+    def as_dict(self, origin=0.0):
+        """
+        :param origin: the wall clock time of the first sample of the stream
+        :return: the event as published to the tone events capture, with wall clock start and end
+        """
+        return {"kind": self.kind, "tones": list(self.tones), "start": origin + self.start / self.sample_rate,
+                "end": origin + self.end / self.sample_rate, "duration_ms": self.duration * 1000}
+
+    def __repr__(self):
+        return "ToneEvent({}, {}, {:.1f}ms, {:.1f}ms)".format(
+            self.kind, self.tones, self.time * 1000, self.duration * 1000)
+
+
+class ToneTracker:
+    """
+    Follows when tones start and stop with a SlidingGoertzel, and reports tone changes, gaps and overlaps.
+
+    A tone is present when its amplitude rises above `level`, and until it falls below `level * release`.
+    While a tone starts, the window fills up with it and its amplitude rises linearly; while it stops, it falls
+    linearly. So where the amplitude crossed the threshold, relative to the full amplitude of the tone, tells how far
+    into the window the tone started or stopped. Events are reported a window after they happened, in order.
+
+    Example of usage :
+
+        tracker = ToneTracker(16000, 512, (300, 600), hop=16)
+        for event in tracker.feed(some_samples) + tracker.flush():
+            print(event.kind, event.tones, event.time, event.duration)
+    """
+
+    def __init__(self, sample_rate, window_size, tones, hop=16, level=2000.0, release=0.75):
+        self.sliding = SlidingGoertzel(sample_rate, window_size, tones)
+        self.sample_rate = sample_rate
+        self.window_size = window_size
+        self.tones = self.sliding.tones
+        if not 0 < hop <= window_size:
+            raise ValueError("hop size should be between 1 and the window size, got {}".format(hop))
+        self.hop = hop
+        self.level = level
+        self.release = release
+        count = len(self.tones)
+        self._present = np.zeros(count, dtype=bool)
+        # the evaluated windows of the last few window sizes, to find the full amplitude of a tone around a crossing
+        self._positions = np.zeros(0, dtype=np.int64)
+        self._amplitudes = np.zeros((0, count))
+        # threshold crossings of tones that started, waiting for a window to see their full amplitude, and the edges
+        self._onsets = []
+        self._edges = []
+        # what the events are derived from: the tones that are on, since when, and the last tone that was alone
+        self.on = {}
+        self._stops = {}
+        self._alone = None
+        self._silent_since = None
+        self._overlap_since = None
+
+    def feed(self, samples):
+        """
+        :param samples: mono samples
+        :return: a list of ToneEvent, for what happened up to a window ago
+        """
+        positions, amplitudes = self.sliding.feed(samples, self.hop)
+        if len(positions):
+            self._crossings(positions, amplitudes)
+        position = self.sliding.position
+        self._resolve(position)
+        keep = min([onset[0] for onset in self._onsets] + [position]) - 2 * self.window_size
+        first = int(np.searchsorted(self._positions, keep))
+        self._positions = self._positions[first:]
+        self._amplitudes = self._amplitudes[first:]
+        return self._events(position - self.window_size - self.hop)
+
+    def flush(self):
+        """
+        :return: the events that are still waiting at the end of the stream
+        """
+        self._resolve(None)
+        return self._events(None)
+
+    def _peak(self, column, low, high):
+        """
+        :return: the highest amplitude of a tone in the windows from `low` up to `high`
+        """
+        within = (self._positions > low) & (self._positions <= high)
+        return self._amplitudes[within, column].max() if within.any() else 0.0
+
+    def _crossings(self, positions, amplitudes):
+        """
+        find where each tone crossed its thresholds, with hysteresis
+        """
+        # 1 above the level, 0 below the release level, and in between the state carries over
+        marks = np.where(amplitudes >= self.level, 1, np.where(amplitudes < self.level * self.release, 0, -1))
+        rows = np.arange(len(positions))[:, None]
+        last = np.maximum.accumulate(np.where(marks >= 0, rows, -1), axis=0)
+        columns = np.arange(len(self.tones))
+        states = np.where(last >= 0, marks[np.maximum(last, 0), columns], self._present).astype(bool)
+        before = np.vstack((self._present, states[:-1]))
+
+        if len(self._positions):
+            before_positions = np.concatenate((self._positions[-1:], positions[:-1]))
+            before_amplitudes = np.vstack((self._amplitudes[-1:], amplitudes[:-1]))
+        else:
+            before_positions = np.concatenate((positions[:1], positions[:-1]))
+            before_amplitudes = np.vstack((np.zeros((1, len(self.tones))), amplitudes[:-1]))
+        self._positions = np.concatenate((self._positions, positions))
+        self._amplitudes = np.vstack((self._amplitudes, amplitudes))
+
+        for row, column in zip(*np.nonzero(states != before)):
+            rising = bool(states[row, column])
+            threshold = self.level if rising else self.level * self.release
+            low, high = before_amplitudes[row, column], amplitudes[row, column]
+            fraction = (threshold - low) / (high - low) if high != low else 1.0
+            crossing = before_positions[row] + fraction * (positions[row] - before_positions[row])
+            if rising:
+                self._onsets.append((crossing, column, threshold))
+            else:
+                # the amplitude fell from its full value for at most a window
+                peak = max(self._peak(column, crossing - self.window_size, crossing), threshold)
+                self._edges.append((crossing - self.window_size * (1.0 - threshold / peak), "stop", column))
+        self._present = states[-1]
+
+    def _resolve(self, position):
+        """
+        turn the starts that were followed for a full window into edges, or all of them at the end of the stream
+        """
+        waiting = []
+        for crossing, column, threshold in self._onsets:
+            if position is not None and crossing + self.window_size > position:
+                waiting.append((crossing, column, threshold))
+                continue
+            # the amplitude rose to its full value within a window
+            peak = max(self._peak(column, crossing, crossing + self.window_size), threshold)
+            self._edges.append((crossing - self.window_size * threshold / peak + 1, "start", column))
+        self._onsets = waiting
+        self._edges.sort(key=lambda edge: edge[0])
+
+    def _events(self, safe):
+        """
+        derive the events from the edges before `safe`, later crossings may still give edges before that
+        """
+        events = []
+        ready = len(self._edges) if safe is None else sum(1 for edge in self._edges if edge[0] < safe)
+        for position, kind, column in self._edges[:ready]:
+            tone = self.tones[column]
+            events.append(self._event(kind, (tone,), position, position))
+            if kind == "start":
+                if not self.on and self._silent_since is not None:
+                    events.append(self._event("gap", (), self._silent_since, position))
+                self.on[tone] = position
+                if len(self.on) == 2:
+                    self._overlap_since = position
+            elif tone in self.on:
+                if len(self.on) == 2:
+                    events.append(self._event("overlap", sorted(self.on), self._overlap_since, position))
+                del self.on[tone]
+                self._stops[tone] = position
+                if not self.on:
+                    self._silent_since = position
+            if len(self.on) == 1:
+                alone = next(iter(self.on))
+                if self._alone is not None and alone != self._alone:
+                    events.append(self._event("switch", (self._alone, alone),
+                                              self._stops.get(self._alone, self.on[alone]), self.on[alone]))
+                self._alone = alone
+        del self._edges[:ready]
+        return events
+
+    def _event(self, kind, tones, start, end):
+        return ToneEvent(kind, tones, float(start), float(end), self.sample_rate)
+
+
+class StreamingDetector:
+    """
+    Long running tone detector, that keeps one UDP socket open for the audio svxlink sends.
+
+    Consecutive datagrams are assembled into windows of `window_size` samples.
+    Every `hop_size` samples a new window is complete, so a hop smaller than the window gives overlapping windows.
+    For every window the strongest of `tones` is reported, see ToneBank.
+    With a SignatureDecoder, the windows are as short as its signatures allow, and every window is decoded instead:
+    the remote's signature, or silence, mixed or unknown.
+    With a ToneTracker, the samples are also followed hop by hop, for tone changes with sample accurate positions.
+    With a SpectrumAnalyzer, both channels are also summarized every interval, for the health of the whole band.
+
+    Example of usage :
+
+        detector = StreamingDetector(("127.0.0.1", 10000), 16000, 1024, hop_size=512)
+        detector.run(print)
+    """
+    max_datagram = 65536
+
+    def __init__(self, address, sample_rate, window_size, hop_size=None, tones=(300, 600), channel=0, tracker=None,
+                 decoder=None, analyzer=None):
+        self.log = logging.getLogger(__class__.__name__)
+        self.address = address
+        self.sample_rate = sample_rate
+        self.decoder = decoder
+        if decoder:
+            window_size = decoder.window_size
+            tones = decoder.tones
+        self.window_size = window_size
+        self.hop_size = hop_size or window_size
+        if not 0 < self.hop_size <= window_size:
+            raise ValueError("hop size should be between 1 and the window size, got {}".format(self.hop_size))
+        self.tones = tuple(tones)
+        self.channel = channel
+        self.bank = decoder.bank if decoder else tone_bank(sample_rate, window_size, self.tones)
+        self.window = hamming_window(window_size)
+        self.tracker = tracker
+        self.analyzer = analyzer
+        self.sock = None
+
+        # preallocated buffers: one for the datagrams, one for the samples of the window being assembled
+        self._buffer = bytearray(self.max_datagram)
+        self._view = memoryview(self._buffer)
+        self._pending = np.zeros(window_size, dtype=np.float32)
+        self._windowed = np.zeros(window_size, dtype=np.float32)
+        self._fill = 0
+        self._remainder = b""
+        # the power per tone of the windows the last datagram completed, the tracker events and spectrum summaries
+        self.window_powers = []
+        self.events = []
+        self.summaries = []
+
+        # statistics
+        self.packets = 0
+        self.windows = 0
+        self.truncated = 0
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # give the kernel room to queue up audio while we're busy detecting
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind(self.address)
+        # wake up regularly, so close() from another thread is noticed
+        self.sock.settimeout(1.0)
+        self.log.info("listening on %s:%d", *self.sock.getsockname())
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    @property
+    def dropped(self):
+        """
+        the number of datagrams that were lost: dropped by the kernel, or truncated because they didn't fit the buffer
+        :return:
+        """
+        kernel = socket_drops(self.sock) if self.sock else None
+        return (kernel or 0) + self.truncated
+
+    def feed(self, data):
+        """
+        add a datagram of 16 bit, 2 channel interleaved samples, and detect the tone of every window it completes
+        :param data: bytes-like datagram
+        :return: a list of detected tones, or decoded labels with a decoder, one per completed window
+        """
+        if self._remainder:
+            data = self._remainder + bytes(data)
+        frame_bytes = len(data) - len(data) % 4
+        self._remainder = bytes(data[frame_bytes:])
+        samples = decode_pcm(data, self.channel)
+        if self.tracker:
+            self.events = self.tracker.feed(samples)
+        if self.analyzer:
+            self.summaries = self.analyzer.feed(decode_pcm(data, None))
+
+        detections = []
+        self.window_powers = []
+        pos = 0
+        while pos < len(samples):
+            take = min(self.window_size - self._fill, len(samples) - pos)
+            self._pending[self._fill:self._fill + take] = samples[pos:pos + take]
+            self._fill += take
+            pos += take
+            if self._fill == self.window_size:
+                detections.append(self.detect(self._pending))
+                # keep the overlap for the next window
+                keep = self.window_size - self.hop_size
+                self._pending[:keep] = self._pending[self.hop_size:]
+                self._fill = keep
+        self.windows += len(detections)
+        return detections
+
+    def detect(self, samples):
+        """
+        find the strongest tone in a window, or decode it with the decoder
+        :param samples: window_size samples
+        :return:
+        """
+        np.multiply(samples, self.window, out=self._windowed)
+        powers = self.bank.powers(self._windowed)
+        self.window_powers.append(powers)
+        if self.decoder:
+            return self.decoder.classify(powers, float(np.dot(self._windowed, self._windowed)))
+        return self.bank.tones[int(np.argmax(powers))]
+
+    def receive(self):
+        """
+        receive a single datagram into the preallocated buffer
+        :return: a view on the received data
+        """
+        size, _, flags, _ = self.sock.recvmsg_into([self._view])
+        self.packets += 1
+        if flags & socket.MSG_TRUNC:
+            self.truncated += 1
+        return self._view[:size]
+
+    def run(self, callback, stats_interval=10.0, summary_callback=None, event_callback=None):
+        """
+        detect tones until the socket is closed
+        :param callback: called with each detected tone (or decoded label) and the power per tone of its window
+        :param stats_interval: seconds between logging statistics
+        :param summary_callback: called with each spectrum summary, when there is an analyzer
+        :param event_callback: called with each tracker event as a dict, see ToneEvent.as_dict, when there is a tracker
+        :return:
+        """
+        if not self.sock:
+            self.open()
+        next_stats = monotonic() + stats_interval
+        while self.sock:
+            try:
+                for tone, powers in zip(self.feed(self.receive()), self.window_powers):
+                    callback(tone, powers)
+                if self.events:
+                    # the stream pauses when svxlink doesn't send, so time the events from the datagram just received
+                    origin = time() - self.tracker.sliding.position / self.sample_rate
+                    for event in self.events:
+                        self.log.info("%s", event)
+                        if event_callback:
+                            event_callback(event.as_dict(origin))
+                if summary_callback:
+                    for summary in self.summaries:
+                        summary_callback(summary)
+            except socket.timeout:
+                pass
+            except OSError as e:
+                if not self.sock:
+                    break
+                self.log.error(e)
+            except Exception:
+                # a bad datagram or a failing callback loses that datagram, not the detector
+                self.log.exception("failed to handle a datagram")
+            if monotonic() > next_stats:
+                self.log.info("packets: %d windows: %d dropped: %d", self.packets, self.windows, self.dropped)
+                next_stats += stats_interval
+
+
+if __name__ == '__main__':
+    logging.basicConfig(filename="/log", level=logging.INFO)
+    parser = argparse.ArgumentParser(description="detect the tones in the audio svxlink sends over UDP")
+    parser.add_argument("--sample-rate", type=int, default=16000)
+    parser.add_argument("--window-size", type=int, default=1024)
+    parser.add_argument("--hop-size", type=int, default=None, help="samples between windows, defaults to the window size")
+    parser.add_argument("--output", default="/audio", help="the ring the detections are published to")
+    parser.add_argument("--tones", type=int, nargs="+", default=[300, 600], help="the tones of the remotes")
+    parser.add_argument("--track", type=int, default=None, metavar="HOP",
+                        help="also track tone changes, gaps and overlaps, following the tones every HOP samples")
+    parser.add_argument("--events", default="/tone_events",
+                        help="where the tracked tone changes go as json lines, with --track")
+    parser.add_argument("--steady", action="store_true",
+                        help="report the strongest tone of every window, instead of decoding the signatures")
+    parser.add_argument("--signature-window", type=int, default=None,
+                        help="samples per decoded window, defaults to the shortest that tells the tones apart")
+    parser.add_argument("--spectrum", default="/spectrum",
+                        help="where a json summary of the spectrum of both channels goes every second, empty for none")
+    args = parser.parse_args()
+
+    logging.info("starting detector")
+    ring = AudioRing(args.output)
+    ring.create(args.tones)
+    tracker = ToneTracker(args.sample_rate, args.window_size // 2, args.tones, args.track) if args.track else None
+    # each remote of LocalSim sends a single tone, so that tone is its signature
+    decoder = None if args.steady else SignatureDecoder(args.sample_rate, {tone: (tone,) for tone in args.tones},
+                                                        args.signature_window)
+    analyzer = SpectrumAnalyzer(args.sample_rate, args.window_size, args.tones) if args.spectrum else None
+    detector = StreamingDetector(("127.0.0.1", 10000), args.sample_rate, args.window_size,
+                                 args.hop_size if args.steady else None, args.tones, tracker=tracker, decoder=decoder,
+                                 analyzer=analyzer)
+    spectrum = open(args.spectrum, "a", buffering=1) if args.spectrum else None
+    events = open(args.events, "a", buffering=1) if tracker and args.events else None
+    detector.run(lambda label, powers: ring.publish(signature_value(label), powers),
+                 summary_callback=lambda summary: spectrum.write(json.dumps(summary) + "\n"),
+                 event_callback=lambda event: events.write(json.dumps(event) + "\n") if events else None)
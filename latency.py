@@ -0,0 +1,310 @@
+"""
+This module measures how fast the voter reacts: the time from each command the harness issues
+(opening or closing a squelch, enabling or disabling a remote) to each effect it causes:
+- state: the first STATE_PTY line that differs from the one before, also measured with the svxlink timestamp
+- active: the first STATE_PTY line with another active remote, also measured with the svxlink timestamp
+- ptt: the PTT edge
+- tone: the first audio window with the tone of another remote
+
+Commands and effects are timestamped with time.monotonic() as they are seen. An effect is attributed to the last
+command before it, once per kind of effect. The latencies of a run are kept per test, and merged into histograms
+per branch under runs/latency/, so runs can be compared.
+"""
+from collections import OrderedDict
+import fcntl
+import json
+import logging
+import os
+from threading import Lock
+from time import monotonic, time
+
+import numpy as np
+
+from stack import ROOT
+
+OUTPUT_DIR = os.path.join(ROOT, "runs", "latency")
+# effects later than this after a command are not caused by it
+MAX_LATENCY = 30.0
+# upper bounds of the histogram buckets, in milliseconds
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 300, 500, 750, 1000, 2000, 5000, 10000, 30000]
+
+
+def current_test():
+    """
+    the test that is running, as set by pytest
+    :return: the node id and the phase (setup, call or teardown), or (None, None) outside of pytest
+    """
+    current = os.environ.get("PYTEST_CURRENT_TEST")
+    if not current:
+        return None, None
+    nodeid, _, phase = current.rpartition(" ")
+    return nodeid, phase.strip("()")
+
+
+class Sample:
+    """
+    one measured latency
+    """
+    __slots__ = ("backend", "test", "phase", "transition", "seconds", "target", "value")
+
+    def __init__(self, backend, test, phase, transition, seconds, target, value):
+        self.backend = backend
+        self.test = test
+        self.phase = phase
+        self.transition = transition
+        self.seconds = seconds
+        self.target = target
+        self.value = value
+
+
+class Command:
+    __slots__ = ("kind", "target", "at", "wall", "test", "phase", "seen")
+
+    def __init__(self, kind, target):
+        self.kind = kind
+        self.target = target
+        self.at = monotonic()
+        self.wall = time()
+        self.test, self.phase = current_test()
+        self.seen = set()
+
+
+class Histogram:
+    """
+    counts per bucket of BUCKETS, plus one for everything above the last bucket
+    """
+
+    def __init__(self, counts=None, maximum=0.0):
+        self.counts = list(counts) if counts else [0] * (len(BUCKETS) + 1)
+        self.maximum = maximum
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def add(self, seconds):
+        self.counts[int(np.searchsorted(BUCKETS, seconds * 1000.0))] += 1
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other):
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.maximum = max(self.maximum, other.maximum)
+
+    def percentile(self, percent):
+        """
+        :return: the upper bound of the bucket the percentile falls in, in seconds
+        """
+        if not self.count:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), self.count * percent / 100.0))
+        if index >= len(BUCKETS):
+            return self.maximum
+        return min(BUCKETS[index] / 1000.0, self.maximum)
+
+    def as_dict(self):
+        return {"buckets_ms": BUCKETS, "counts": self.counts, "max": self.maximum}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("buckets_ms") != BUCKETS:
+            # different buckets, can't be merged
+            return cls()
+        return cls(data.get("counts"), data.get("max", 0.0))
+
+
+def summarize(samples):
+    """
+    :param samples: a list of Sample
+    :return: count, p50, p95 and max in seconds per transition
+    """
+    by_transition = OrderedDict()
+    for sample in samples:
+        by_transition.setdefault(sample.transition, []).append(sample.seconds)
+    summary = OrderedDict()
+    for transition, values in sorted(by_transition.items()):
+        values = np.array(values)
+        summary[transition] = {
+            "count": len(values),
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)),
+            "max": float(values.max()),
+        }
+    return summary
+
+
+def format_summary(summary):
+    """
+    :return: the summary as lines of text, in milliseconds
+    """
+    lines = ["{:32} {:>6} {:>9} {:>9} {:>9}".format("transition", "count", "p50 ms", "p95 ms", "max ms")]
+    for transition, stats in summary.items():
+        lines.append("{:32} {:>6} {:>9.1f} {:>9.1f} {:>9.1f}".format(
+            transition, stats["count"], stats["p50"] * 1000, stats["p95"] * 1000, stats["max"] * 1000))
+    return lines
+
+
+def html_summary(summary):
+    rows = "".join(
+        "<tr><td>{}</td><td>{}</td><td>{:.1f}</td><td>{:.1f}</td><td>{:.1f}</td></tr>".format(
+            transition, stats["count"], stats["p50"] * 1000, stats["p95"] * 1000, stats["max"] * 1000)
+        for transition, stats in summary.items())
+    return ("<table border=\"1\"><tr><th>transition</th><th>count</th><th>p50 ms</th><th>p95 ms</th><th>max ms</th>"
+            "</tr>{}</table>").format(rows)
+
+
+class LatencyLog:
+    """
+    All latencies measured in this process, shared by the environments, like the environment pool is.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.samples = []
+
+    def add(self, sample):
+        with self.lock:
+            self.samples.append(sample)
+
+    def for_test(self, nodeid, phase="call"):
+        with self.lock:
+            return [sample for sample in self.samples if sample.test == nodeid and sample.phase == phase]
+
+    def tests(self, phase="call"):
+        """
+        :return: the samples of all tests, without those of setting up and resetting the environment
+        """
+        with self.lock:
+            return [sample for sample in self.samples if sample.test is None or sample.phase == phase]
+
+    def histograms(self, backend="docker"):
+        histograms = OrderedDict()
+        for sample in self.tests():
+            if sample.backend == backend:
+                histograms.setdefault(sample.transition, Histogram()).add(sample.seconds)
+        return histograms
+
+    def save(self, branch, directory=OUTPUT_DIR):
+        """
+        merge the histograms of this run into those of earlier runs of the branch, one file per backend
+        :param branch:
+        :param directory:
+        :return: the paths of the histograms
+        """
+        with self.lock:
+            backends = sorted({sample.backend for sample in self.samples})
+        paths = []
+        for backend in backends:
+            name = branch if backend == "docker" else "{}-{}".format(branch, backend)
+            path = self._merge(os.path.join(directory, "{}.json".format(name)), self.histograms(backend))
+            if path:
+                paths.append(path)
+        return paths
+
+    @staticmethod
+    def _merge(path, histograms):
+        if not histograms:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # other pytest-xdist workers save to the same file
+        with open(path, "a+") as output:
+            fcntl.flock(output, fcntl.LOCK_EX)
+            output.seek(0)
+            data = output.read()
+            stored = json.loads(data) if data.strip() else {"runs": 0, "transitions": {}}
+            stored["runs"] += 1
+            for transition, histogram in histograms.items():
+                merged = Histogram.from_dict(stored["transitions"].get(transition, {"buckets_ms": BUCKETS}))
+                merged.merge(histogram)
+                stored["transitions"][transition] = merged.as_dict()
+            output.seek(0)
+            output.truncate()
+            json.dump(stored, output, indent=2)
+        return path
+
+
+_log = LatencyLog()
+
+
+def session_log():
+    return _log
+
+
+class LatencyRecorder:
+    """
+    Pairs the commands of one environment with the effects it observes.
+
+    Example of usage :
+
+        recorder = LatencyRecorder("docker")
+        recorder.command("open_squelch", "remote1")
+        recorder.effect("ptt", True)
+        recorder.samples   # [Sample(transition="open_squelch->ptt", ...)]
+    """
+
+    def __init__(self, backend, log=None):
+        self.log = logging.getLogger(__class__.__name__)
+        self.backend = backend
+        self.session = log or session_log()
+        self.lock = Lock()
+        self.last_command = None
+        self.last_values = {}
+        self.samples = []
+
+    def reset(self):
+        """
+        forget the effects seen so far, like after the captures were truncated
+        :return:
+        """
+        with self.lock:
+            self.last_values = {}
+            self.last_command = None
+
+    def command(self, kind, target):
+        with self.lock:
+            self.last_command = Command(kind, target)
+
+    def waiting(self, kind):
+        """
+        whether an effect of this kind would be measured, so the effects before it need to be looked at one by one
+        :param kind:
+        :return:
+        """
+        with self.lock:
+            command = self.last_command
+            return command is not None and kind not in command.seen and monotonic() - command.at <= MAX_LATENCY
+
+    def settle(self, kind, value):
+        """
+        the latest value of an effect, when the ones before it don't matter
+        :param kind:
+        :param value:
+        :return:
+        """
+        with self.lock:
+            self.last_values[kind] = value
+
+    def effect(self, kind, value, reported=None):
+        """
+        an observed effect, only counted when its value changed
+        :param kind: state, active, ptt or tone
+        :param value: the new value, like the active remote or the PTT state
+        :param reported: the wall clock time at which svxlink reports the effect happened, if known
+        :return:
+        """
+        now = monotonic()
+        with self.lock:
+            if kind in self.last_values and self.last_values[kind] == value:
+                return
+            self.last_values[kind] = value
+            command = self.last_command
+            if command is None or kind in command.seen or now - command.at > MAX_LATENCY:
+                return
+            command.seen.add(kind)
+            measured = [("{}->{}".format(command.kind, kind), now - command.at)]
+            if reported is not None:
+                measured.append(("{}->{}(svxlink)".format(command.kind, kind), max(0.0, reported - command.wall)))
+        for transition, seconds in measured:
+            sample = Sample(self.backend, command.test, command.phase, transition, seconds, command.target, value)
+            self.log.debug("%s %s: %.1fms", transition, command.target, seconds * 1000)
+            self.samples.append(sample)
+            self.session.add(sample)
@@ -0,0 +1,212 @@
+"""
+This module follows the logs of the containers through the docker SDK, so they don't have to be fetched over and over.
+Each container gets one log pump, which keeps a bounded buffer of recent lines and resolves futures for
+patterns that are waited for.
+"""
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timezone
+import logging
+import re
+from threading import Lock, Thread
+
+
+def parse_docker_timestamp(timestamp):
+    """
+    parses the RFC3339 timestamp docker prefixes log lines with, which has nanoseconds
+    :param timestamp: like 2023-06-01T12:34:56.123456789Z
+    :return: an aware datetime, or None if it can't be parsed
+    """
+    try:
+        date, _, fraction = timestamp.rstrip("Z").partition(".")
+        result = datetime.strptime(date, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+        if fraction:
+            result = result.replace(microsecond=int(fraction[:6].ljust(6, "0")))
+        return result
+    except ValueError:
+        return None
+
+
+class LogMatch:
+    """
+    the first line that matched one of the patterns of an expectation
+    """
+    __slots__ = ("container", "pattern", "line", "timestamp")
+
+    def __init__(self, container, pattern, line, timestamp):
+        self.container = container
+        self.pattern = pattern
+        self.line = line
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return "LogMatch({}, {!r}, {!r}, {})".format(self.container, self.pattern, self.line, self.timestamp)
+
+
+class Expectation:
+    def __init__(self, patterns, regex):
+        self.patterns = patterns
+        if regex:
+            self.compiled = [re.compile(pattern) for pattern in patterns]
+        else:
+            self.compiled = [re.compile(re.escape(pattern)) for pattern in patterns]
+        self.future = Future()
+
+    def match(self, line):
+        for pattern, compiled in zip(self.patterns, self.compiled):
+            if compiled.search(line):
+                return pattern
+        return None
+
+
+class LogPump:
+    """
+    Follows the log stream of one container, from the start of the container, until it stops.
+
+    Example of usage :
+
+        pump = LogPump(container)
+        pump.start()
+        match = pump.expect(["RemoteTrx protocol", "Authentication failed"]).result(timeout=5)
+    """
+
+    def __init__(self, container, max_lines=10000):
+        self.container = container
+        self.name = container.name
+        self.log = logging.getLogger(__class__.__name__).getChild(self.name)
+        self.lines = deque(maxlen=max_lines)
+        self.lock = Lock()
+        self.expectations = []
+        self.bytes_read = 0
+        self._stream = None
+        self._thread = None
+
+    def start(self):
+        self._stream = self.container.logs(stream=True, follow=True, timestamps=True)
+        self._thread = Thread(target=self._pump, name="logs-{}".format(self.name), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stream:
+            self._stream.close()
+        if self._thread:
+            self._thread.join(5)
+        self._stream = None
+        self._thread = None
+
+    def _pump(self):
+        partial = b""
+        try:
+            for chunk in self._stream:
+                self.bytes_read += len(chunk)
+                data = partial + chunk
+                end = data.rfind(b"\n") + 1
+                partial = data[end:]
+                for line in data[:end].decode(errors="replace").splitlines():
+                    self._add(line)
+        except Exception as e:
+            # closing the stream from stop() ends up here as well
+            self.log.debug("log stream ended: %s", e)
+        if partial:
+            self._add(partial.decode(errors="replace"))
+
+    def _add(self, line):
+        # a line that can't be handled shouldn't end the stream, the lines after it are still waited for
+        try:
+            self.add(line)
+        except Exception:
+            self.log.exception("failed handling log line: %s", line)
+
+    def add(self, line):
+        """
+        add a line as it came from docker, with the timestamp prefix
+        :param line:
+        :return:
+        """
+        timestamp, _, text = line.partition(" ")
+        timestamp = parse_docker_timestamp(timestamp)
+        if timestamp is None:
+            text = line
+        self.log.info(text.strip())
+        with self.lock:
+            self.lines.append((timestamp, text))
+            for expectation in list(self.expectations):
+                self._check(expectation, timestamp, text)
+
+    def _check(self, expectation, timestamp, text):
+        if expectation.future.cancelled():
+            self.expectations.remove(expectation)
+            return True
+        pattern = expectation.match(text)
+        if pattern is None:
+            return False
+        if expectation in self.expectations:
+            self.expectations.remove(expectation)
+        # the waiter can cancel from another thread at any time, this settles who wins
+        if expectation.future.set_running_or_notify_cancel():
+            expectation.future.set_result(LogMatch(self.name, pattern, text, timestamp))
+        return True
+
+    def expect(self, patterns, regex=False, history=True):
+        """
+        wait for any of the patterns to show up in the logs
+        :param patterns: a string or a list of strings, matched literally unless regex is True
+        :param regex: treat the patterns as regular expressions
+        :param history: also match the lines already in the buffer
+        :return: a Future that resolves to a LogMatch for the first matching line
+        """
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        expectation = Expectation(list(patterns), regex)
+        with self.lock:
+            if history:
+                for timestamp, text in self.lines:
+                    if self._check(expectation, timestamp, text):
+                        return expectation.future
+            self.expectations.append(expectation)
+        return expectation.future
+
+    def find(self, term):
+        """
+        check if a literal term is in the buffered lines
+        :param term:
+        :return:
+        """
+        with self.lock:
+            return any(term in text for _, text in self.lines)
+
+
+class LogBus:
+    """
+    A log pump per container, indexed by container name
+    """
+
+    def __init__(self, max_lines=10000):
+        self.log = logging.getLogger(__class__.__name__)
+        self.max_lines = max_lines
+        self.pumps = {}
+
+    def attach(self, container):
+        """
+        start following the logs of a container, if that's not done yet
+        :param container: a docker container object
+        :return: the LogPump for the container
+        """
+        if container.name not in self.pumps:
+            self.log.debug("following logs of %s", container.name)
+            pump = LogPump(container, self.max_lines)
+            pump.start()
+            self.pumps[container.name] = pump
+        return self.pumps[container.name]
+
+    def expect(self, container, patterns, regex=False):
+        return self.pumps[container].expect(patterns, regex)
+
+    def find(self, container, term):
+        pump = self.pumps.get(container)
+        return pump is not None and pump.find(term)
+
+    def stop(self):
+        for pump in self.pumps.values():
+            pump.stop()
+        self.pumps = {}
@@ -0,0 +1,364 @@
+"""
+This module runs the tests for several svxlink branches at the same time, each in its own stack
+(see stack.py), and merges the results into one comparison: the outcome and duration of every test on every branch.
+Tests that passed before with the same image, test and harness are taken from the cache (see resultcache.py) instead
+of run again, unless --force is given.
+
+Usage:
+    python matrix.py [--branches master old hobbyscoop] [--force] [-- extra pytest arguments]
+    python matrix.py --branches hobbyscoop --check   # exits with 0 when every result is cached, nothing to build or run
+"""
+import argparse
+from collections import OrderedDict
+import html
+import json
+import logging
+import os
+import subprocess
+import sys
+from time import monotonic
+from xml.etree import ElementTree
+
+from resultcache import ResultCache, image_identity
+from stack import ROOT
+
+BRANCHES = ["master", "old", "hobbyscoop"]
+OUTPUT_DIR = os.path.join(ROOT, "runs", "matrix")
+# options of pytest-xdist, that don't apply to collecting the tests
+XDIST_OPTIONS = ("-n", "--numprocesses", "--dist", "--maxprocesses")
+
+
+class Result:
+    """
+    the outcome of one test on one branch
+    """
+    __slots__ = ("outcome", "duration", "message", "cached")
+
+    def __init__(self, outcome, duration, message="", cached=False):
+        self.outcome = outcome
+        self.duration = duration
+        self.message = message
+        self.cached = cached
+
+    def as_dict(self):
+        return {"outcome": self.outcome, "duration": self.duration, "message": self.message, "cached": self.cached}
+
+
+def junit_id(nodeid):
+    """
+    the test id of a pytest node id as parse_junit makes it:
+    tests/test_original.py::Test::test_x becomes tests.test_original.Test::test_x
+    """
+    path, *names = nodeid.split("::")
+    module = os.path.splitext(path)[0].replace("/", ".")
+    return "{}::{}".format(".".join([module] + names[:-1]), names[-1])
+
+
+def collect_args(pytest_args):
+    """
+    :return: the pytest arguments without those of pytest-xdist
+    """
+    args, skip = [], False
+    for arg in pytest_args:
+        if skip:
+            skip = False
+            continue
+        name = arg.split("=")[0]
+        if name in XDIST_OPTIONS:
+            skip = "=" not in arg
+            continue
+        if arg.startswith("-n") and arg[2:].isdigit():
+            continue
+        args.append(arg)
+    return args
+
+
+def parse_junit(path):
+    """
+    reads the results from a junit xml file, as written by pytest --junitxml
+    :param path:
+    :return: an ordered dict of test id to Result
+    """
+    results = OrderedDict()
+    for case in ElementTree.parse(path).getroot().iter("testcase"):
+        test_id = "{}::{}".format(case.get("classname"), case.get("name"))
+        outcome, message = "passed", ""
+        for tag in ("failure", "error", "skipped"):
+            element = case.find(tag)
+            if element is not None:
+                outcome = {"failure": "failed", "error": "error", "skipped": "skipped"}[tag]
+                message = element.get("message", "")
+                break
+        results[test_id] = Result(outcome, float(case.get("time", 0)), message)
+    return results
+
+
+class BranchRun:
+    """
+    a pytest run for one branch, in its own stack.
+    The tests in `cached` are deselected, and merged into the results after the run.
+    """
+    def __init__(self, branch, slot, pytest_args):
+        self.branch = branch
+        self.slot = slot
+        self.pytest_args = pytest_args
+        self.junit = os.path.join(OUTPUT_DIR, "{}.xml".format(branch))
+        self.process = None
+        self.start = None
+        self.duration = None
+        self.results = OrderedDict()
+        # node id to the fingerprint of its result, and to the Result when it was cached
+        self.keys = OrderedDict()
+        self.cached = OrderedDict()
+
+    def command(self):
+        deselect = [arg for nodeid in self.cached for arg in ("--deselect", nodeid)]
+        return [sys.executable, "-m", "pytest", "--junitxml", self.junit,
+                "--html", os.path.join(ROOT, "report-{}.html".format(self.branch)), "--self-contained-html"] + \
+            self.pytest_args + deselect
+
+    @property
+    def up_to_date(self):
+        """
+        True when every test is cached, so there is nothing to run
+        """
+        return bool(self.keys) and len(self.cached) == len(self.keys)
+
+    def environment(self):
+        env = dict(os.environ)
+        env.update({"BRANCH": self.branch, "STACK_NAME": self.branch, "STACK_SLOT": str(self.slot)})
+        return env
+
+    def launch(self):
+        if os.path.exists(self.junit):
+            os.remove(self.junit)
+        self.start = monotonic()
+        log_file = open(os.path.join(OUTPUT_DIR, "{}.log".format(self.branch)), "w")
+        self.process = subprocess.Popen(self.command(), cwd=ROOT, env=self.environment(),
+                                        stdout=log_file, stderr=subprocess.STDOUT)
+        log_file.close()
+
+    def wait(self):
+        if self.process is None:
+            self.duration = 0.0
+            self.results = self.merge(OrderedDict())
+            return 0
+        self.process.wait()
+        self.duration = monotonic() - self.start
+        self.results = self.merge(parse_junit(self.junit) if os.path.exists(self.junit) else OrderedDict())
+        return self.process.returncode
+
+    def merge(self, results):
+        """
+        :param results: the results of the run
+        :return: those and the cached ones, in the order the tests were collected
+        """
+        merged = OrderedDict()
+        for nodeid in self.keys:
+            test_id = junit_id(nodeid)
+            result = self.cached.get(nodeid) or results.get(test_id)
+            if result is not None:
+                merged[test_id] = result
+        for test_id, result in results.items():
+            merged.setdefault(test_id, result)
+        return merged
+
+
+class Matrix:
+    """
+    Runs all branches concurrently, and merges the results.
+
+    Example of usage :
+
+        matrix = Matrix(["master", "hobbyscoop"])
+        matrix.run()
+        print(matrix.text_report())
+    """
+
+    def __init__(self, branches, pytest_args=(), cache=None, force=False):
+        """
+        :param branches: the svxlink branches to run the tests for
+        :param pytest_args: passed on to pytest
+        :param cache: a ResultCache, or None to run every test
+        :param force: run every test, but still store the results in the cache
+        """
+        self.log = logging.getLogger(__class__.__name__)
+        self.branches = list(branches)
+        self.pytest_args = list(pytest_args)
+        self.cache = cache
+        self.force = force
+        self.runs = OrderedDict()
+        self.duration = None
+
+    def run(self):
+        """
+        run the tests for every branch at the same time
+        :return: True when all tests passed on all branches
+        """
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        start = monotonic()
+        self.prepare()
+        for run in self.runs.values():
+            if run.up_to_date:
+                self.log.info("%s: all %d tests cached", run.branch, len(run.cached))
+                continue
+            self.log.info("starting %s in slot %d, %d tests cached", run.branch, run.slot, len(run.cached))
+            run.launch()
+        returncodes = [run.wait() for run in self.runs.values()]
+        self.duration = monotonic() - start
+        for run in self.runs.values():
+            self.store(run)
+            self.log.info("%s done in %.1fs", run.branch, run.duration)
+        return all(code == 0 for code in returncodes)
+
+    def prepare(self):
+        """
+        set up a run per branch, with the results that are in the cache
+        """
+        nodeids = self.collect() if self.cache is not None else []
+        for slot, branch in enumerate(self.branches):
+            run = BranchRun(branch, slot, self.pytest_args)
+            self.runs[branch] = run
+            self.lookup(run, nodeids)
+
+    def check(self):
+        """
+        look up the results of every branch without running anything
+        :return: True when every result is cached
+        """
+        self.prepare()
+        for run in self.runs.values():
+            self.log.info("%s: %d of %d tests cached", run.branch, len(run.cached), len(run.keys))
+        return all(run.up_to_date for run in self.runs.values())
+
+    def collect(self):
+        """
+        :return: the node ids of the tests pytest would run
+        """
+        output = subprocess.run([sys.executable, "-m", "pytest", "--collect-only", "-q"] +
+                                collect_args(self.pytest_args),
+                                cwd=ROOT, capture_output=True, text=True).stdout
+        return [line.strip() for line in output.splitlines() if "::" in line and not line.startswith(" ")]
+
+    def lookup(self, run, nodeids):
+        """
+        fingerprints the tests of a run, and takes the results that are in the cache
+        """
+        if self.cache is None or not nodeids:
+            return
+        image = image_identity(run.branch, os.environ.get("BACKEND", "docker"))
+        if image is None:
+            self.log.warning("no image for %s, running all its tests", run.branch)
+            return
+        for nodeid in nodeids:
+            key = self.cache.fingerprint(run.branch, image, nodeid)
+            run.keys[nodeid] = key
+            stored = None if self.force else self.cache.get(key)
+            if stored is not None:
+                run.cached[nodeid] = Result(stored["outcome"], stored["duration"], stored.get("message", ""), True)
+
+    def store(self, run):
+        """
+        adds the passed results of a run to the cache
+        """
+        if self.cache is None:
+            return
+        for nodeid, key in run.keys.items():
+            result = run.results.get(junit_id(nodeid))
+            if result is not None and not result.cached:
+                self.cache.put(key, run.branch, nodeid, result.outcome, result.duration, result.message)
+
+    @property
+    def test_ids(self):
+        test_ids = OrderedDict()
+        for run in self.runs.values():
+            for test_id in run.results:
+                test_ids[test_id] = True
+        return list(test_ids)
+
+    def cell(self, branch, test_id):
+        return self.runs[branch].results.get(test_id)
+
+    def as_dict(self):
+        return {
+            "duration": self.duration,
+            "branches": {branch: {"duration": run.duration} for branch, run in self.runs.items()},
+            "tests": {
+                test_id: {branch: self.cell(branch, test_id).as_dict() if self.cell(branch, test_id) else None
+                          for branch in self.runs}
+                for test_id in self.test_ids
+            },
+        }
+
+    def text_report(self):
+        width = max([len(test_id.split("::")[-1]) for test_id in self.test_ids] + [4])
+        lines = ["{:{}}  ".format("test", width) + "  ".join("{:>18}".format(branch) for branch in self.runs)]
+        for test_id in self.test_ids:
+            cells = []
+            for branch in self.runs:
+                result = self.cell(branch, test_id)
+                cells.append("{:>18}".format("{}{} {:.1f}s".format(
+                    result.outcome, "*" if result.cached else "", result.duration) if result else "-"))
+            lines.append("{:{}}  ".format(test_id.split("::")[-1], width) + "  ".join(cells))
+        lines.append("{:{}}  ".format("total", width) + "  ".join(
+            "{:>18}".format("{:.1f}s".format(run.duration or 0)) for run in self.runs.values()))
+        lines.append("wall clock {:.1f}s, sum of branches {:.1f}s".format(
+            self.duration or 0, sum(run.duration or 0 for run in self.runs.values())))
+        cached = sum(len(run.cached) for run in self.runs.values())
+        if cached:
+            lines.append("* from the cache: {} of {} results".format(
+                cached, sum(len(run.results) for run in self.runs.values())))
+        return "\n".join(lines)
+
+    def html_report(self):
+        colors = {"passed": "#8f8", "failed": "#f88", "error": "#fa8", "skipped": "#ddd"}
+        rows = []
+        for test_id in self.test_ids:
+            cells = []
+            for branch in self.runs:
+                result = self.cell(branch, test_id)
+                if result is None:
+                    cells.append("<td>-</td>")
+                    continue
+                cells.append('<td style="background: {}" title="{}">{}{} ({:.1f}s)</td>'.format(
+                    colors.get(result.outcome, "#fff"), html.escape(result.message), result.outcome,
+                    ", cached" if result.cached else "", result.duration))
+            rows.append("<tr><td>{}</td>{}</tr>".format(html.escape(test_id), "".join(cells)))
+        header = "".join("<th>{}</th>".format(html.escape(branch)) for branch in self.runs)
+        totals = "".join("<td>{:.1f}s</td>".format(run.duration or 0) for run in self.runs.values())
+        return (
+            "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>svxlink test matrix</title></head><body>"
+            "<h1>svxlink test matrix</h1><p>wall clock {:.1f}s</p>"
+            "<table border=\"1\"><tr><th>test</th>{}</tr>{}<tr><td>total</td>{}</tr></table></body></html>"
+        ).format(self.duration or 0, header, "".join(rows), totals)
+
+    def write(self, html_path):
+        with open(os.path.join(OUTPUT_DIR, "results.json"), "w") as output:
+            json.dump(self.as_dict(), output, indent=2)
+        with open(html_path, "w") as output:
+            output.write(self.html_report())
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="run the tests for several branches at the same time")
+    parser.add_argument("--branches", nargs="+", default=BRANCHES)
+    parser.add_argument("--output", default=os.path.join(ROOT, "report-matrix.html"))
+    parser.add_argument("--force", action="store_true", help="run every test, also when its result is cached")
+    parser.add_argument("--no-cache", action="store_true", help="don't use or update the cache")
+    parser.add_argument("--check", action="store_true",
+                        help="only check whether every result is cached, exit with 0 when it is")
+    parser.add_argument("pytest_args", nargs="*", help="passed on to pytest, after --")
+    args = parser.parse_args()
+
+    matrix = Matrix(args.branches, args.pytest_args, None if args.no_cache else ResultCache(), args.force)
+    if args.check:
+        sys.exit(0 if matrix.check() else 1)
+    success = matrix.run()
+    matrix.write(args.output)
+    print(matrix.text_report())
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+This module brings up the containers in dependency waves.
+Containers of a wave are created by one docker-compose call, the docker events stream tells when they started
+or died, and a container is ready when all of its probes pass (a port that is listened on inside the container,
+a file that exists, a line in the logs).
+"""
+from collections import OrderedDict
+import logging
+from subprocess import check_output
+from threading import Condition, Thread
+from time import monotonic, sleep
+
+from tracing import tracer
+
+
+class DockerEvents:
+    """
+    Follows the docker events stream for containers, and keeps the last action per container name.
+
+    Example of usage :
+
+        events = DockerEvents(client)
+        events.start()
+        events.wait_for(["remote1", "remote2"], "start", 10)
+    """
+
+    def __init__(self, client):
+        self.log = logging.getLogger(__class__.__name__)
+        self.client = client
+        self.condition = Condition()
+        self.actions = {}
+        self.listeners = []
+        self._stream = None
+        self._thread = None
+
+    def start(self):
+        if self._stream:
+            return
+        self._stream = self.client.events(decode=True, filters={"type": "container"})
+        self._thread = Thread(target=self._follow, name="docker-events", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._stream:
+            self._stream.close()
+        if self._thread:
+            self._thread.join(5)
+        self._stream = None
+        self._thread = None
+
+    def add_listener(self, callback):
+        """
+        call `callback(action, name)` from the events thread for every container event
+        :param callback:
+        :return:
+        """
+        self.listeners.append(callback)
+
+    def _follow(self):
+        try:
+            for event in self._stream:
+                action = event.get("Action", event.get("status", ""))
+                name = event.get("Actor", {}).get("Attributes", {}).get("name")
+                if not name:
+                    continue
+                self.log.debug("%s: %s", name, action)
+                for callback in self.listeners:
+                    try:
+                        callback(action, name)
+                    except Exception as e:
+                        self.log.error("listener failed on %s %s: %s", action, name, e)
+                with self.condition:
+                    self.actions[name] = action
+                    self.condition.notify_all()
+        except Exception as e:
+            # closing the stream from stop() ends up here as well
+            self.log.debug("events stream ended: %s", e)
+
+    def forget(self, names):
+        """
+        forget the last actions of containers, before they are (re)created
+        :param names:
+        :return:
+        """
+        with self.condition:
+            for name in names:
+                self.actions.pop(name, None)
+
+    def died(self, names):
+        with self.condition:
+            return [name for name in names if self.actions.get(name) in ("die", "oom", "kill", "destroy")]
+
+    def wait_for(self, names, action, timeout):
+        """
+        wait for all containers to have `action` as their last event
+        :param names: container names
+        :param action: like start or die
+        :param timeout: in seconds
+        :return: True when all containers got there, False on timeout
+        """
+        deadline = monotonic() + timeout
+        with self.condition:
+            while not all(self.actions.get(name) == action for name in names):
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+class ListenProbe:
+    """
+    passes when a process in the container listens on a TCP port.
+    A published port accepts connections on the host as soon as the container runs, before anything listens on it,
+    so this looks at the sockets inside the container instead.
+    """
+    def __init__(self, port):
+        self.port = port
+
+    def __str__(self):
+        return "listen {}".format(self.port)
+
+    @staticmethod
+    def listening_ports(table):
+        """
+        :param table: the contents of /proc/net/tcp and /proc/net/tcp6
+        :return: the ports in the LISTEN state
+        """
+        ports = set()
+        for line in table.splitlines():
+            fields = line.split()
+            # sl local_address rem_address st ..., the local address is hex ip:port, state 0A is LISTEN
+            if len(fields) > 3 and ":" in fields[1] and fields[3] == "0A":
+                ports.add(int(fields[1].rsplit(":", 1)[1], 16))
+        return ports
+
+    def __call__(self, container):
+        with tracer().span("exec_run cat /proc/net/tcp", "docker", container=container.name):
+            result = container.exec_run(["cat", "/proc/net/tcp", "/proc/net/tcp6"])
+        return self.port in self.listening_ports(result.output.decode(errors="replace"))
+
+
+class PathProbe:
+    """
+    passes when a path exists inside the container, like a PTY
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return "path {}".format(self.path)
+
+    def __call__(self, container):
+        with tracer().span("exec_run test -e", "docker", container=container.name):
+            return container.exec_run(["test", "-e", self.path]).exit_code == 0
+
+
+class LogProbe:
+    """
+    passes when a line shows up in the logs of the container
+    """
+    def __init__(self, logs, pattern, regex=False):
+        self.logs = logs
+        self.pattern = pattern
+        self.regex = regex
+        self.future = None
+
+    def __str__(self):
+        return "log {!r}".format(self.pattern)
+
+    def __call__(self, container):
+        if self.future is None:
+            self.future = self.logs.attach(container).expect(self.pattern, self.regex)
+        return self.future.done()
+
+
+class Service:
+    """
+    a compose service, with the probes that have to pass before it's ready
+    """
+    def __init__(self, name, probes=(), container_name=None):
+        self.name = name
+        self.container_name = container_name or name
+        self.probes = list(probes)
+
+
+class Orchestrator:
+    """
+    Starts waves of services one after another, the services within a wave are started together.
+    The time each phase took ends up in `timings`.
+    """
+    probe_interval = 0.05
+
+    def __init__(self, client, events, logs, compose_command):
+        self.log = logging.getLogger(__class__.__name__)
+        self.client = client
+        self.events = events
+        self.logs = logs
+        self.compose_command = compose_command
+        self.timings = OrderedDict()
+
+    def phase(self, name, start):
+        self.timings[name] = monotonic() - start
+        self.log.debug("%s took %.3fs", name, self.timings[name])
+        return monotonic()
+
+    def up(self, waves, timeout=30):
+        """
+        bring up all waves of services
+        :param waves: a list of lists of Service
+        :param timeout: in seconds, for each wave
+        :return: True when all services are ready
+        """
+        self.timings.clear()
+        for wave in waves:
+            if not self.up_wave(wave, timeout):
+                return False
+        self.log.info("startup timings: %s", ", ".join("{} {:.2f}s".format(*item) for item in self.timings.items()))
+        return True
+
+    def up_wave(self, wave, timeout):
+        names = [service.container_name for service in wave]
+        label = "+".join(service.name for service in wave)
+        deadline = monotonic() + timeout
+        start = monotonic()
+        self.events.forget(names)
+        with tracer().span("compose up", "subprocess", services=label):
+            check_output(self.compose_command + ["up", "-d", "--no-deps"] + [service.name for service in wave])
+        start = self.phase("{} create".format(label), start)
+
+        if not self.events.wait_for(names, "start", max(0, deadline - monotonic())):
+            self.log.error("timeout waiting for %s to start", label)
+            return False
+        start = self.phase("{} start".format(label), start)
+
+        pending = {}
+        for service in wave:
+            with tracer().span("containers.get", "docker", container=service.container_name):
+                container = self.client.containers.get(service.container_name)
+            self.logs.attach(container)
+            for probe in service.probes:
+                pending[(service.name, str(probe))] = (container, probe)
+        with tracer().span("probe " + label, "wait") as span:
+            span.args["iterations"] = 0
+            while pending:
+                span.args["iterations"] += 1
+                for key, (container, probe) in list(pending.items()):
+                    if probe(container):
+                        del pending[key]
+                        self.timings["{} {}".format(*key)] = monotonic() - start
+                died = self.events.died(names)
+                if died:
+                    self.log.error("containers died during startup: %s", ", ".join(died))
+                    return False
+                if monotonic() > deadline:
+                    self.log.error("timeout waiting for: %s", ", ".join("{} {}".format(*key) for key in pending))
+                    return False
+                if pending:
+                    sleep(self.probe_interval)
+        self.phase("{} ready".format(label), start)
+        return True
@@ -0,0 +1,138 @@
+"""
+This module keeps a started environment around between tests, so the stack doesn't have to be started and stopped
+for every test. Between tests the stack is reset to a clean baseline, and restarted when that doesn't work.
+
+The mode is picked with the ENV_POOL environment variable:
+- unset or empty: every test starts and stops its own stack
+- session: one stack for the whole test session
+- module: one stack per test module
+"""
+import atexit
+import logging
+import os
+from time import monotonic
+
+
+class EnvironmentPool:
+    """
+    Hands out a started environment, and resets it for the next test.
+
+    Example of usage :
+
+        pool = EnvironmentPool(Environment, "session")
+        env = pool.acquire(__name__)
+        ...
+        pool.close()
+    """
+
+    def __init__(self, factory, scope="session"):
+        self.log = logging.getLogger(__class__.__name__)
+        self.factory = factory
+        self.scope = scope
+        self.environment = None
+        self.current_scope = None
+        # statistics, to see how much time reusing the stack saves
+        self.starts = 0
+        self.start_time = 0.0
+        self.stops = 0
+        self.stop_time = 0.0
+        self.resets = 0
+        self.reset_time = 0.0
+        self.recycles = 0
+
+    def _start(self):
+        start = monotonic()
+        self.environment = self.factory()
+        ready = self.environment.start()
+        self.start_time += monotonic() - start
+        self.starts += 1
+        if not ready:
+            self._stop()
+            raise RuntimeError("failed to set up env")
+
+    def _stop(self):
+        if self.environment is None:
+            return
+        start = monotonic()
+        self.environment.stop()
+        self.stop_time += monotonic() - start
+        self.stops += 1
+        self.environment = None
+
+    def acquire(self, scope=None):
+        """
+        returns a started environment, in its baseline state
+        :param scope: the name of the current module, a new module gets a new stack in module mode
+        :return:
+        """
+        if self.environment is not None and self.scope == "module" and scope != self.current_scope:
+            self.log.info("new module %s, replacing the stack", scope)
+            self._stop()
+        self.current_scope = scope
+
+        if self.environment is None:
+            self._start()
+            return self.environment
+
+        start = monotonic()
+        reset = self.environment.fast_reset()
+        self.reset_time += monotonic() - start
+        self.resets += 1
+        if not reset:
+            self.log.warning("reset didn't converge, recycling the stack")
+            self.recycles += 1
+            self._stop()
+            self._start()
+        return self.environment
+
+    def release(self, environment):
+        """
+        hand back an environment after a test, it stays running for the next one
+        :param environment:
+        :return:
+        """
+        if environment is not self.environment:
+            environment.stop()
+
+    def close(self):
+        self._stop()
+
+    @property
+    def saved(self):
+        """
+        estimate the wall-clock time saved, compared to starting and stopping a stack for every test
+        :return: seconds
+        """
+        if not self.starts:
+            return 0.0
+        per_stack = self.start_time / self.starts + (self.stop_time / self.stops if self.stops else 0.0)
+        return self.resets * per_stack - self.reset_time
+
+    def summary(self):
+        return "{} starts ({:.1f}s), {} resets ({:.1f}s), {} recycles, saved about {:.1f}s".format(
+            self.starts, self.start_time, self.resets, self.reset_time, self.recycles, self.saved)
+
+
+_pool = None
+
+
+def shared_pool(factory):
+    """
+    returns the pool for the mode in ENV_POOL, or None when every test should have its own stack
+    :param factory: creates a new environment
+    :return:
+    """
+    global _pool
+    scope = os.environ.get("ENV_POOL", "")
+    if not scope:
+        return None
+    if scope not in ("session", "module"):
+        raise ValueError("ENV_POOL should be session or module, not {}".format(scope))
+    if _pool is None:
+        _pool = EnvironmentPool(factory, scope)
+        atexit.register(_pool.close)
+    return _pool
+
+
+def current_pool():
+    return _pool
@@ -0,0 +1,168 @@
+"""
+This module keeps the results of passed tests, so a run only executes the tests something changed for.
+
+A result is stored under the fingerprint of everything it depends on:
+- the svxlink image of the branch: the svxlink revision and the hash of the Dockerfile it was built with, as labelled
+  by scripts/build-images.sh, or the image id for an image without those labels. Without an image, like on a fresh CI
+  runner, the head of the branch and the Dockerfile it would be built with, so the build can be skipped when every
+  result is cached
+- the test id, and the hash of its test file
+- the hashes of the harness: the python modules the tests import, tests/conftest.py, pytest.ini and configs/*
+- the environment variables that change how the tests run: BACKEND, REMOTES and ENV_POOL
+
+Only passed results are kept, a failed or skipped test always runs again. The cache is a directory of json files
+named after their fingerprint, under runs/cache/, so it can be copied or restored as a whole, like in CI.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import subprocess
+from time import time
+
+from stack import ROOT
+
+CACHE_DIR = os.path.join(ROOT, "runs", "cache")
+SVXLINK_REPO = "https://github.com/hobbyscoop/svxlink.git"
+REVISION_LABEL = "org.opencontainers.image.revision"
+DOCKERFILE_LABEL = "svxlink-testing.dockerfile"
+ENVIRONMENT = ("BACKEND", "REMOTES", "ENV_POOL")
+# the tools that run the tests, not part of them
+NOT_HARNESS = {"benchmark.py", "matrix.py", "resultcache.py", "soak.py"}
+HARNESS = ["*.py", "pytest.ini", "configs/*", "tests/conftest.py", "tests/__init__.py"]
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def harness_digest(root=ROOT):
+    """
+    :return: one hash over the files of the harness, see HARNESS
+    """
+    digest = hashlib.sha256()
+    for pattern in HARNESS:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            if os.path.basename(path) in NOT_HARNESS or not os.path.isfile(path):
+                continue
+            digest.update("{} {}\n".format(os.path.relpath(path, root), file_digest(path)).encode())
+    return digest.hexdigest()
+
+
+def remote_identity(branch, root=ROOT):
+    """
+    :return: what the image of a branch would be built from, like scripts/build-images.sh labels it,
+             or None when the head of the branch can't be found
+    """
+    try:
+        output = subprocess.run(["git", "ls-remote", SVXLINK_REPO, "refs/heads/{}".format(branch)],
+                                capture_output=True, check=True, text=True, timeout=60).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if not output.strip():
+        return None
+    return "{}:{}".format(output.split()[0], file_digest(os.path.join(root, "Dockerfile")))
+
+
+def image_identity(branch, backend="docker"):
+    """
+    :return: what identifies the build of svxlink for a branch, see remote_identity when there is no image,
+             or None when that is unknown as well
+    """
+    if backend == "sim":
+        return "sim"
+    try:
+        output = subprocess.run(["docker", "image", "inspect", "svxlink:{}".format(branch)],
+                                capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return remote_identity(branch)
+    image = json.loads(output)[0]
+    labels = (image.get("Config") or {}).get("Labels") or {}
+    if labels.get(REVISION_LABEL) and labels.get(DOCKERFILE_LABEL):
+        return "{}:{}".format(labels[REVISION_LABEL], labels[DOCKERFILE_LABEL])
+    return image["Id"]
+
+
+def environment_settings(environ=None):
+    environ = os.environ if environ is None else environ
+    return {name: environ.get(name, "") for name in ENVIRONMENT}
+
+
+class ResultCache:
+    """
+    The passed results per fingerprint.
+
+    Example of usage :
+
+        cache = ResultCache()
+        image = image_identity("hobbyscoop")
+        key = cache.fingerprint("hobbyscoop", image, "tests/test_original.py::Test::test_switchover_with_squelch")
+        if cache.get(key) is None:
+            ... run the test ...
+            cache.put(key, "hobbyscoop", test_id, "passed", 12.5)
+    """
+
+    def __init__(self, directory=CACHE_DIR, root=ROOT, environ=None):
+        """
+        :param directory: where the results are kept
+        :param root: the root of the harness, test ids are relative to it
+        :param environ: the environment the tests run with, defaults to os.environ
+        """
+        self.log = logging.getLogger(__class__.__name__)
+        self.directory = directory
+        self.root = root
+        self.harness = harness_digest(root)
+        self.settings = environment_settings(environ)
+        self._test_files = {}
+
+    def test_file_digest(self, test_id):
+        path = os.path.join(self.root, test_id.split("::")[0])
+        if path not in self._test_files:
+            self._test_files[path] = file_digest(path) if os.path.isfile(path) else ""
+        return self._test_files[path]
+
+    def fingerprint(self, branch, image, test_id):
+        """
+        :param branch: the svxlink branch
+        :param image: see image_identity
+        :param test_id: a pytest node id
+        :return: the hex digest of everything the result of the test depends on
+        """
+        parts = {"branch": branch, "image": image, "test": test_id, "test_file": self.test_file_digest(test_id),
+                 "harness": self.harness, "environment": self.settings}
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], "{}.json".format(key))
+
+    def get(self, key):
+        """
+        :return: the stored result as a dict with outcome, duration, branch, test and time, or None
+        """
+        try:
+            with open(self.path(key), "r") as source:
+                return json.load(source)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, branch, test_id, outcome, duration, message=""):
+        """
+        stores a result, when it passed
+        :return: True when it was stored
+        """
+        if outcome != "passed":
+            return False
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write the whole file before it shows up, another run may be reading the cache
+        temporary = "{}.{}".format(path, os.getpid())
+        with open(temporary, "w") as output:
+            json.dump({"branch": branch, "test": test_id, "outcome": outcome, "duration": duration,
+                       "message": message, "time": time()}, output)
+        os.replace(temporary, path)
+        return True
@@ -1,10 +1,25 @@
 #!/bin/bash
+# builds svxlink:<branch>, unless it was already built from the same svxlink revision and Dockerfile. FORCE=1 rebuilds.
 set -e
-git clone https://github.com/hobbyscoop/svxlink.git || true
-cd svxlink
+repository=https://github.com/hobbyscoop/svxlink.git
 branch=${1:-hobbyscoop}
+dockerfile=$(sha256sum Dockerfile | cut -d' ' -f1)
+
+# what the image would be built from, known before cloning, see resultcache.py
+revision=$(git ls-remote "${repository}" "refs/heads/${branch}" | cut -f1)
+built=$(docker image inspect -f '{{ index .Config.Labels "org.opencontainers.image.revision" }} {{ index .Config.Labels "svxlink-testing.dockerfile" }}' "svxlink:${branch}" 2>/dev/null || true)
+if [ "${FORCE:-0}" != "1" ] && [ -n "${revision}" ] && [ "${built}" == "${revision} ${dockerfile}" ]; then
+  echo "svxlink:${branch} is up to date with ${revision}, set FORCE=1 to rebuild"
+  exit 0
+fi
+
+git clone "${repository}" || true
+cd svxlink
 echo "BUILDING FOR ${branch}"
 git checkout "${branch}"
 git pull
+revision=$(git rev-parse HEAD)
 
-docker build --progress=plain -f ../Dockerfile -t "svxlink:${branch}" .
+docker build --progress=plain -f ../Dockerfile -t "svxlink:${branch}" \
+  --label "org.opencontainers.image.revision=${revision}" \
+  --label "svxlink-testing.dockerfile=${dockerfile}" .
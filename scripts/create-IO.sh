@@ -1,3 +1,3 @@
 #!/bin/bash
-rm -rf ptt state audio log
-touch  ptt state audio log
+rm -rf ptt state audio spectrum tone_events log
+touch  ptt state audio spectrum tone_events log
@@ -0,0 +1,580 @@
+"""
+This module is a pure-Python stand-in for svxlink and its remotes, so the harness, the tone detection and the tests
+can run without docker.
+
+It has the same observable interfaces as the containers:
+- a squelch input per remote, taking O and Z like /tmp/sql
+- voter commands, both ENABLE/MUTE and the old name:1/name:0 syntax, like /dev/shm/voter
+- the voter state in the state capture, as JSON or in the old remote1*+1000 format
+- T and R in the ptt capture
+- 16 bit stereo UDP audio carrying the tone of the active remote, decoded by goertzel.py into the audio ring,
+  and summarized every second into the spectrum capture, its tone changes tracked into the tone events capture
+
+The voter follows the timing from configs/svxlink.conf (VOTING_DELAY, HYSTERESIS, SQL_CLOSE_REVOTE_DELAY,
+RX_SWITCH_DELAY, REVOTE_INTERVAL, IDLE_TIMEOUT), and the remotes their siglev and tone from configs/<name>.conf.
+How a muted receiver is handled depends on the branch being simulated:
+- hobbyscoop: MUTE forces the squelch closed for the voter, and deselects the receiver
+- old: disabling deselects the receiver, the squelch state is kept
+- master: MUTE doesn't deselect an active receiver, it stays selected without audio
+
+Run it in-process with BACKEND=sim pytest, or as a separate process with FIFOs as inputs:
+    python simulator.py --directory runs/sim
+"""
+import argparse
+import configparser
+import json
+import logging
+import os
+import re
+import socket
+from threading import Condition, Event, Thread
+from time import monotonic, sleep, time
+
+import numpy as np
+
+from environment import Environment
+from goertzel import AudioRing, SignatureDecoder, SpectrumAnalyzer, StreamingDetector, ToneTracker, signature_value
+from stack import ROOT
+
+
+def read_config(path):
+    """
+    read an svxlink config file
+    :param path:
+    :return: a RawConfigParser, with the case of the keys preserved
+    """
+    parser = configparser.RawConfigParser(inline_comment_prefixes=("#",), strict=False)
+    parser.optionxform = str
+    if not parser.read(path):
+        raise FileNotFoundError(path)
+    return parser
+
+
+class SimReceiver:
+    """
+    A remote receiver, as the voter sees it.
+    `sql_open` is what the remote reports, `voter_sql` is what the voter uses to select, these differ after a
+    squelch was forced closed on MUTE.
+    """
+
+    def __init__(self, name, siglev, tone):
+        self.name = name
+        self.siglev = siglev
+        self.tone = tone
+        self.enabled = True
+        self.sql_open = False
+        self.voter_sql = False
+        self.ignore_squelch = False
+        self.active = False
+
+    @property
+    def selectable(self):
+        return self.enabled and self.voter_sql
+
+    def as_dict(self):
+        return {
+            "active": self.active,
+            "enabled": self.enabled,
+            "id": "?",
+            "name": self.name,
+            "siglev": self.siglev,
+            "sql_open": self.sql_open,
+        }
+
+    def old_format(self):
+        if not self.enabled:
+            status = "#"
+        elif self.active:
+            status = "*"
+        elif self.sql_open:
+            status = ":"
+        else:
+            status = "_"
+        return "{}{}{:+04d}".format(self.name, status, self.siglev)
+
+
+class SimVoter:
+    """
+    Model of the svxlink voter and the repeater logic behind it.
+    All changes happen under one condition, timers are handled by a single thread.
+    """
+
+    def __init__(self, receivers, timing, state_path, ptt_path, flavor="hobbyscoop"):
+        self.log = logging.getLogger(__class__.__name__)
+        self.receivers = {receiver.name: receiver for receiver in receivers}
+        self.timing = timing
+        self.state_path = state_path
+        self.ptt_path = ptt_path
+        self.flavor = flavor
+        self.condition = Condition()
+        self.timers = {}
+        self.active = None
+        self.switch_to = None
+        self.tx_on = False
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._thread = Thread(target=self._loop, name="sim-voter", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self.condition:
+            self._running = False
+            self.condition.notify_all()
+        if self._thread:
+            self._thread.join()
+        self._thread = None
+
+    def _loop(self):
+        with self.condition:
+            while self._running:
+                now = monotonic()
+                for name in sorted(self.timers, key=self.timers.get):
+                    # an earlier handler may have cancelled or moved this timer
+                    deadline = self.timers.get(name)
+                    if deadline is not None and deadline <= now:
+                        del self.timers[name]
+                        getattr(self, "on_" + name)()
+                timeout = min(self.timers.values(), default=now + 1) - monotonic()
+                self.condition.wait(max(0, timeout))
+
+    def schedule(self, name, delay_ms):
+        self.timers[name] = monotonic() + delay_ms / 1000.0
+        self.condition.notify_all()
+
+    def best(self):
+        candidates = [receiver for receiver in self.receivers.values() if receiver.selectable]
+        return max(candidates, key=lambda receiver: receiver.siglev, default=None)
+
+    def set_active(self, receiver):
+        if self.active is receiver:
+            return
+        self.log.debug("active: %s", receiver.name if receiver else None)
+        if self.active:
+            self.active.active = False
+        self.active = receiver
+        self.timers.pop("switch", None)
+        if receiver:
+            receiver.active = True
+            self.timers.pop("idle", None)
+            self.set_tx(True)
+            self.schedule("revote", self.timing["REVOTE_INTERVAL"])
+        else:
+            self.timers.pop("revote", None)
+            self.schedule("idle", self.timing["IDLE_TIMEOUT"])
+        self.write_state()
+
+    def set_tx(self, on):
+        if self.tx_on == on:
+            return
+        self.tx_on = on
+        with open(self.ptt_path, "a") as ptt:
+            ptt.write("T" if on else "R")
+
+    def write_state(self):
+        if self.flavor == "old":
+            state = " ".join(receiver.old_format() for receiver in self.receivers.values())
+        else:
+            state = json.dumps([receiver.as_dict() for receiver in self.receivers.values()])
+        with open(self.state_path, "a") as state_file:
+            state_file.write("{:.3f} Voter:sql_state {}\n".format(time(), state))
+
+    # timers
+    def on_select(self):
+        if self.active is None:
+            self.set_active(self.best())
+
+    def on_revote(self):
+        best = self.best()
+        if self.active and best and best is not self.active and "switch" not in self.timers:
+            if best.siglev > self.active.siglev + self.timing["HYSTERESIS"]:
+                self.switch_to = best
+                self.schedule("switch", self.timing["RX_SWITCH_DELAY"])
+        if self.active:
+            # the voter keeps reporting while a receiver is selected
+            self.write_state()
+            self.schedule("revote", self.timing["REVOTE_INTERVAL"])
+
+    def on_switch(self):
+        if self.switch_to and self.switch_to.selectable:
+            self.set_active(self.switch_to)
+        self.switch_to = None
+
+    def on_sql_close_revote(self):
+        if self.active is None or not self.active.selectable:
+            self.set_active(self.best())
+
+    def on_idle(self):
+        if self.active is None:
+            self.set_tx(False)
+
+    # inputs
+    def squelch(self, name, is_open):
+        """
+        the squelch state a remote reports
+        :param name: receiver name
+        :param is_open:
+        :return:
+        """
+        with self.condition:
+            receiver = self.receivers[name]
+            if receiver.ignore_squelch:
+                return
+            receiver.sql_open = is_open
+            receiver.voter_sql = is_open
+            self.voter_sql_changed(receiver)
+            self.write_state()
+
+    def voter_sql_changed(self, receiver):
+        if receiver.selectable and self.active is None and "select" not in self.timers:
+            self.schedule("select", self.timing["VOTING_DELAY"])
+        if receiver is self.active and not receiver.selectable:
+            self.schedule("sql_close_revote", self.timing["SQL_CLOSE_REVOTE_DELAY"])
+
+    def command(self, line):
+        """
+        a voter command: ENABLE/MUTE/DISABLE name, or name:1/name:0
+        :param line:
+        :return:
+        """
+        line = line.strip()
+        if not line:
+            return
+        match = re.match(r"^(\w+):([01])$", line)
+        if match:
+            name, action = match.group(1), "ENABLE" if match.group(2) == "1" else "DISABLE"
+        else:
+            try:
+                action, name = line.split(None, 1)
+            except ValueError:
+                self.log.warning("unknown voter command: %s", line)
+                return
+        with self.condition:
+            receiver = self.receivers.get(name)
+            if receiver is None:
+                self.log.warning("unknown receiver in voter command: %s", line)
+                return
+            action = action.upper()
+            if action == "ENABLE":
+                receiver.enabled = True
+                receiver.ignore_squelch = False
+            elif action in ("MUTE", "DISABLE"):
+                receiver.enabled = False
+                if self.flavor == "master":
+                    if action == "MUTE":
+                        # MUTE_CONTENT: the receiver stays selected, without audio
+                        self.write_state()
+                        return
+                    # MUTE_ALL: the squelch updates don't come in at all anymore
+                    receiver.ignore_squelch = True
+                    receiver.voter_sql = False
+                elif self.flavor == "hobbyscoop":
+                    # force close squelch on MUTE
+                    receiver.voter_sql = False
+            else:
+                self.log.warning("unknown voter command: %s", line)
+                return
+            self.voter_sql_changed(receiver)
+            self.write_state()
+
+    @property
+    def audible(self):
+        """
+        the receiver whose audio goes out, if any
+        :return:
+        """
+        with self.condition:
+            if self.tx_on and self.active and self.active.enabled:
+                return self.active
+            return None
+
+
+class AudioGenerator:
+    """
+    Sends the audio that goes out of the transmitter as 16 bit stereo UDP datagrams, in real time,
+    like svxlink does with AUDIO_DEV=udp:127.0.0.1:10000
+    """
+    block_frames = 320
+    amplitude = 16000
+
+    def __init__(self, voter, target, sample_rate=16000, channel=0):
+        self.voter = voter
+        self.target = target
+        self.sample_rate = sample_rate
+        self.channel = channel
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._phase = 0.0
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = Thread(target=self._loop, name="sim-audio", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.sock.close()
+
+    def block(self, tone):
+        frames = np.zeros((self.block_frames, 2), dtype="<i2")
+        if tone:
+            step = 2 * np.pi * tone / self.sample_rate
+            phases = self._phase + step * np.arange(self.block_frames)
+            frames[:, self.channel] = self.amplitude * np.sin(phases)
+            self._phase = (self._phase + step * self.block_frames) % (2 * np.pi)
+        return frames.tobytes()
+
+    def _loop(self):
+        period = self.block_frames / self.sample_rate
+        deadline = monotonic()
+        while not self._stop.is_set():
+            if self.voter.tx_on:
+                receiver = self.voter.audible
+                self.sock.sendto(self.block(receiver.tone if receiver else None), self.target)
+            deadline += period
+            self._stop.wait(max(0, deadline - monotonic()))
+
+
+class SimShell:
+    """
+    Takes the shell commands the environment sends to a container over its control channel,
+    and hands them to the simulator
+    """
+    def __init__(self, simulator, name):
+        self.log = logging.getLogger(__class__.__name__).getChild(name)
+        self.simulator = simulator
+        self.name = name
+
+    def send(self, *commands):
+        for command in commands:
+            match = re.match(r"^echo (.*) > (\S+)$", command.strip())
+            if not match:
+                self.log.warning("can't simulate: %s", command)
+                continue
+            self.simulator.write(self.name, match.group(2), match.group(1))
+
+    def close(self):
+        pass
+
+
+class Simulator:
+    """
+    The voter, the remotes, the transmitter audio and the tone detector together.
+
+    Example of usage :
+
+        simulator = Simulator.from_configs("state", "ptt", "audio")
+        simulator.start()
+        simulator.write("remote1", "/tmp/sql", "O")
+    """
+
+    def __init__(self, receivers, timing, state_path, ptt_path, audio_path, flavor="hobbyscoop", sample_rate=16000,
+                 spectrum_path=None, events_path=None):
+        self.log = logging.getLogger(__class__.__name__)
+        self.voter = SimVoter(receivers, timing, state_path, ptt_path, flavor)
+        self.audio_path = audio_path
+        self.sample_rate = sample_rate
+        tones = sorted(receiver.tone for receiver in receivers)
+        decoder = SignatureDecoder(sample_rate, {tone: (tone,) for tone in tones})
+        analyzer = SpectrumAnalyzer(sample_rate, 1024, tones) if spectrum_path else None
+        tracker = ToneTracker(sample_rate, 512, tones, 16) if events_path else None
+        self.detector = StreamingDetector(("127.0.0.1", 0), sample_rate, decoder.window_size, decoder=decoder,
+                                          analyzer=analyzer, tracker=tracker)
+        self.spectrum_path = spectrum_path
+        self.spectrum = None
+        self.events_path = events_path
+        self.events = None
+        self.audio = None
+        self._threads = []
+        self.ring = AudioRing(audio_path)
+
+    @classmethod
+    def from_configs(cls, state_path, ptt_path, audio_path, flavor="hobbyscoop", config_dir=None, spectrum_path=None,
+                     events_path=None):
+        """
+        set up the simulator like the containers are set up, from configs/
+        :return:
+        """
+        config_dir = config_dir or os.path.join(ROOT, "configs")
+        svxlink = read_config(os.path.join(config_dir, "svxlink.conf"))
+        logic = svxlink["GLOBAL"]["LOGICS"].split(",")[0]
+        voter = svxlink[svxlink[logic]["RX"]]
+        timing = {key: int(voter.get(key, 0)) for key in
+                  ("VOTING_DELAY", "HYSTERESIS", "SQL_CLOSE_REVOTE_DELAY", "RX_SWITCH_DELAY", "REVOTE_INTERVAL")}
+        timing["IDLE_TIMEOUT"] = int(svxlink[logic].get("IDLE_TIMEOUT", 1)) * 1000
+        receivers = []
+        for name in voter["RECEIVERS"].split(","):
+            remote = read_config(os.path.join(config_dir, "{}.conf".format(name)))
+            rx = remote[remote[remote["GLOBAL"]["TRXS"]]["RX"]]
+            receivers.append(SimReceiver(name, int(rx["SIGLEV_DEFAULT"]), int(rx["SIM_TONE_FQ"])))
+        sample_rate = int(svxlink["GLOBAL"].get("CARD_SAMPLE_RATE", 16000))
+        return cls(receivers, timing, state_path, ptt_path, audio_path, flavor, sample_rate, spectrum_path, events_path)
+
+    @property
+    def receivers(self):
+        return self.voter.receivers
+
+    def start(self):
+        self.voter.start()
+        self.detector.open()
+        self.ring.create(self.detector.tones)
+        if self.spectrum_path:
+            self.spectrum = open(self.spectrum_path, "a", buffering=1)
+        if self.events_path:
+            self.events = open(self.events_path, "a", buffering=1)
+        thread = Thread(target=self.detector.run, args=(self.publish,),
+                        kwargs={"summary_callback": self.write_summary, "event_callback": self.write_event},
+                        name="sim-detector", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        self.audio = AudioGenerator(self.voter, self.detector.sock.getsockname(), self.sample_rate)
+        self.audio.start()
+
+    def stop(self):
+        if self.audio:
+            self.audio.stop()
+        self.detector.close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.voter.stop()
+        self.ring.close()
+        if self.spectrum:
+            self.spectrum.close()
+            self.spectrum = None
+        if self.events:
+            self.events.close()
+            self.events = None
+
+    def publish(self, label, powers):
+        self.ring.publish(signature_value(label), powers)
+
+    def write_summary(self, summary):
+        self.spectrum.write(json.dumps(summary) + "\n")
+
+    def write_event(self, event):
+        self.events.write(json.dumps(event) + "\n")
+
+    def write(self, container, path, data):
+        """
+        what `echo data > path` does in a container
+        :param container: svxlink, or the name of a remote
+        :param path: /tmp/sql in a remote, /dev/shm/voter in svxlink
+        :param data:
+        :return:
+        """
+        if path == "/tmp/sql" and container in self.receivers:
+            for char in data:
+                if char in "OZ":
+                    self.voter.squelch(container, char == "O")
+        elif path == "/dev/shm/voter" and container == "svxlink":
+            self.voter.command(data)
+        else:
+            self.log.warning("can't simulate writing %r to %s in %s", data, path, container)
+
+    def shell(self, container):
+        return SimShell(self, container)
+
+    def serve_fifos(self, directory):
+        """
+        create FIFOs for the inputs, so other processes can write to them:
+        <name>.sql for the squelch of each remote, and voter for the voter commands
+        :param directory:
+        :return:
+        """
+        inputs = {"{}.sql".format(name): (name, "/tmp/sql") for name in self.receivers}
+        inputs["voter"] = ("svxlink", "/dev/shm/voter")
+        for filename, (container, path) in inputs.items():
+            fifo = os.path.join(directory, filename)
+            if not os.path.exists(fifo):
+                os.mkfifo(fifo)
+            thread = Thread(target=self._read_fifo, args=(fifo, container, path), name="sim-" + filename, daemon=True)
+            thread.start()
+
+    def _read_fifo(self, fifo, container, path):
+        # opened for writing as well, so it doesn't hit EOF when a writer closes it
+        with open(os.open(fifo, os.O_RDWR), "r") as commands:
+            for line in commands:
+                self.write(container, path, line.strip())
+
+
+class SimEnvironment(Environment):
+    """
+    The environment, backed by the simulator instead of docker
+    """
+    backend = "sim"
+
+    def __init__(self, stack=None):
+        super().__init__(stack)
+        self.log = logging.getLogger(__class__.__name__)
+        self.simulator = None
+
+    def connect(self):
+        return None
+
+    def start(self):
+        self.log.info("starting simulator")
+        if self.simulator:
+            self.stop()
+        self.stack.render(self.branch)
+        for reader in (self.state_reader, self.ptt_reader, self.spectrum_reader, self.tone_events_reader):
+            open(reader.path, "w").close()
+            reader.reset()
+        self.spectrum = []
+        self.tracked = []
+        self.audio_ring.close()
+        self.simulator = Simulator.from_configs(self.state_reader.path, self.ptt_reader.path, self.audio_ring.path,
+                                                flavor=self.branch,
+                                                config_dir=os.path.dirname(self.stack.config_path("svxlink.conf")),
+                                                spectrum_path=self.spectrum_reader.path,
+                                                events_path=self.tone_events_reader.path)
+        self.simulator.start()
+        self.watcher.start()
+        self.log.info("startup done")
+        return True
+
+    def stop(self):
+        self.log.info("stopping simulator")
+        self.watcher.stop()
+        if self.simulator:
+            self.simulator.stop()
+            self.simulator = None
+
+    @property
+    def running(self):
+        return 1 + len(self.remotes) if self.simulator else 0
+
+    def control(self, name):
+        return self.simulator.shell(name)
+
+    def start_pty_forwarder(self, name):
+        pass
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="run the svxlink stand-in, with FIFOs as inputs")
+    parser.add_argument("--directory", default=".", help="where the captures and the FIFOs go")
+    parser.add_argument("--branch", default=os.environ.get("BRANCH", "hobbyscoop"), help="branch behaviour to simulate")
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    paths = [os.path.join(args.directory, name) for name in ("state", "ptt", "audio", "spectrum", "tone_events")]
+    for path in paths:
+        open(path, "w").close()
+    simulator = Simulator.from_configs(*paths[:3], flavor=args.branch, spectrum_path=paths[3], events_path=paths[4])
+    simulator.serve_fifos(args.directory)
+    simulator.start()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == "__main__":
+    main()
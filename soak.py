@@ -0,0 +1,521 @@
+"""
+This module soaks the voter with squelch storms: randomized or scripted squelch and enable/disable patterns across all
+remotes, at up to hundreds of events per second, for minutes at a time, like weak mobile stations flapping.
+
+Every injected event is correlated with the state lines and PTT edges that follow it, and the run is reported as:
+- throughput: state lines and PTT edges per second
+- transitions: injected events seen in the state, coalesced (undone before the voter showed them),
+  missed (held long enough, never shown), or masked (a squelch change of a disabled remote)
+- ptt: for every event that changed whether any remote is active, the PTT edge that should follow it: seen with its
+  delay, held (the transmitter was already in that state, or the change was undone before the edge), or missing
+- events: per injected event, its outcome and delay in the state, and the PTT edge expected after it
+- stuck: remotes that stayed active with their squelch closed, and the PTT left on at the end
+- resources: CPU and memory of the containers, or of this process for the simulator
+
+Usage:
+    BACKEND=sim python soak.py --rate 200 --duration 60
+    python soak.py --script storm.json   # [[0.0, "open", "remote1"], [0.005, "close", "remote1"], ...]
+"""
+import argparse
+from collections import OrderedDict
+import json
+import logging
+import os
+import random
+import resource
+from threading import Event, Thread
+from time import monotonic, sleep, strftime, time
+
+import numpy as np
+
+from stack import ROOT
+from stateparser import StateHistory
+
+OUTPUT_DIR = os.path.join(ROOT, "runs", "soak")
+# the kinds of events, the state field they change and the value they set it to
+KINDS = OrderedDict([
+    ("open", ("sql_open", 1)),
+    ("close", ("sql_open", 0)),
+    ("enable", ("enabled", 1)),
+    ("disable", ("enabled", 0)),
+])
+
+
+class Injection:
+    """
+    one event to inject, `at` seconds after the start of the run; `sent` and `wall` are filled in when it was sent
+    """
+    __slots__ = ("at", "kind", "remote", "sent", "wall")
+
+    def __init__(self, at, kind, remote):
+        if kind not in KINDS:
+            raise ValueError("unknown event {}, should be one of {}".format(kind, ", ".join(KINDS)))
+        self.at = at
+        self.kind = kind
+        self.remote = remote
+        self.sent = None
+        self.wall = None
+
+    def __repr__(self):
+        return "Injection({:.3f}, {!r}, {!r})".format(self.at, self.kind, self.remote)
+
+
+def random_pattern(remotes, rate, duration, seed=None, toggle_ratio=0.05):
+    """
+    squelch flapping at random intervals, like a Poisson process, with the occasional enable or disable
+    :param remotes: the remote names
+    :param rate: events per second, over all remotes
+    :param duration: in seconds
+    :param seed: for a reproducible pattern
+    :param toggle_ratio: the share of events that enable or disable a remote instead of flapping its squelch
+    :return: a list of Injection, in order
+    """
+    generator = random.Random(seed)
+    squelch = {name: False for name in remotes}
+    enabled = {name: True for name in remotes}
+    pattern = []
+    at = generator.expovariate(rate)
+    while at < duration:
+        remote = generator.choice(remotes)
+        if generator.random() < toggle_ratio:
+            enabled[remote] = not enabled[remote]
+            kind = "enable" if enabled[remote] else "disable"
+        else:
+            squelch[remote] = not squelch[remote]
+            kind = "open" if squelch[remote] else "close"
+        pattern.append(Injection(at, kind, remote))
+        at += generator.expovariate(rate)
+    return pattern
+
+
+def load_script(path):
+    """
+    a scripted pattern: a json list of [seconds, kind, remote]
+    :param path:
+    :return: a list of Injection, in order
+    """
+    with open(path) as script:
+        return sorted((Injection(float(at), kind, remote) for at, kind, remote in json.load(script)),
+                      key=lambda injection: injection.at)
+
+
+def closing(remotes, at):
+    """
+    close every squelch and enable every remote, to end a run in a known state
+    """
+    return [Injection(at, "close", name) for name in remotes] + [Injection(at, "enable", name) for name in remotes]
+
+
+class ResourceSampler:
+    """
+    Samples the CPU and memory use of the containers of an environment, or of this process when there is no docker.
+    """
+
+    def __init__(self, env, interval=1.0):
+        self.log = logging.getLogger(__class__.__name__)
+        self.env = env
+        self.interval = interval
+        self.samples = {}
+        self._stop = Event()
+        self._thread = None
+        self._last = None
+
+    def start(self):
+        self._thread = Thread(target=self._loop, name="soak-resources", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.env.client is None:
+                    self._sample_process()
+                else:
+                    self._sample_containers()
+            except Exception as e:
+                self.log.warning("can't sample resources: %s", e)
+            self._stop.wait(self.interval)
+
+    def _add(self, name, cpu, memory):
+        self.samples.setdefault(name, []).append((cpu, memory))
+
+    def _sample_process(self):
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        now = (monotonic(), usage.ru_utime + usage.ru_stime)
+        if self._last:
+            cpu = 100.0 * (now[1] - self._last[1]) / max(now[0] - self._last[0], 1e-6)
+            with open("/proc/self/statm") as statm:
+                memory = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+            self._add("simulator", cpu, memory)
+        self._last = now
+
+    def _sample_containers(self):
+        for name, container in self.env.containers.items():
+            stats = container.stats(stream=False)
+            cpu_delta = stats["cpu_stats"]["cpu_usage"]["total_usage"] - stats["precpu_stats"]["cpu_usage"]["total_usage"]
+            system_delta = stats["cpu_stats"].get("system_cpu_usage", 0) - stats["precpu_stats"].get("system_cpu_usage", 0)
+            cpus = stats["cpu_stats"].get("online_cpus", 1)
+            cpu = 100.0 * cpu_delta / system_delta * cpus if system_delta > 0 else 0.0
+            self._add(name, cpu, stats["memory_stats"].get("usage", 0))
+
+    def summary(self):
+        """
+        :return: mean and max CPU in percent, and max memory in MB, per container
+        """
+        summary = OrderedDict()
+        for name, samples in sorted(self.samples.items()):
+            cpu = np.array([sample[0] for sample in samples])
+            summary[name] = {"cpu_mean": float(cpu.mean()), "cpu_max": float(cpu.max()),
+                             "memory_max_mb": max(sample[1] for sample in samples) / 1e6, "samples": len(samples)}
+        return summary
+
+
+class Soak:
+    """
+    Injects a pattern into an environment, recording when every event was sent and when state lines and PTT edges
+    came in, and analyses the run.
+
+    Example of usage :
+
+        soak = Soak(env, random_pattern(env.remotes, rate=200, duration=60, seed=1))
+        report = soak.run()
+        print("\\n".join(format_report(report)))
+    """
+
+    def __init__(self, env, pattern, hold=0.5, stuck_after=2.0, settle=3.0, resource_interval=1.0):
+        """
+        :param env: a started Environment
+        :param pattern: a list of Injection
+        :param hold: how long an event should stand before the voter is expected to have shown it, in seconds
+        :param stuck_after: how long a remote may stay active with its squelch closed, in seconds
+        :param settle: how long to wait for the voter to go idle after the pattern, in seconds
+        :param resource_interval: in seconds between resource samples
+        """
+        self.log = logging.getLogger(__class__.__name__)
+        self.env = env
+        self.pattern = pattern
+        self.hold = hold
+        self.stuck_after = stuck_after
+        self.settle = settle
+        self.resources = ResourceSampler(env, resource_interval)
+        self.late = []
+
+    def inject(self, injection):
+        if injection.kind in ("open", "close"):
+            self.env.open_squelch(injection.remote, injection.kind == "open")
+        elif injection.kind == "enable":
+            self.env.enable_remote(injection.remote)
+        else:
+            self.env.disable_remote(injection.remote)
+
+    def run(self):
+        """
+        inject the pattern in real time, then close all squelches and let the voter settle
+        :return: the report
+        """
+        self.env.truncate_captures()
+        end = self.pattern[-1].at if self.pattern else 0.0
+        pattern = self.pattern + closing(self.env.remotes, end + self.hold)
+        self.resources.start()
+        start_wall = time()
+        start = monotonic()
+        try:
+            for injection in pattern:
+                delay = start + injection.at - monotonic()
+                if delay > 0:
+                    sleep(delay)
+                elif delay < -0.05:
+                    self.late.append(-delay)
+                injection.sent = monotonic() - start
+                injection.wall = time()
+                self.inject(injection)
+            self.env.wait_for_ptt_off(self.settle)
+            sleep(min(self.settle, 0.5))
+            # catch up on what the watcher hasn't handed over yet
+            self.env.state_reader.poll()
+            self.env.ptt_reader.poll()
+        finally:
+            self.resources.stop()
+        duration = monotonic() - start
+        history = StateHistory.from_file(self.env.state_reader.path)
+        # the environment keeps the PTT edges since the captures were truncated, timed when they were read
+        report = analyse(pattern, history, list(self.env.ptt_edges), self.env.remotes, start_wall, duration,
+                         self.hold, self.stuck_after)
+        report["resources"] = self.resources.summary()
+        report["injection"] = {"events": len(pattern), "late": len(self.late),
+                               "max_late_ms": max(self.late) * 1000 if self.late else 0.0}
+        return report
+
+
+def analyse(pattern, history, ptt_edges, remotes, start, duration, hold=0.5, stuck_after=2.0):
+    """
+    correlate the injected events with the state lines and PTT edges
+    :param pattern: the sent Injections, with their wall clock times
+    :param history: the StateHistory of the run
+    :param ptt_edges: (wall clock time, state) per PTT edge
+    :param remotes: the remote names
+    :param start: the wall clock time the run started
+    :param duration: of the run, in seconds
+    :param hold: an event is missed when it stood this long without being shown, coalesced when it stood shorter
+    :param stuck_after: a remote is stuck when it stays active with its squelch closed for this long, in seconds
+    :return: the report, as a dict
+    """
+    counts = OrderedDict((outcome, 0) for outcome in ("seen", "coalesced", "missed", "masked"))
+    per_remote = OrderedDict((name, OrderedDict((outcome, 0) for outcome in counts)) for name in remotes)
+    delays = []
+    missed = []
+    events = []
+    lines = []
+    ptt_counts = OrderedDict((outcome, 0) for outcome in ("seen", "held", "missing"))
+    ptt_delays = []
+    ptt_missing = []
+    any_active = (history.columns["active"] == 1).any(axis=1) if len(history) else np.zeros(0, dtype=bool)
+    edges = PttEdges(ptt_edges)
+    enabled = {name: True for name in remotes}
+    sent = [injection for injection in pattern if injection.wall is not None]
+    # an event stands until the next event on the same field of the same remote
+    until = [float("inf")] * len(sent)
+    next_wall = {}
+    for index in range(len(sent) - 1, -1, -1):
+        key = (sent[index].remote, KINDS[sent[index].kind][0])
+        until[index] = next_wall.get(key, float("inf"))
+        next_wall[key] = sent[index].wall
+    for index, injection in enumerate(sent):
+        field, value = KINDS[injection.kind]
+        masked = field == "sql_open" and not enabled[injection.remote]
+        if field == "enabled":
+            enabled[injection.remote] = bool(value)
+        outcome, delay, line = correlate(history, injection, field, value, until[index], hold)
+        if masked and outcome != "seen":
+            outcome = "masked"
+        counts[outcome] += 1
+        if injection.remote in per_remote:
+            per_remote[injection.remote][outcome] += 1
+        if delay is not None:
+            delays.append(delay)
+        if outcome == "missed":
+            missed.append({"at": injection.sent, "kind": injection.kind, "remote": injection.remote})
+        events.append(OrderedDict([("at", injection.sent), ("kind", injection.kind), ("remote", injection.remote),
+                                   ("state", outcome), ("state_delay_ms", None if delay is None else delay * 1000),
+                                   ("ptt", None), ("ptt_outcome", None), ("ptt_delay_ms", None)]))
+        lines.append(line)
+
+    for index, change in expected_ptt(history, any_active, lines):
+        expected = bool(any_active[change])
+        ptt_outcome, ptt_delay = edges.correlate(expected, sent[index].wall,
+                                                 next_change(history, any_active, change) + hold)
+        ptt_counts[ptt_outcome] += 1
+        events[index].update(ptt="on" if expected else "off", ptt_outcome=ptt_outcome,
+                             ptt_delay_ms=None if ptt_delay is None else ptt_delay * 1000)
+        if ptt_delay is not None:
+            ptt_delays.append(ptt_delay)
+        if ptt_outcome == "missing":
+            ptt_missing.append({"at": sent[index].sent, "kind": sent[index].kind, "remote": sent[index].remote,
+                                "ptt": events[index]["ptt"]})
+
+    times = history.times[history.times >= start] if len(history) else np.zeros(0)
+    per_second = np.bincount((times - start).astype(int)) if len(times) else np.zeros(1, dtype=int)
+    delays = np.array(delays) if delays else np.zeros(1)
+    ptt_delays = np.array(ptt_delays) if ptt_delays else np.zeros(1)
+    return OrderedDict([
+        ("duration", duration),
+        ("throughput", {
+            "state_lines": int(len(times)),
+            "state_lines_per_second": len(times) / duration if duration else 0.0,
+            "state_lines_peak_per_second": int(per_second.max()),
+            "ptt_edges": len(ptt_edges),
+            "ptt_edges_per_second": len(ptt_edges) / duration if duration else 0.0,
+        }),
+        ("transitions", counts),
+        ("per_remote", per_remote),
+        ("state_delay_ms", {"p50": float(np.percentile(delays, 50)) * 1000,
+                            "p95": float(np.percentile(delays, 95)) * 1000, "max": float(delays.max()) * 1000}),
+        ("missed", missed[:100]),
+        ("ptt", ptt_counts),
+        ("ptt_delay_ms", {"p50": float(np.percentile(ptt_delays, 50)) * 1000,
+                          "p95": float(np.percentile(ptt_delays, 95)) * 1000, "max": float(ptt_delays.max()) * 1000}),
+        ("ptt_missing", ptt_missing[:100]),
+        ("stuck", stuck_remotes(history, stuck_after)),
+        ("ptt_on_at_end", bool(ptt_edges and ptt_edges[-1][1])),
+        ("events", events),
+    ])
+
+
+def correlate(history, injection, field, value, until, hold):
+    """
+    find the first state line after an injection that shows its value, before the next injection on the same field
+    :return: the outcome (seen, coalesced or missed), and the delay in seconds and the index of the line when seen
+    """
+    if not len(history) or injection.remote not in history.names:
+        return ("missed" if until - injection.wall >= hold else "coalesced"), None, None
+    times = history.times
+    column = history.column(injection.remote, field)
+    # state lines have millisecond timestamps
+    first = int(np.searchsorted(times, injection.wall - 0.001))
+    last = int(np.searchsorted(times, until + 0.001, side="right")) if until != float("inf") else len(times)
+    shown = np.flatnonzero(column[first:last] == value)
+    if len(shown):
+        line = first + int(shown[0])
+        return "seen", max(0.0, float(times[line]) - injection.wall), line
+    return ("missed" if until - injection.wall >= hold else "coalesced"), None, None
+
+
+def expected_ptt(history, any_active, lines):
+    """
+    The transmitter is on while any remote is active. Every change of that is caused by the last event shown before
+    it, later changes without an event in between are the voter's own, like a revote.
+    :param any_active: per state line, whether any remote is active
+    :param lines: per sent event, the index of the state line that showed it, or None when it wasn't shown
+    :return: (index of the event, index of the state line where any remote active changed) per expected PTT edge
+    """
+    shown = [(line, index) for index, line in enumerate(lines) if line is not None]
+    if not shown:
+        return []
+    shown.sort()
+    shown_lines = np.array([line for line, _ in shown])
+    changes = np.flatnonzero(np.diff(np.concatenate(([False], any_active)).astype(np.int8)))
+    expected, caused = [], set()
+    for change in changes:
+        position = int(np.searchsorted(shown_lines, change, side="right")) - 1
+        if position >= 0 and shown[position][1] not in caused:
+            caused.add(shown[position][1])
+            expected.append((shown[position][1], int(change)))
+    return expected
+
+
+def next_change(history, any_active, line):
+    """
+    :return: the time of the first state line after `line` where whether any remote is active changed again, or inf
+    """
+    changes = np.flatnonzero(any_active[line + 1:] != any_active[line])
+    return float(history.times[line + 1 + changes[0]]) if len(changes) else float("inf")
+
+
+class PttEdges:
+    """
+    The PTT edges of a run, to find the edge that follows an event
+    """
+
+    def __init__(self, ptt_edges):
+        self.times = np.array([edge[0] for edge in ptt_edges], dtype=np.float64)
+        self.states = np.array([bool(edge[1]) for edge in ptt_edges], dtype=bool)
+
+    def state_at(self, time):
+        index = int(np.searchsorted(self.times, time, side="right")) - 1
+        return bool(self.states[index]) if index >= 0 else False
+
+    def correlate(self, expected, wall, until):
+        """
+        :param expected: the PTT state an event should lead to
+        :param wall: when the event was sent
+        :param until: the edge should come before this time, when the voter changed its mind again, or inf
+        :return: the outcome (seen, held or missing) and the delay in seconds when seen
+        """
+        first = int(np.searchsorted(self.times, wall))
+        last = int(np.searchsorted(self.times, until, side="right"))
+        found = np.flatnonzero(self.states[first:last] == expected)
+        if len(found):
+            return "seen", float(self.times[first + found[0]]) - wall
+        # already in that state, like an activation during the transmitter's tail, or undone before the edge came
+        if self.state_at(wall) == expected or until != float("inf"):
+            return "held", None
+        return "missing", None
+
+
+def stuck_remotes(history, stuck_after):
+    """
+    :return: per remote, the intervals it stayed active with its squelch closed for longer than `stuck_after`
+    """
+    stuck = OrderedDict()
+    if len(history) < 1:
+        return stuck
+    for name in history.names:
+        bad = (history.column(name, "active") == 1) & (history.column(name, "sql_open") == 0)
+        edges = np.diff(np.concatenate(([0], bad.astype(np.int8), [0])))
+        begins, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+        intervals = []
+        for begin, end in zip(begins, ends):
+            # until the next line, or the last line for a run at the end
+            until = history.times[min(end, len(history) - 1)]
+            if until - history.times[begin] >= stuck_after or end == len(history):
+                intervals.append({"from": float(history.times[begin]), "seconds": float(until - history.times[begin]),
+                                  "until_end": bool(end == len(history))})
+        if intervals:
+            stuck[name] = intervals
+    return stuck
+
+
+def format_report(report):
+    """
+    :return: the report as lines of text
+    """
+    throughput = report["throughput"]
+    transitions = report["transitions"]
+    lines = [
+        "{:.1f}s, {} events injected ({} late, at most {:.1f}ms)".format(
+            report["duration"], report["injection"]["events"], report["injection"]["late"],
+            report["injection"]["max_late_ms"]),
+        "state: {} lines, {:.1f}/s, peak {}/s; ptt: {} edges, {:.1f}/s".format(
+            throughput["state_lines"], throughput["state_lines_per_second"], throughput["state_lines_peak_per_second"],
+            throughput["ptt_edges"], throughput["ptt_edges_per_second"]),
+        "transitions: " + ", ".join("{} {}".format(count, outcome) for outcome, count in transitions.items()),
+        "state delay: p50 {p50:.1f}ms, p95 {p95:.1f}ms, max {max:.1f}ms".format(**report["state_delay_ms"]),
+        "ptt: " + ", ".join("{} {}".format(count, outcome) for outcome, count in report["ptt"].items()) +
+        ", delay p50 {p50:.1f}ms, p95 {p95:.1f}ms, max {max:.1f}ms".format(**report["ptt_delay_ms"]),
+    ]
+    for name, intervals in report["stuck"].items():
+        lines.append("STUCK {}: active with a closed squelch {} time(s), longest {:.1f}s{}".format(
+            name, len(intervals), max(interval["seconds"] for interval in intervals),
+            ", until the end" if any(interval["until_end"] for interval in intervals) else ""))
+    if report["ptt_on_at_end"]:
+        lines.append("STUCK ptt: still on at the end")
+    for name, stats in report["resources"].items():
+        lines.append("{:28} cpu mean {:5.1f}% max {:5.1f}%, memory max {:.1f}MB".format(
+            name, stats["cpu_mean"], stats["cpu_max"], stats["memory_max_mb"]))
+    return lines
+
+
+def save(report, branch, directory=OUTPUT_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "{}-{}.json".format(branch, strftime("%Y%m%d-%H%M%S")))
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+    return path
+
+
+def main():
+    from environment import new_environment
+
+    logging.basicConfig(level=logging.WARNING)
+    parser = argparse.ArgumentParser(description="soak the voter with squelch storms")
+    parser.add_argument("--rate", type=float, default=100.0, help="events per second, over all remotes")
+    parser.add_argument("--duration", type=float, default=60.0, help="in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--toggle-ratio", type=float, default=0.05, help="the share of enable and disable events")
+    parser.add_argument("--script", help="a json list of [seconds, kind, remote] to inject instead")
+    parser.add_argument("--hold", type=float, default=0.5, help="seconds after which an unseen event is missed")
+    args = parser.parse_args()
+
+    env = new_environment()
+    if not env.start():
+        raise SystemExit("the environment didn't start")
+    try:
+        env.fast_reset()
+        if args.script:
+            pattern = load_script(args.script)
+        else:
+            pattern = random_pattern(env.remotes, args.rate, args.duration, args.seed, args.toggle_ratio)
+        report = Soak(env, pattern, hold=args.hold).run()
+    finally:
+        env.stop()
+    for line in format_report(report):
+        print(line)
+    print("saved to {}".format(save(report, env.branch)))
+
+
+if __name__ == "__main__":
+    main()
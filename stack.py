@@ -0,0 +1,176 @@
+"""
+This module describes everything that has to be unique for a stack (svxlink and its remotes) to run next to others
+on the same host: the compose project, the container names, the host ports, the configs and the capture directory.
+
+The default stack is the hand-written one: docker-compose.yaml, the configs/ directory and the captures in the
+working directory. A sharded stack, for instance one per pytest-xdist worker, gets its own project, a block of
+host ports and a directory under runs/ with rendered configs, a generated compose file and its own captures.
+The remotes come from the topology (see topology.py), a stack with other remotes than the hand-written ones is
+always sharded.
+"""
+import json
+import os
+
+from topology import PORT_BLOCK, Topology
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CAPTURES = ["state", "ptt", "audio", "spectrum", "tone_events", "log"]
+# the port remotetrx listens on inside its container, LISTEN_PORT in configs/remote1.conf
+REMOTE_LISTEN_PORT = 5210
+# stacks per slot, a slot is used for every concurrent pytest run (like one per branch)
+WORKERS_PER_SLOT = 10
+
+
+class Stack:
+    """
+    Example of usage :
+
+        stack = Stack("gw1", port_offset=200)
+        stack.render("hobbyscoop")
+        check_output(stack.compose_command("hobbyscoop") + ["up", "-d"])
+    """
+    svxlink_ports = ["5200:5200", "5198:5198/udp", "5199:5199/udp"]
+
+    def __init__(self, name=None, port_offset=0, topology=None):
+        self.name = name
+        self.port_offset = port_offset
+        self.topology = topology or Topology.load()
+        self.remote_ports = self.topology.ports
+        if name:
+            self.directory = os.path.join(ROOT, "runs", name)
+        else:
+            self.directory = "."
+
+    @classmethod
+    def from_env(cls):
+        """
+        the stack for this process, based on:
+        - STACK_NAME: a name for this test run, e.g. the branch
+        - STACK_SLOT: a number unique per concurrent test run, to pick a block of ports
+        - PYTEST_XDIST_WORKER: set by pytest-xdist, like gw0
+        - REMOTES: the remotes, see Topology.from_env
+        without any of these, the default stack is used
+        :return:
+        """
+        name = os.environ.get("STACK_NAME", "")
+        slot = int(os.environ.get("STACK_SLOT", "0"))
+        worker = os.environ.get("PYTEST_XDIST_WORKER", "")
+        topology = Topology.from_env()
+        if not name and not worker and not slot and topology.is_default:
+            return cls(topology=topology)
+        worker_index = int(worker[2:]) if worker.startswith("gw") else 0
+        if worker_index >= WORKERS_PER_SLOT:
+            raise ValueError("at most {} workers per slot are supported".format(WORKERS_PER_SLOT))
+        block = slot * WORKERS_PER_SLOT + worker_index + 1
+        full_name = "-".join(part for part in ["svx", name or "slot{}".format(slot), worker] if part)
+        return cls(full_name, port_offset=PORT_BLOCK * block, topology=topology)
+
+    @property
+    def sharded(self):
+        return self.name is not None
+
+    def container_name(self, service):
+        if not self.sharded:
+            return service
+        return "{}-{}".format(self.name, service)
+
+    def service_name(self, container_name):
+        """
+        the compose service for a container name of this stack, or None if it's not ours
+        :param container_name:
+        :return:
+        """
+        if not self.sharded:
+            return container_name
+        prefix = self.name + "-"
+        if container_name.startswith(prefix):
+            return container_name[len(prefix):]
+        return None
+
+    def port(self, port):
+        return port + self.port_offset
+
+    def remote_port(self, name):
+        return self.port(self.remote_ports[name])
+
+    def capture_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def config_path(self, name):
+        """
+        the path of a config file, like svxlink.conf or remote1.conf: rendered for a sharded stack, hand-written otherwise
+        :param name:
+        :return:
+        """
+        if not self.sharded:
+            return os.path.join(ROOT, "configs", name)
+        return self.capture_path(name)
+
+    @property
+    def compose_file(self):
+        return os.path.join(self.directory, "docker-compose.json")
+
+    def compose_command(self, branch):
+        if not self.sharded:
+            return ["docker-compose", "-f", "docker-compose.yaml", "-f", "docker-compose-{}.yaml".format(branch)]
+        return ["docker-compose", "-p", self.name, "-f", self.compose_file]
+
+    def render_svxlink_config(self):
+        """
+        the svxlink config, with all remotes of this stack as receivers, pointing at the ports of this stack
+        :return:
+        """
+        return self.topology.svxlink_config({name: self.remote_port(name) for name in self.remote_ports})
+
+    def compose(self, branch):
+        """
+        the compose file for this stack, in the same (version 1) format as docker-compose.yaml
+        :param branch: the svxlink image tag
+        :return: a dict
+        """
+        def port_mapping(mapping):
+            host, _, container = mapping.partition(":")
+            return "{}:{}".format(self.port(int(host)), container)
+
+        services = {
+            "svxlink": {
+                "container_name": self.container_name("svxlink"),
+                "image": "svxlink:{}".format(branch),
+                "volumes": [
+                    "{}:/etc/svxlink/svxlink.conf".format(self.capture_path("svxlink.conf")),
+                    "{}:/goertzel.py".format(os.path.join(ROOT, "goertzel.py")),
+                ] + ["{}:/{}".format(self.capture_path(name), name) for name in CAPTURES],
+                "command": "svxlink",
+                "privileged": True,
+                "ports": [port_mapping(mapping) for mapping in self.svxlink_ports],
+            },
+        }
+        for name, port in self.remote_ports.items():
+            services[name] = {
+                "container_name": self.container_name(name),
+                "image": "svxlink:{}".format(branch),
+                "volumes": ["{}:/etc/svxlink/remotetrx.conf".format(self.config_path(name + ".conf"))],
+                "command": "remotetrx",
+                "privileged": True,
+                "ports": ["{}:{}".format(self.port(port), REMOTE_LISTEN_PORT)],
+            }
+        return services
+
+    def render(self, branch):
+        """
+        write the rendered configs, the compose file and empty captures to the directory of this stack
+        :param branch: the svxlink image tag
+        :return:
+        """
+        if not self.sharded:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.capture_path("svxlink.conf"), "w") as config:
+            config.write(self.render_svxlink_config())
+        for remote in self.topology.remotes:
+            with open(self.config_path(remote.name + ".conf"), "w") as config:
+                config.write(self.topology.remote_config(remote))
+        with open(self.compose_file, "w") as compose:
+            # JSON is valid YAML, so docker-compose reads it as is
+            json.dump(self.compose(branch), compose, indent=2)
+        for name in CAPTURES:
+            open(self.capture_path(name), "w").close()
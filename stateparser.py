@@ -0,0 +1,348 @@
+"""
+This module parses the voter state svxlink writes to the state capture, in either format:
+- json: [{"active": false, "enabled": true, "id": "?", "name": "remote1", "siglev": 1000, "sql_open": false}, ...]
+- old: remote1*+1000 remote2_+030, with _ closed, : open, * active and # off
+
+A stream is always in one format, so the format is detected on the first line and then used for all others.
+Every line gives a compact RemoteState per remote. A whole capture can also be parsed in one pass into a
+StateHistory, with a numpy column per field, for post-mortem analysis of long runs.
+
+Usage:
+    python stateparser.py state
+"""
+import argparse
+import json
+from operator import itemgetter
+import re
+from time import perf_counter
+
+import numpy as np
+
+JSON = "json"
+OLD = "old"
+# timestamp, source and state, separated by spaces
+FIRST_LINE = re.compile(r"^\S+ \S+ \S.*$", re.MULTILINE)
+OLD_ITEM = re.compile(r"(\w+)([_:#*])([+-]\d+)")
+# enabled, sql_open and active per status character, None when the old format doesn't tell
+OLD_STATUS = {
+    "_": (True, False, False),
+    ":": (True, True, False),
+    "*": (True, True, True),
+    "#": (False, None, None),
+}
+UNKNOWN = -1
+
+
+class RemoteState:
+    """
+    the state of one remote, as reported by the voter
+    """
+    __slots__ = ("name", "enabled", "sql_open", "active", "siglev")
+    fields = ("enabled", "sql_open", "active", "siglev")
+
+    def __init__(self, name, enabled, sql_open, active, siglev):
+        self.name = name
+        self.enabled = enabled
+        self.sql_open = sql_open
+        self.active = active
+        self.siglev = siglev
+
+    def get(self, field, default=None):
+        value = getattr(self, field, None)
+        return default if value is None else value
+
+    def __getitem__(self, field):
+        value = self.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __eq__(self, other):
+        return isinstance(other, RemoteState) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return "RemoteState({})".format(", ".join("{}={!r}".format(key, value) for key, value in self.as_dict().items()))
+
+    def as_dict(self):
+        """
+        :return: the known fields, like the voter reports them
+        """
+        return {field: getattr(self, field) for field in ("name",) + self.fields if getattr(self, field) is not None}
+
+
+def detect_format(state):
+    """
+    :param state: the state part of a line
+    :return: JSON or OLD
+    """
+    return JSON if state.lstrip().startswith("[") else OLD
+
+
+def parse_json(state):
+    return [RemoteState(item["name"], item.get("enabled"), item.get("sql_open"), item.get("active"), item.get("siglev"))
+            for item in json.loads(state)]
+
+
+def parse_old(state):
+    items = OLD_ITEM.findall(state)
+    if not items:
+        raise ValueError("no remotes in state: {}".format(state))
+    return [RemoteState(name, *OLD_STATUS[status], int(siglev)) for name, status, siglev in items]
+
+
+PARSERS = {JSON: parse_json, OLD: parse_old}
+
+
+class StateParser:
+    """
+    Parses the lines of one state stream, detecting the format on the first line.
+
+    Example of usage :
+
+        parser = StateParser()
+        timestamp, remotes = parser.parse_line("1690000000.000 Voter:sql_state remote1*+1000 remote2_+030")
+    """
+
+    def __init__(self):
+        self.format = None
+
+    def reset(self):
+        self.format = None
+
+    def parse(self, state):
+        """
+        parse the state part of a line
+        :param state:
+        :return: a list of RemoteState
+        """
+        if self.format is None:
+            self.format = detect_format(state)
+        try:
+            return PARSERS[self.format](state)
+        except (ValueError, KeyError, TypeError):
+            # the stream switched formats, like after a restart with another branch
+            other = detect_format(state)
+            if other == self.format:
+                raise
+            self.format = other
+            return PARSERS[self.format](state)
+
+    def parse_line(self, line):
+        """
+        :param line: timestamp, source and state, separated by spaces
+        :return: the timestamp and a list of RemoteState
+        """
+        timestamp, _, state = line.split(" ", 2)
+        return float(timestamp), self.parse(state)
+
+
+class StateHistory:
+    """
+    All states of a capture, as columns: one row per line, one column per remote.
+    enabled, sql_open and active are int8, with UNKNOWN (-1) where the line doesn't tell; siglev is int32.
+
+    Example of usage :
+
+        history = StateHistory.from_file("runs/soak/state")
+        history.active_remote()           # the index of the active remote per line, or -1
+        history.changes("remote1", "active")
+    """
+
+    def __init__(self, times, names, columns):
+        self.times = times
+        self.names = names
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.times)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", errors="replace") as capture:
+            return cls.parse(capture.read())
+
+    @classmethod
+    def parse(cls, text):
+        """
+        parse a whole capture in one pass
+        :param text: the contents of a state capture
+        :return:
+        """
+        first = FIRST_LINE.search(text)
+        if first is None:
+            return cls(np.zeros(0), [], {field: np.zeros((0, 0), dtype=cls.dtype(field)) for field in RemoteState.fields})
+        first = first.group(0)
+        state_format = detect_format(first.split(" ", 2)[2])
+        if state_format == OLD:
+            history = cls._parse_old(text, first)
+            if history is not None:
+                return history
+        rows = [row for row in (line.split(" ", 2) for line in text.splitlines()) if len(row) == 3]
+        history = None
+        if state_format == JSON:
+            try:
+                times = np.array([row[0] for row in rows], dtype=np.float64)
+                history = cls._parse_json(times, [row[2] for row in rows])
+            except ValueError:
+                pass
+        if history is None:
+            history = cls._parse_lines(rows)
+        return history
+
+    @staticmethod
+    def dtype(field):
+        return np.int32 if field == "siglev" else np.int8
+
+    @classmethod
+    def _parse_old(cls, text, first):
+        """
+        all lines at once, when every line lists the same remotes in the same order:
+        the capture is split into words, and every remote is a column of fixed width byte strings
+        """
+        items = first.split()[2:]
+        width = len(items) + 2
+        words = text.split()
+        if not items or len(words) % width:
+            return None
+        names = []
+        columns = {field: [] for field in RemoteState.fields}
+        for index, item in enumerate(items):
+            match = OLD_ITEM.fullmatch(item)
+            if not match:
+                return None
+            name = match.group(1)
+            names.append(name)
+            table = np.array(words[index + 2::width], dtype="S")
+            table = table.view(np.uint8).reshape(len(table), -1)
+            offset = len(name)
+            if table.shape[1] < offset + 3 or not (table[:, :offset] == np.frombuffer(name.encode(), np.uint8)).all():
+                return None
+            status = table[:, offset]
+            sign = table[:, offset + 1]
+            digits = table[:, offset + 2:]
+            present = digits != 0
+            if (not np.isin(status, np.frombuffer(b"_:*#", np.uint8)).all()
+                    or not np.isin(sign, np.frombuffer(b"+-", np.uint8)).all()
+                    or not present[:, 0].all()
+                    or ((digits < ord("0")) | (digits > ord("9")))[present].any()):
+                return None
+            siglev = np.zeros(len(table), dtype=np.int32)
+            for position in range(digits.shape[1]):
+                siglev = np.where(present[:, position], siglev * 10 + digits[:, position] - ord("0"), siglev)
+            off = status == ord("#")
+            columns["enabled"].append(np.where(off, 0, 1))
+            columns["sql_open"].append(np.where(off, UNKNOWN, status != ord("_")))
+            columns["active"].append(np.where(off, UNKNOWN, status == ord("*")))
+            columns["siglev"].append(np.where(sign == ord("-"), -siglev, siglev))
+        try:
+            times = np.array(words[0::width], dtype=np.float64)
+        except ValueError:
+            return None
+        return cls(times, names, {field: np.stack(values, axis=1).astype(cls.dtype(field))
+                                  for field, values in columns.items()})
+
+    @classmethod
+    def _parse_json(cls, times, states):
+        """
+        all lines with a single json decode
+        """
+        try:
+            decoded = json.loads("[" + ",".join(states) + "]")
+        except ValueError:
+            return None
+        if len(decoded) != len(states):
+            return None
+        items = [item for state in decoded for item in state]
+        names = [item["name"] for item in decoded[0]] if decoded else []
+        if len(items) != len(names) * len(decoded) or [item["name"] for item in items] != names * len(decoded):
+            return None
+        try:
+            table = np.array(list(map(itemgetter(*RemoteState.fields), items)), dtype=np.int32)
+        except (KeyError, TypeError, ValueError):
+            return None
+        table = table.reshape(len(decoded), len(names), len(RemoteState.fields))
+        return cls(times, names, {field: table[:, :, index].astype(cls.dtype(field))
+                                  for index, field in enumerate(RemoteState.fields)})
+
+    @classmethod
+    def _parse_lines(cls, rows):
+        """
+        line by line, skipping what can't be parsed
+        """
+        parser = StateParser()
+        parsed = []
+        times = []
+        for timestamp, _, state in rows:
+            try:
+                remotes = parser.parse(state)
+                times.append(float(timestamp))
+            except (ValueError, KeyError, TypeError):
+                continue
+            parsed.append(remotes)
+        names = []
+        for remotes in parsed:
+            for remote in remotes:
+                if remote.name not in names:
+                    names.append(remote.name)
+        index = {name: position for position, name in enumerate(names)}
+        columns = {field: np.full((len(parsed), len(names)), UNKNOWN, dtype=cls.dtype(field))
+                   for field in RemoteState.fields}
+        for row, remotes in enumerate(parsed):
+            for remote in remotes:
+                for field in RemoteState.fields:
+                    value = getattr(remote, field)
+                    if value is not None:
+                        columns[field][row, index[remote.name]] = value
+        return cls(np.array(times, dtype=np.float64), names, columns)
+
+    def column(self, name, field):
+        """
+        :param name: remote name
+        :param field: enabled, sql_open, active or siglev
+        :return: the value per line
+        """
+        return self.columns[field][:, self.names.index(name)]
+
+    def changes(self, name, field):
+        """
+        :return: the times at which a field of a remote changed, and the new values
+        """
+        values = self.column(name, field)
+        changed = np.flatnonzero(values[1:] != values[:-1]) + 1
+        return self.times[changed], values[changed]
+
+    def active_remote(self):
+        """
+        :return: the index of the active remote per line, -1 when none is active
+        """
+        active = self.columns["active"] == 1
+        return np.where(active.any(axis=1), active.argmax(axis=1), -1)
+
+    def active_time(self):
+        """
+        how long each remote was active, counting every line until the next one
+        :return: seconds per remote name
+        """
+        if len(self) < 2:
+            return {name: 0.0 for name in self.names}
+        durations = np.diff(self.times)
+        active = self.active_remote()[:-1]
+        return {name: float(durations[active == index].sum()) for index, name in enumerate(self.names)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="summarize a state capture")
+    parser.add_argument("path", nargs="?", default="state")
+    args = parser.parse_args()
+
+    start = perf_counter()
+    history = StateHistory.from_file(args.path)
+    duration = perf_counter() - start
+    print("{} states of {} remotes parsed in {:.1f}ms".format(len(history), len(history.names), duration * 1000))
+    for name, seconds in history.active_time().items():
+        print("{:12} active {:8.1f}s, {} squelch openings".format(
+            name, seconds, int((history.changes(name, "sql_open")[1] == 1).sum())))
+
+
+if __name__ == "__main__":
+    main()
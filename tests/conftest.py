@@ -0,0 +1,77 @@
+"""
+Hooks to report on the shared environment pool (see pool.py), on the measured latencies (see latency.py)
+and on where the time of each test went (see tracing.py)
+"""
+import os
+
+import pytest
+
+from latency import format_summary, html_summary, session_log, summarize
+from pool import current_pool
+import tracing
+
+BRANCH = os.environ.get("BRANCH", "hobbyscoop")
+
+
+def pytest_configure(config):
+    tracing.enable()
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    outcome = yield
+    report = outcome.get_result()
+    html = item.config.pluginmanager.getplugin("html")
+    if report.when == "teardown":
+        trace = tracing.tracer()
+        path = trace.save(trace.take(item.nodeid), item.nodeid, os.path.join(tracing.OUTPUT_DIR, BRANCH))
+        if path:
+            report.user_properties.append(("trace", path))
+        return
+    if report.when != "call":
+        return
+    spans = tracing.tracer().for_test(item.nodeid)
+    if spans:
+        summary = tracing.summarize(spans)
+        for (category, name), stats in summary.items():
+            report.user_properties.append(("trace {} {}".format(category, name),
+                                           "count={count} total={seconds:.3f}s".format(**stats)))
+        if html:
+            report.extra = getattr(report, "extra", []) + [html.extras.html(tracing.html_summary(summary))]
+    samples = session_log().for_test(item.nodeid)
+    if not samples:
+        return
+    summary = summarize(samples)
+    for transition, stats in summary.items():
+        report.user_properties.append(("latency " + transition, "p50={p50:.3f}s p95={p95:.3f}s max={max:.3f}s".format(**stats)))
+    if html:
+        report.extra = getattr(report, "extra", []) + [html.extras.html(html_summary(summary))]
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_html_results_summary(prefix, summary, postfix):
+    samples = session_log().tests()
+    if samples:
+        from py.xml import html, raw
+        prefix.extend([html.h2("Latency"), raw(html_summary(summarize(samples)))])
+
+
+def pytest_sessionfinish(session, exitstatus):
+    pool = current_pool()
+    if pool:
+        pool.close()
+    session_log().save(BRANCH)
+    trace = tracing.tracer()
+    trace.save(trace.take(None), "session-{}".format(os.getpid()), os.path.join(tracing.OUTPUT_DIR, BRANCH))
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    pool = current_pool()
+    if pool and pool.starts:
+        terminalreporter.write_sep("-", "environment pool ({})".format(pool.scope))
+        terminalreporter.write_line(pool.summary())
+    samples = session_log().tests()
+    if samples:
+        terminalreporter.write_sep("-", "latency")
+        for line in format_summary(summarize(samples)):
+            terminalreporter.write_line(line)
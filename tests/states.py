@@ -0,0 +1,13 @@
+"""
+Made up voter states, shared by the tests of the soak and the timeline.
+"""
+from stateparser import StateHistory
+
+START = 1690000000.0
+
+
+def history(*states):
+    """
+    a state history from (seconds, old format state) pairs
+    """
+    return StateHistory.parse("".join("{:.3f} Voter:sql_state {}\n".format(START + at, state) for at, state in states))
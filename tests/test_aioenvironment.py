@@ -0,0 +1,97 @@
+"""
+This file tests the asyncio environment, against the simulator.
+These tests don't need docker.
+"""
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+from aioenvironment import AsyncEnvironment, all_within, any_within, in_order_within
+from simulator import SimEnvironment
+from stack import Stack
+
+
+class TestCombinators(unittest.TestCase):
+    @staticmethod
+    async def after(seconds, result=True):
+        await asyncio.sleep(seconds)
+        return result
+
+    def test_all_within(self):
+        start = time.monotonic()
+        self.assertTrue(asyncio.run(all_within(1, self.after(0.1), self.after(0.2), self.after(0.1))))
+        # concurrently, not one after another
+        self.assertLess(time.monotonic() - start, 0.35)
+        self.assertFalse(asyncio.run(all_within(0.2, self.after(0.05), self.after(5))))
+        self.assertFalse(asyncio.run(all_within(1, self.after(0.05), self.after(0.05, False))))
+
+    def test_any_within(self):
+        self.assertEqual(asyncio.run(any_within(1, self.after(0.3), self.after(0.05, False), self.after(0.1))), 2)
+        self.assertIsNone(asyncio.run(any_within(0.1, self.after(1), self.after(0.05, False))))
+
+    def test_in_order_within(self):
+        """
+        the deadline is shared: each wait gets what the ones before it left
+        """
+        start = time.monotonic()
+        self.assertTrue(asyncio.run(in_order_within(1, self.after(0.1), self.after(0.1))))
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertFalse(asyncio.run(in_order_within(0.3, self.after(0.2), self.after(0.2), self.after(0.2))))
+
+
+class TestAsyncEnvironment(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def environment(self, name):
+        stack = Stack(name)
+        stack.directory = os.path.join(self.directory.name, name)
+        os.makedirs(stack.directory)
+        return AsyncEnvironment(SimEnvironment(stack))
+
+    def test_switchover(self):
+        """
+        PTT, voter state and tone are awaited at the same time, with one deadline
+        """
+        async def switchover(aenv):
+            self.assertTrue(await aenv.start())
+            try:
+                await aenv.open_squelch("remote2")
+                self.assertTrue(await all_within(2, aenv.wait_for_ptt(True),
+                                                 aenv.wait_for_remote_state("remote2", "active", True),
+                                                 aenv.wait_for_remote_by_tone("remote2")))
+                await aenv.open_squelch("remote1")
+                self.assertTrue(await in_order_within(2, aenv.wait_for_remote_state("remote1", "active", True),
+                                                      aenv.wait_for_remote_by_tone("remote1")))
+                self.assertFalse(await aenv.wait_for_remote_by_tone("remote2", 0.2))
+                self.assertTrue(await aenv.fast_reset(5))
+            finally:
+                await aenv.stop()
+                aenv.close()
+        asyncio.run(switchover(self.environment("aio")))
+
+    def test_two_stacks(self):
+        """
+        one loop should drive two environments, each waking up only on its own captures
+        """
+        async def both(first, second):
+            await asyncio.gather(first.start(), second.start())
+            try:
+                await asyncio.gather(first.open_squelch("remote1"), second.open_squelch("remote2"))
+                self.assertTrue(await all_within(2, first.wait_for_remote_by_tone("remote1"),
+                                                 second.wait_for_remote_by_tone("remote2")))
+                self.assertEqual(first.env.voter_state["remote2"]["sql_open"], False)
+            finally:
+                await asyncio.gather(first.stop(), second.stop())
+                first.close()
+                second.close()
+        asyncio.run(both(self.environment("aio-a"), self.environment("aio-b")))
+
+
+if __name__ == '__main__':
+    unittest.main()
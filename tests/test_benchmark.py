@@ -0,0 +1,40 @@
+"""
+This file tests the benchmark suite, on small inputs so it stays fast.
+These tests don't need docker.
+"""
+import tempfile
+import unittest
+
+from benchmark import KB, capture_benchmarks, compare, detection_benchmarks, measure, run
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_compare(self):
+        regressions = compare({"fast": 1.0, "slow": 2.0, "new": 5.0}, {"fast": 1.0, "slow": 1.0}, threshold=1.5)
+        self.assertEqual(list(regressions), ["slow"])
+        self.assertAlmostEqual(regressions["slow"], 2.0)
+
+    def test_measure(self):
+        calls = []
+        seconds = measure(lambda: calls.append(1), repeat=2, min_time=0.001)
+        self.assertGreater(len(calls), 2)
+        self.assertLess(seconds, 0.001)
+
+    def test_benchmarks_run(self):
+        """
+        every benchmark should run on small captures, and the environment properties should see the captures
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            benchmarks = detection_benchmarks()
+            benchmarks.update(capture_benchmarks(directory, [KB]))
+            for name, function in benchmarks.items():
+                function()
+            self.assertEqual(benchmarks["ptt_state[tail-1KB]"](), True)
+            self.assertEqual(benchmarks["active_remote_by_tone[ring]"](), "remote1")
+            self.assertTrue(benchmarks["voter_state[cold-1KB]"]()["remote1"]["active"])
+            results = run(benchmarks, keyword="tone_bank", log=lambda line: None)
+        self.assertEqual(list(results), ["tone_bank[2]", "tone_bank[16]", "tone_bank[64]"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+This file tests the incremental readers for the capture files.
+These tests don't need docker.
+"""
+import os
+import tempfile
+import unittest
+
+from capture import TailReader
+
+
+class TestTailReader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "state")
+        open(self.path, "w").close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, data, mode="a"):
+        with open(self.path, mode) as capture:
+            capture.write(data)
+
+    def test_partial_lines(self):
+        """
+        a partial trailing line should only be returned once it's complete
+        """
+        reader = TailReader(self.path, parse=str.upper)
+        self.write("one\ntw")
+        self.assertEqual(reader.poll(), ["one"])
+        self.assertEqual(reader.latest, "ONE")
+        self.write("o\nthree")
+        self.assertEqual(reader.poll(), ["two"])
+        self.assertEqual(reader.latest, "TWO")
+        self.assertEqual(reader.poll(), [])
+        self.assertEqual(reader.latest, "TWO")
+
+    def test_only_new_bytes(self):
+        """
+        every poll should only read what was written since the previous poll
+        """
+        reader = TailReader(self.path)
+        self.write("x" * 1000 + "\n")
+        reader.poll()
+        self.write("y\n")
+        reader.poll()
+        self.assertEqual(reader.bytes_read, 1003)
+        self.assertEqual(reader.latest, "y")
+
+    def test_truncate(self):
+        reader = TailReader(self.path)
+        self.write("first line\nsecond line\n")
+        reader.poll()
+        self.write("new\n", mode="w")
+        self.assertEqual(reader.poll(), ["new"])
+
+    def test_replace(self):
+        """
+        scripts/create-IO.sh removes and recreates the files
+        """
+        reader = TailReader(self.path)
+        self.write("old\n")
+        reader.poll()
+        os.remove(self.path)
+        self.assertEqual(reader.poll(), [])
+        self.write("a much longer line than before\n", mode="w")
+        self.assertEqual(reader.poll(), ["a much longer line than before"])
+
+    def test_missing(self):
+        reader = TailReader(os.path.join(self.directory.name, "missing"))
+        self.assertEqual(reader.poll(), [])
+        self.assertIsNone(reader.latest)
+
+    def test_characters(self):
+        """
+        the PTT state is written as single characters, without newlines
+        """
+        reader = TailReader(self.path, parse=lambda char: char == "T", lines=False)
+        self.write("TRT")
+        self.assertEqual(reader.poll(), ["T", "R", "T"])
+        self.assertTrue(reader.latest)
+        self.write("R")
+        reader.poll()
+        self.assertFalse(reader.latest)
+
+    def test_reset(self):
+        reader = TailReader(self.path)
+        self.write("line\n")
+        reader.poll()
+        reader.reset()
+        self.assertIsNone(reader.latest)
+        self.assertEqual(reader.poll(), ["line"])
+
+
+    def test_on_records(self):
+        """
+        every new record is handed over once, whoever polls
+        """
+        handed = []
+        reader = TailReader(self.path, on_records=handed.extend)
+        self.write("one\ntwo\nthr")
+        reader.poll()
+        reader.poll()
+        self.write("ee\n")
+        reader.poll()
+        self.assertEqual(handed, ["one", "two", "three"])
+
+if __name__ == '__main__':
+    unittest.main()
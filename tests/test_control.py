@@ -0,0 +1,141 @@
+"""
+This file tests the container handle cache and the control channels, with a fake docker client.
+"""
+import re
+import socket
+import struct
+from threading import Thread
+import unittest
+
+from control import ContainerCache, ControlChannel
+
+
+class FakeContainer:
+    def __init__(self, name):
+        self.name = name
+        self.id = name
+
+
+class FakeShell:
+    """
+    the other end of a control channel, it answers the done markers like sh would, in docker's stream frames
+    """
+
+    def __init__(self, sock, answer=True):
+        self.sock = sock
+        self.answer = answer
+        self.received = b""
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while True:
+                data = self.sock.recv(4096)
+                if not data:
+                    break
+                self.received += data
+                for number in re.findall(rb"echo (__done_\d+)\n", data):
+                    if self.answer:
+                        self.sock.sendall(struct.pack(">BxxxL", 1, len(number) + 1) + number + b"\n")
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+
+
+class FakeClient:
+    def __init__(self, names, answer=True):
+        self.names = names
+        self.answer = answer
+        self.lists = 0
+        self.execs = []
+        self.containers = self
+        self.api = self
+
+    def list(self):
+        self.lists += 1
+        return [FakeContainer(name) for name in self.names]
+
+    def exec_create(self, container, cmd, **kwargs):
+        return container
+
+    def exec_start(self, exec_id, **kwargs):
+        ours, theirs = socket.socketpair()
+        self.execs.append(FakeShell(theirs, self.answer))
+        return ours
+
+
+class TestContainerCache(unittest.TestCase):
+    def test_cached_until_event(self):
+        client = FakeClient(["svxlink", "remote1"])
+        cache = ContainerCache(client)
+        for _ in range(4):
+            self.assertEqual(cache["svxlink"].name, "svxlink")
+        self.assertEqual(client.lists, 1)
+        cache.on_event("exec_start", "svxlink")
+        cache["remote1"]
+        self.assertEqual(client.lists, 1)
+        cache.on_event("die", "remote1")
+        cache["remote1"]
+        self.assertEqual(client.lists, 2)
+
+    def test_refresh_on_miss(self):
+        client = FakeClient(["svxlink"])
+        cache = ContainerCache(client)
+        cache.all()
+        client.names = ["svxlink", "remote2"]
+        self.assertEqual(cache["remote2"].name, "remote2")
+        with self.assertRaises(KeyError):
+            cache["remote3"]
+
+
+class TestControlChannel(unittest.TestCase):
+    def test_batch(self):
+        """
+        several commands should go to the shell in one write, over one exec
+        """
+        client = FakeClient(["svxlink"])
+        channel = ControlChannel(client, FakeContainer("svxlink"))
+        channel.send("echo ENABLE remote1 > /dev/shm/voter", "echo ENABLE remote2 > /dev/shm/voter")
+        channel.send("echo O > /tmp/sql")
+        self.assertEqual(len(client.execs), 1)
+        shell = client.execs[0]
+        self.assertEqual(shell.received, b"echo ENABLE remote1 > /dev/shm/voter\necho ENABLE remote2 > /dev/shm/voter\n"
+                                         b"echo __done_1\necho O > /tmp/sql\necho __done_2\n")
+        channel.close()
+        shell.thread.join(1)
+        self.assertTrue(shell.received.endswith(b"exit\n"))
+
+    def test_waits_for_shell(self):
+        """
+        send should only return once the shell ran the commands, and give up after the timeout
+        """
+        client = FakeClient(["svxlink"])
+        channel = ControlChannel(client, FakeContainer("svxlink"))
+        self.assertTrue(channel.send("true"))
+        client.answer = False
+        client.execs[0].answer = False
+        channel.timeout = 0.2
+        self.assertFalse(channel.send("sleep 10"))
+        channel.close()
+
+    def test_reopen(self):
+        """
+        when the shell goes away, the next command should open a new one
+        """
+        client = FakeClient(["svxlink"])
+        channel = ControlChannel(client, FakeContainer("svxlink"))
+        channel.send("true")
+        client.execs[0].close()
+        channel._reader.join(1)
+        self.assertFalse(channel.connected)
+        channel.send("true")
+        self.assertEqual(len(client.execs), 2)
+        channel.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
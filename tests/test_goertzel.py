@@ -0,0 +1,632 @@
+"""
+This file tests the tone detection in goertzel.py, which runs inside the svxlink container.
+These tests don't need docker.
+"""
+import logging
+import math
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from goertzel import (AudioRing, GoertzelBank, MIXED, SILENCE, SignatureDecoder, SlidingGoertzel, SpectrumAnalyzer,
+                      StreamingDetector, ToneBank, ToneTracker, UNKNOWN, convert_interleaved_to_windowed, decode_pcm,
+                      goertzel, signature_label, signature_value)
+
+SAMPLE_RATE = 16000
+WINDOW_SIZE = 1024
+RANGES = ((200, 400), (500, 700))
+
+
+def goertzel_loop(samples, sample_rate, *freqs):
+    """
+    The original per-sample implementation, kept as reference
+    """
+    window_size = len(samples)
+    f_step = sample_rate / float(window_size)
+    f_step_normalized = 1.0 / window_size
+    bins = set()
+    for f_start, f_end in freqs:
+        k_start = int(math.floor(f_start / f_step))
+        k_end = int(math.ceil(f_end / f_step))
+        bins = bins.union(range(k_start, k_end))
+    result = {}
+    for k in bins:
+        f = k * f_step_normalized
+        w_real = 2.0 * math.cos(2.0 * math.pi * f)
+        d1, d2 = 0.0, 0.0
+        for n in range(0, window_size):
+            y = samples[n] + w_real * d1 - d2
+            d2, d1 = d1, y
+        result[f * sample_rate] = d2 ** 2 + d1 ** 2 - w_real * d1 * d2
+    return max(result, key=lambda x: result[x]), result
+
+
+def convert_struct(raw_bytes, window_size):
+    """
+    The original struct based conversion, kept as reference
+    """
+    raw_data = struct.unpack('<%dh' % (len(raw_bytes) / 2), raw_bytes)
+    samples = np.array(raw_data).reshape((-1, 2))
+    channel = samples[:, 0]
+    window = np.hamming(len(channel))
+    window = np.pad(window, (0, max(0, window_size - len(window))), mode='constant')
+    return channel * window[:len(channel)]
+
+
+def tone(freq, window_size=WINDOW_SIZE, amplitude=10000.0, phase=0.0):
+    t = np.arange(window_size) / SAMPLE_RATE
+    return amplitude * np.sin(2 * np.pi * freq * t + phase) * np.hamming(window_size)
+
+
+def interleaved(freq, frames, start=0, amplitude=10000.0):
+    """
+    16 bit, 2 channel interleaved audio as svxlink sends it, with the tone on the first channel
+    """
+    t = np.arange(start, start + frames) / SAMPLE_RATE
+    samples = np.zeros((frames, 2), dtype="<i2")
+    samples[:, 0] = amplitude * np.sin(2 * np.pi * freq * t)
+    return samples.tobytes()
+
+
+class TestGoertzel(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = logging.getLogger(__class__.__name__)
+
+    def test_powers_match_loop(self):
+        """
+        the bank should calculate the same power per bin as the recurrence
+        """
+        rng = np.random.default_rng(1)
+        samples = tone(300) + rng.normal(0, 500, WINDOW_SIZE)
+        _, expected = goertzel_loop(samples, SAMPLE_RATE, *RANGES)
+        bank = GoertzelBank(SAMPLE_RATE, WINDOW_SIZE, *RANGES)
+        powers = bank.powers(samples)
+        self.assertEqual(list(bank.frequencies), list(expected.keys()))
+        np.testing.assert_allclose(powers, list(expected.values()), rtol=1e-6, atol=1e-3)
+
+    def test_dominant_matches_loop(self):
+        """
+        goertzel() should pick the same frequency as the recurrence, for various tones
+        """
+        rng = np.random.default_rng(2)
+        for freq in (210, 300, 333, 399, 520, 600, 690):
+            samples = tone(freq, phase=rng.uniform(0, np.pi)) + rng.normal(0, 200, WINDOW_SIZE)
+            expected, _ = goertzel_loop(samples, SAMPLE_RATE, *RANGES)
+            self.assertEqual(goertzel(samples, SAMPLE_RATE, *RANGES), expected, "tone {}".format(freq))
+
+    def test_stack_of_windows(self):
+        """
+        a 2-D stack of windows should give the same result as one window at a time
+        """
+        stack = np.stack([tone(300), tone(600), tone(350), tone(650)])
+        bank = GoertzelBank(SAMPLE_RATE, WINDOW_SIZE, *RANGES)
+        result = bank.dominant(stack)
+        self.assertEqual(list(result), [bank.dominant(window) for window in stack])
+        self.assertEqual(bank.powers(stack).shape, (4, len(bank.bins)))
+
+    def test_wrong_window_size(self):
+        bank = GoertzelBank(SAMPLE_RATE, WINDOW_SIZE, *RANGES)
+        with self.assertRaises(ValueError):
+            bank.powers(np.zeros(WINDOW_SIZE // 2))
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            GoertzelBank(SAMPLE_RATE, 64, (7000, 17000))
+
+    def test_tone_bank(self):
+        """
+        every one of 64 generated remote tones should be recognised, also in a stack of noisy windows
+        """
+        from topology import Topology
+        tones = sorted(Topology.generate(64).tones)
+        bank = ToneBank(SAMPLE_RATE, WINDOW_SIZE, tones)
+        rng = np.random.default_rng(3)
+        window = np.hamming(WINDOW_SIZE)
+        stack = np.stack([(tone(freq, phase=rng.uniform(0, np.pi)) + rng.normal(0, 2000, WINDOW_SIZE)) * window
+                          for freq in tones])
+        self.assertEqual(list(bank.dominant(stack)), tones)
+        self.assertEqual(bank.dominant(stack[5].astype(np.float32)), tones[5])
+        self.assertIsInstance(bank.dominant(stack[5]), int)
+        with self.assertRaises(ValueError):
+            ToneBank(SAMPLE_RATE, WINDOW_SIZE, (300, 9000))
+
+    def test_timing(self):
+        """
+        compare the time per window against the recurrence, the bank should be much faster
+        """
+        samples = tone(600)
+        repeats = 5
+        start = time.perf_counter()
+        for _ in range(repeats):
+            goertzel_loop(samples, SAMPLE_RATE, *RANGES)
+        loop_time = (time.perf_counter() - start) / repeats
+
+        goertzel(samples, SAMPLE_RATE, *RANGES)  # warm up the cache
+        start = time.perf_counter()
+        for _ in range(repeats * 20):
+            goertzel(samples, SAMPLE_RATE, *RANGES)
+        bank_time = (time.perf_counter() - start) / (repeats * 20)
+
+        stack = np.stack([samples] * 64)
+        bank = GoertzelBank(SAMPLE_RATE, WINDOW_SIZE, *RANGES)
+        start = time.perf_counter()
+        bank.dominant(stack)
+        stack_time = (time.perf_counter() - start) / len(stack)
+
+        self.log.info("per window: loop %.3f ms, bank %.3f ms, stacked %.3f ms",
+                      loop_time * 1000, bank_time * 1000, stack_time * 1000)
+        self.assertLess(bank_time, loop_time)
+
+
+class TestConversion(unittest.TestCase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.log = logging.getLogger(__class__.__name__)
+
+    def test_matches_struct(self):
+        """
+        the zero-copy conversion should give the same samples as the struct based one
+        """
+        data = interleaved(300, WINDOW_SIZE)
+        np.testing.assert_allclose(convert_interleaved_to_windowed(data, WINDOW_SIZE),
+                                   convert_struct(data, WINDOW_SIZE), rtol=1e-6, atol=1e-2)
+
+    def test_decode_is_a_view(self):
+        data = bytearray(interleaved(300, 16))
+        samples = decode_pcm(data, channel=1)
+        data[2:4] = b"\x01\x00"
+        self.assertEqual(samples[0], 1)
+        self.assertEqual(decode_pcm(data, None).shape, (16, 2))
+
+    def test_channels(self):
+        """
+        both channels should be windowed when no channel is selected
+        """
+        frames = np.zeros((WINDOW_SIZE, 2), dtype="<i2")
+        frames[:, 0] = 100
+        frames[:, 1] = -200
+        both = convert_interleaved_to_windowed(frames.tobytes(), WINDOW_SIZE, channel=None)
+        self.assertEqual(both.shape, (2, WINDOW_SIZE))
+        np.testing.assert_allclose(both[1], convert_interleaved_to_windowed(frames.tobytes(), WINDOW_SIZE, channel=1))
+        np.testing.assert_allclose(both[0] * -2, both[1])
+
+    def test_preallocated_output(self):
+        out = np.zeros(WINDOW_SIZE * 2, dtype=np.float32)
+        result = convert_interleaved_to_windowed(interleaved(600, WINDOW_SIZE), WINDOW_SIZE, out=out)
+        self.assertTrue(np.shares_memory(result, out))
+        self.assertEqual(result.dtype, np.float32)
+        self.assertEqual(len(result), WINDOW_SIZE)
+
+    def test_timing(self):
+        """
+        compare the time per datagram against the struct based conversion
+        """
+        data = interleaved(300, WINDOW_SIZE)
+        out = np.empty(WINDOW_SIZE, dtype=np.float32)
+        repeats = 200
+        start = time.perf_counter()
+        for _ in range(repeats):
+            convert_struct(data, WINDOW_SIZE)
+        struct_time = (time.perf_counter() - start) / repeats
+        start = time.perf_counter()
+        for _ in range(repeats):
+            convert_interleaved_to_windowed(data, WINDOW_SIZE, out=out)
+        view_time = (time.perf_counter() - start) / repeats
+        self.log.info("per datagram: struct %.1f us, zero-copy %.1f us", struct_time * 1e6, view_time * 1e6)
+        self.assertLess(view_time, struct_time)
+
+
+class TestStreamingDetector(unittest.TestCase):
+    def test_windows_from_datagrams(self):
+        """
+        windows should be assembled from consecutive datagrams, regardless of the datagram size
+        """
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE)
+        detections = []
+        for start in range(0, 4 * WINDOW_SIZE, 300):
+            detections += detector.feed(interleaved(600, 300, start))
+        self.assertEqual(detections, [600] * 4)
+        self.assertEqual(detector.windows, 4)
+
+    def test_overlap(self):
+        """
+        with a hop of a quarter window, every quarter window should give a detection
+        """
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE, hop_size=WINDOW_SIZE // 4)
+        detections = detector.feed(interleaved(300, 2 * WINDOW_SIZE))
+        self.assertEqual(len(detections), 5)
+        detections = detector.feed(interleaved(600, 2 * WINDOW_SIZE, 2 * WINDOW_SIZE))
+        self.assertEqual(len(detections), 8)
+        # the switch is picked up before a full window of the new tone is in
+        self.assertEqual(detections[-1], 600)
+        self.assertLess(detections.index(600), 4)
+
+    def test_partial_frames(self):
+        """
+        a datagram that ends halfway a frame should be continued by the next datagram
+        """
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE)
+        data = interleaved(300, WINDOW_SIZE)
+        self.assertEqual(detector.feed(data[:1001]), [])
+        self.assertEqual(detector.feed(data[1001:]), [300])
+
+    def test_window_powers(self):
+        """
+        every detection should come with the power per tone of its window
+        """
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE)
+        detections = detector.feed(interleaved(600, 2 * WINDOW_SIZE))
+        self.assertEqual(len(detector.window_powers), len(detections))
+        self.assertGreater(detector.window_powers[0][1], 100 * detector.window_powers[0][0])
+
+    def test_invalid_hop(self):
+        with self.assertRaises(ValueError):
+            StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE, hop_size=WINDOW_SIZE + 1)
+
+    def test_socket(self):
+        """
+        the detector should keep its socket open and detect every window that is sent
+        """
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE)
+        detector.open()
+        detections = []
+        thread = threading.Thread(target=detector.run, args=(lambda tone, powers: detections.append(tone),))
+        thread.start()
+        try:
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for start in range(0, 8 * WINDOW_SIZE, 256):
+                sender.sendto(interleaved(300, 256, start), detector.sock.getsockname())
+            sender.close()
+            deadline = time.monotonic() + 5
+            while len(detections) + detector.dropped // 4 < 8 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            detector.close()
+            thread.join(5)
+        self.assertEqual(detector.packets, 32 - detector.dropped)
+        self.assertTrue(all(tone == 300 for tone in detections))
+
+    def test_socket_survives_errors(self):
+        """
+        an error while handling a datagram, like a failing publish, should only lose that datagram
+        """
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE)
+        detector.open()
+        detections = []
+
+        def publish(tone, powers):
+            if not detections:
+                detections.append(None)
+                raise ValueError("ring is broken")
+            detections.append(tone)
+
+        thread = threading.Thread(target=detector.run, args=(publish,))
+        thread.start()
+        try:
+            sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            for start in range(0, 8 * WINDOW_SIZE, 256):
+                sender.sendto(interleaved(300, 256, start), detector.sock.getsockname())
+            sender.close()
+            deadline = time.monotonic() + 5
+            while len(detections) + detector.dropped // 4 < 8 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            detector.close()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertGreater(len(detections), 1)
+        self.assertTrue(all(tone == 300 for tone in detections[1:]))
+
+
+def sine(freq, frames, start=0, amplitude=10000.0):
+    return amplitude * np.sin(2 * np.pi * freq * np.arange(start, start + frames) / SAMPLE_RATE)
+
+
+class TestSignatureDecoder(unittest.TestCase):
+    def setUp(self):
+        self.decoder = SignatureDecoder(SAMPLE_RATE, {"remote1": (300,), "remote2": (600,)})
+
+    def window(self, *freqs, size=None):
+        t = np.arange(size or self.decoder.window_size) / SAMPLE_RATE
+        return sum(10000.0 * np.sin(2 * np.pi * freq * t + 0.3) for freq in freqs) + np.zeros(len(t))
+
+    def test_short_window(self):
+        """
+        300 Hz apart needs 4 bins of at most 75 Hz, about 13 ms instead of the 64 ms of the steady detector
+        """
+        self.assertEqual(self.decoder.window_size, 214)
+        self.assertEqual(self.decoder.decode(self.window(300)), "remote1")
+        self.assertEqual(self.decoder.decode(self.window(600)), "remote2")
+        with self.assertRaises(ValueError):
+            SignatureDecoder(SAMPLE_RATE, {"remote1": (300,), "remote2": (600,)}, window_size=128)
+
+    def test_no_nearest_match(self):
+        """
+        silence, both tones, noise or another tone should not be taken for the nearest remote
+        """
+        self.assertEqual(self.decoder.decode(self.window()), SILENCE)
+        self.assertEqual(self.decoder.decode(self.window(300, 600)), MIXED)
+        self.assertEqual(self.decoder.decode(self.window(1000)), UNKNOWN)
+        noise = np.random.default_rng(1).normal(0, 5000, self.decoder.window_size)
+        self.assertEqual(self.decoder.decode(noise), UNKNOWN)
+
+    def test_switch(self):
+        """
+        a window in which one remote stops and the other starts is mixed, unless one of them fills most of it
+        """
+        first, second = self.window(300), self.window(600)
+        labels = [self.decoder.decode(np.concatenate((first[:cut], second[cut:]))) for cut in range(0, 214, 10)]
+        self.assertEqual(labels[0], "remote2")
+        self.assertEqual(labels[-1], "remote1")
+        self.assertIn(MIXED, labels)
+        self.assertEqual(set(labels), {"remote1", "remote2", MIXED})
+
+    def test_pairs(self):
+        """
+        two groups of two tones give four signatures, a single tone of a pair or two pairs at once are not one
+        """
+        decoder = SignatureDecoder(SAMPLE_RATE, {"a": (697, 1209), "b": (697, 1336), "c": (770, 1209),
+                                                 "d": (770, 1336)})
+        windows = np.array([self.window(697, 1209, size=decoder.window_size),
+                            self.window(770, 1336, size=decoder.window_size),
+                            self.window(697, size=decoder.window_size),
+                            self.window(697, 770, 1209, 1336, size=decoder.window_size)])
+        self.assertEqual(decoder.decode(windows), ["a", "d", UNKNOWN, MIXED])
+        with self.assertRaises(ValueError):
+            SignatureDecoder(SAMPLE_RATE, {"a": (697, 1209), "b": (1209, 697)})
+
+    def test_published_values(self):
+        for label in ("remote1", 300, SILENCE, MIXED, UNKNOWN):
+            self.assertEqual(signature_label(signature_value(label)), label)
+        self.assertEqual(signature_value(600), 600)
+
+    def test_detector_decodes(self):
+        """
+        with a decoder, the detector should take its window size and report a label per window
+        """
+        decoder = SignatureDecoder(SAMPLE_RATE, {300: (300,), 600: (600,)})
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE, decoder=decoder)
+        self.assertEqual(detector.window_size, decoder.window_size)
+        labels = detector.feed(interleaved(300, 4 * 214))
+        labels += detector.feed(bytes(4 * 4 * 214))
+        self.assertEqual(labels, [300] * 4 + [SILENCE] * 4)
+        self.assertEqual(len(detector.window_powers), 4)
+
+
+class TestSpectrumAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = SpectrumAnalyzer(SAMPLE_RATE, WINDOW_SIZE, tones=(300, 700), interval=0.25)
+
+    def stereo(self, left, right, windows=4):
+        t = np.arange(windows * WINDOW_SIZE) / SAMPLE_RATE
+        channels = [sum(amplitude * np.sin(2 * np.pi * freq * t) for freq, amplitude in tones) + np.zeros(len(t))
+                    for tones in (left, right)]
+        return np.clip(np.stack(channels, axis=1), -32768, 32767).astype(np.int16)
+
+    def test_measures(self):
+        """
+        a tone with a third harmonic 30 dB down and another remote's tone 40 dB down, and a clipping tone
+        """
+        frames = self.stereo([(300, 10000), (900, 316), (700, 100)], [(600, 40000)])
+        measures = self.analyzer.analyze(frames.T.reshape(2, -1, WINDOW_SIZE))
+        self.assertEqual(measures["dominant"].shape, (2, 4))
+        self.assertAlmostEqual(measures["dominant"][0, 0], 300, delta=0.5)
+        self.assertAlmostEqual(measures["level_db"][0, 0], -13.3, delta=0.2)
+        self.assertAlmostEqual(measures["thd_db"][0, 0], -30, delta=0.5)
+        self.assertAlmostEqual(measures["leakage_db"][0, 0], -40, delta=0.5)
+        self.assertAlmostEqual(measures["secondary"][0, 0], 700, delta=0.5)
+        self.assertGreater(measures["snr_db"][0, 0], 35)
+        self.assertEqual(measures["clipped"][0, 0], 0)
+        self.assertGreater(measures["clipped"][1, 0], 100)
+        self.assertGreater(measures["thd_db"][1, 0], -25)
+
+    def test_silence(self):
+        measures = self.analyzer.analyze(np.zeros((2, 3, WINDOW_SIZE)))
+        self.assertTrue(np.isnan(measures["snr_db"]).all())
+        self.assertTrue(np.isnan(measures["dominant"]).all())
+
+    def test_summaries(self):
+        """
+        every interval gives a summary per channel, with the worst of its windows
+        """
+        frames = self.stereo([(300, 10000)], [], windows=8)
+        self.assertEqual(self.analyzer.feed(frames[:1000]), [])
+        summaries = self.analyzer.feed(frames[1000:])
+        self.assertEqual([summary["channel"] for summary in summaries], [0, 1, 0, 1])
+        self.assertEqual(summaries[0]["windows"], 4)
+        self.assertAlmostEqual(summaries[0]["dominant"], 300, delta=0.5)
+        self.assertEqual(summaries[1]["silent"], 4)
+        self.assertIsNone(summaries[1]["snr_db"])
+
+    def test_detector_analyzes(self):
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE, analyzer=self.analyzer)
+        summaries = []
+        for start in range(0, 8 * WINDOW_SIZE, 320):
+            detector.feed(interleaved(600, 320, start))
+            summaries += detector.summaries
+        self.assertEqual(len(summaries), 4)
+        self.assertAlmostEqual(summaries[0]["dominant"], 600, delta=0.5)
+
+    def test_timing(self):
+        """
+        a second of stereo audio should take well under 1% of that second to analyze
+        """
+        windows = self.stereo([(300, 10000)], [(600, 10000)], windows=16).T.reshape(2, -1, WINDOW_SIZE)
+        self.analyzer.analyze(windows)
+        start = time.perf_counter()
+        for _ in range(10):
+            self.analyzer.analyze(windows)
+        self.assertLess((time.perf_counter() - start) / 10, 0.01)
+
+
+class TestToneTracker(unittest.TestCase):
+    def track(self, samples, hop=16, block=320):
+        tracker = ToneTracker(SAMPLE_RATE, 512, (300, 600), hop=hop)
+        events = []
+        for start in range(0, len(samples), block):
+            events += tracker.feed(samples[start:start + block])
+        return events + tracker.flush()
+
+    def test_sliding_matches_dft(self):
+        """
+        the running sums should give the DFT of the window ending at every evaluated sample
+        """
+        samples = sine(300, 3000) + sine(600, 3000, amplitude=3000.0)
+        sliding = SlidingGoertzel(SAMPLE_RATE, 512, (300, 600))
+        positions, amplitudes = sliding.feed(samples[:1000], hop=7)
+        more, more_amplitudes = sliding.feed(samples[1000:], hop=7)
+        positions, amplitudes = np.concatenate((positions, more)), np.vstack((amplitudes, more_amplitudes))
+        self.assertEqual(list(np.diff(positions)), [7] * (len(positions) - 1))
+        for row in (80, 200, len(positions) - 1):
+            window = samples[positions[row] - 511:positions[row] + 1]
+            for column, freq in enumerate((300, 600)):
+                expected = 2 * abs(np.sum(window * np.exp(-2j * np.pi * freq * np.arange(512) / SAMPLE_RATE))) / 512
+                self.assertAlmostEqual(amplitudes[row, column], expected, delta=1e-6 * expected)
+        self.assertAlmostEqual(amplitudes[-1, 0], 10000, delta=500)
+
+    def test_switch_with_gap(self):
+        """
+        a switch through 250 ms of silence should be found to the millisecond, whatever the hop.
+        The last tone is still on at the end, so it doesn't stop.
+        """
+        samples = np.concatenate((sine(300, 8000), np.zeros(4000), sine(600, 8000, 12000)))
+        for hop in (1, 16, 64):
+            events = self.track(samples, hop)
+            self.assertEqual([event.kind for event in events], ["start", "stop", "start", "gap", "switch"])
+            switch = events[4]
+            self.assertEqual(switch.tones, (300, 600))
+            self.assertAlmostEqual(switch.time, 0.5, delta=0.001)
+            self.assertAlmostEqual(switch.duration, 0.25, delta=0.001)
+            self.assertAlmostEqual(events[0].start, 0, delta=16)
+
+    def test_switch_with_overlap(self):
+        """
+        when the next tone starts before the last one stops, the switch has a negative gap
+        """
+        samples = sine(300, 16000)
+        samples[6000:] = 0
+        samples[4000:] += sine(600, 12000, 4000)
+        events = self.track(samples)
+        self.assertEqual([event.kind for event in events], ["start", "start", "stop", "overlap", "switch"])
+        overlap = events[3]
+        self.assertEqual(overlap.tones, (300, 600))
+        self.assertAlmostEqual(overlap.time, 0.25, delta=0.002)
+        self.assertAlmostEqual(overlap.duration, 0.125, delta=0.002)
+        self.assertAlmostEqual(events[4].duration, -0.125, delta=0.002)
+
+    def test_direct_switch(self):
+        samples = np.concatenate((sine(600, 6000), sine(300, 6000, 6000)))
+        events = [event for event in self.track(samples) if event.kind == "switch"]
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0].tones, (600, 300))
+        self.assertAlmostEqual(events[0].time, 6000 / SAMPLE_RATE, delta=0.001)
+        self.assertLess(abs(events[0].duration), 0.001)
+
+    def test_detector_tracks(self):
+        """
+        a detector with a tracker should give the events of every datagram, and still detect per window
+        """
+        tracker = ToneTracker(SAMPLE_RATE, 512, (300, 600))
+        detector = StreamingDetector(("127.0.0.1", 0), SAMPLE_RATE, WINDOW_SIZE, tracker=tracker)
+        detections, events = [], []
+        for start in range(0, 8 * WINDOW_SIZE, 320):
+            detections += detector.feed(interleaved(300 if start < 4 * WINDOW_SIZE else 600, 320, start))
+            events += detector.events
+        self.assertEqual(detections[0], 300)
+        self.assertEqual(detections[-1], 600)
+        switches = [event for event in events + tracker.flush() if event.kind == "switch"]
+        self.assertEqual([event.tones for event in switches], [(300, 600)])
+        # the first datagram of 600 Hz starts at 4160
+        self.assertAlmostEqual(switches[0].end, 4160, delta=16)
+        published = switches[0].as_dict(origin=1000.0)
+        self.assertEqual((published["kind"], published["tones"]), ("switch", [300, 600]))
+        self.assertAlmostEqual(published["end"], 1000.0 + 4160 / SAMPLE_RATE, delta=0.001)
+
+
+class TestAudioRing(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "audio")
+        open(self.path, "w").close()
+        self.writer = AudioRing(self.path)
+        self.writer.create((300, 600), capacity=8)
+        self.reader = AudioRing(self.path)
+
+    def tearDown(self):
+        self.writer.close()
+        self.reader.close()
+        self.directory.cleanup()
+
+    def test_publish(self):
+        self.assertIsNone(self.reader.latest())
+        self.writer.publish(600, np.array([1.0, 5.0]), timestamp=1690000000.5)
+        record = self.reader.latest()
+        self.assertEqual(self.reader.tones, (300, 600))
+        self.assertEqual((record["seq"], record["time"], record["tone"], record["power"]), (1, 1690000000.5, 600, 5))
+        np.testing.assert_array_equal(record["powers"], [1.0, 5.0])
+        self.assertEqual(list(self.reader.read()["tone"]), [600])
+        self.assertEqual(len(self.reader.read()), 0)
+        # reading doesn't affect the newest record
+        self.assertEqual(self.reader.latest()["tone"], 600)
+
+    def test_wraparound(self):
+        """
+        the file should not grow, and a slow reader should get the newest records and count the ones it missed
+        """
+        size = os.path.getsize(self.path)
+        for index in range(20):
+            self.writer.publish(300 if index % 2 else 600, np.zeros(2))
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(list(self.reader.read()["seq"]), list(range(13, 21)))
+        self.assertEqual(self.reader.overruns, 12)
+        self.assertEqual(self.reader.latest()["tone"], 300)
+
+    def test_torn_record(self):
+        """
+        a record that is being written should be skipped, latest() falls back to the one before it
+        """
+        self.writer.publish(300, np.zeros(2))
+        self.writer.publish(600, np.zeros(2))
+        self.writer.records["seq"][1] = 0
+        self.assertEqual(self.reader.latest()["tone"], 300)
+        self.assertEqual(list(self.reader.read()["seq"]), [1])
+
+    def test_reset(self):
+        self.writer.publish(300, np.zeros(2))
+        self.reader.reset()
+        self.assertIsNone(self.reader.latest())
+        self.writer.publish(600, np.zeros(2))
+        self.assertEqual(self.reader.latest()["tone"], 600)
+
+    def test_recreate(self):
+        """
+        a restarted writer should be picked up from its first record, with its own tones
+        """
+        self.writer.publish(300, np.zeros(2))
+        self.reader.read()
+        writer = AudioRing(self.path)
+        writer.create((300, 600, 900), capacity=4)
+        writer.publish(900, np.zeros(3))
+        self.assertEqual(list(self.reader.read()["tone"]), [900])
+        self.assertEqual(self.reader.tones, (300, 600, 900))
+        writer.close()
+
+    def test_not_created(self):
+        """
+        an empty capture, like the one the setup script creates, can't be read yet
+        """
+        open(self.path, "w").close()
+        reader = AudioRing(self.path)
+        self.assertIsNone(reader.latest())
+        self.assertFalse(reader.attach())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+This file tests the latency measurements.
+These tests don't need docker.
+"""
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from latency import Histogram, LatencyLog, LatencyRecorder, summarize
+
+
+class TestLatencyRecorder(unittest.TestCase):
+    def setUp(self):
+        self.log = LatencyLog()
+        self.recorder = LatencyRecorder("docker", self.log)
+
+    def transitions(self):
+        return [sample.transition for sample in self.recorder.samples]
+
+    def test_attribution(self):
+        """
+        every kind of effect is attributed once to the last command, and only when it changed
+        """
+        self.recorder.effect("ptt", False)
+        self.assertEqual(self.recorder.samples, [])
+        self.recorder.command("open_squelch", "remote1")
+        time.sleep(0.01)
+        self.recorder.effect("ptt", False)
+        self.recorder.effect("ptt", True)
+        self.recorder.effect("active", "remote1", reported=time.time())
+        self.recorder.effect("active", "remote1")
+        self.recorder.effect("tone", "remote2")
+        self.recorder.effect("tone", "remote1")
+        self.assertEqual(self.transitions(), ["open_squelch->ptt", "open_squelch->active", "open_squelch->active(svxlink)",
+                                              "open_squelch->tone"])
+        self.assertGreaterEqual(self.recorder.samples[0].seconds, 0.01)
+        self.assertEqual(self.recorder.samples[-1].value, "remote2")
+        self.recorder.command("close_squelch", "remote1")
+        self.recorder.effect("ptt", False)
+        self.assertEqual(self.transitions()[-1], "close_squelch->ptt")
+        self.assertEqual(len(self.log.samples), 5)
+
+    def test_too_late(self):
+        self.recorder.command("disable_remote", "remote1")
+        with mock.patch("latency.monotonic", return_value=time.monotonic() + 60):
+            self.recorder.effect("active", None)
+        self.assertEqual(self.recorder.samples, [])
+
+    def test_reset(self):
+        self.recorder.command("open_squelch", "remote1")
+        self.recorder.effect("ptt", True)
+        self.recorder.reset()
+        self.recorder.effect("ptt", True)
+        self.assertEqual(len(self.recorder.samples), 1)
+
+    def test_phase(self):
+        """
+        only the latencies of the tests themselves count, not those of setting up the environment
+        """
+        with mock.patch.dict(os.environ, {"PYTEST_CURRENT_TEST": "tests/test_x.py::Test::test_a (setup)"}):
+            self.recorder.command("open_squelch", "remote1")
+        self.recorder.effect("ptt", True)
+        with mock.patch.dict(os.environ, {"PYTEST_CURRENT_TEST": "tests/test_x.py::Test::test_a (call)"}):
+            self.recorder.command("close_squelch", "remote1")
+        self.recorder.effect("ptt", False)
+        self.assertEqual([sample.transition for sample in self.log.tests()], ["close_squelch->ptt"])
+        self.assertEqual(len(self.log.for_test("tests/test_x.py::Test::test_a")), 1)
+
+
+class TestHistogram(unittest.TestCase):
+    def test_summary(self):
+        recorder = LatencyRecorder("docker", LatencyLog())
+        for seconds in (0.1, 0.2, 0.3, 0.4, 1.0):
+            recorder.command("open_squelch", "remote1")
+            with mock.patch("latency.monotonic", return_value=recorder.last_command.at + seconds):
+                recorder.effect("ptt", seconds)
+        stats = summarize(recorder.samples)["open_squelch->ptt"]
+        self.assertEqual(stats["count"], 5)
+        self.assertAlmostEqual(stats["p50"], 0.3)
+        self.assertAlmostEqual(stats["max"], 1.0)
+
+    def test_percentile(self):
+        histogram = Histogram()
+        for seconds in [0.004] * 50 + [0.15] * 45 + [0.6] * 4 + [45.0]:
+            histogram.add(seconds)
+        self.assertEqual(histogram.count, 100)
+        self.assertEqual(histogram.percentile(50), 0.005)
+        self.assertEqual(histogram.percentile(95), 0.2)
+        self.assertEqual(histogram.percentile(100), 45.0)
+
+    def test_save(self):
+        """
+        the histograms of every run are added to those on disk, per branch and backend
+        """
+        log = LatencyLog()
+        recorder = LatencyRecorder("docker", log)
+        recorder.command("open_squelch", "remote1")
+        recorder.effect("ptt", True)
+        sim = LatencyRecorder("sim", log)
+        sim.command("open_squelch", "remote1")
+        sim.effect("ptt", True)
+        with tempfile.TemporaryDirectory() as directory:
+            log.save("master", directory)
+            paths = log.save("master", directory)
+            self.assertEqual(sorted(os.path.basename(path) for path in paths), ["master-sim.json", "master.json"])
+            with open(os.path.join(directory, "master.json")) as saved:
+                data = json.load(saved)
+        self.assertEqual(data["runs"], 2)
+        self.assertEqual(sum(data["transitions"]["open_squelch->ptt"]["counts"]), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
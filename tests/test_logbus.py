@@ -0,0 +1,114 @@
+"""
+This file tests the log bus, with a fake container instead of docker.
+"""
+from concurrent.futures import TimeoutError
+import queue
+import unittest
+
+from logbus import LogPump, parse_docker_timestamp
+
+
+class FakeStream:
+    """
+    behaves like the CancellableStream docker returns for followed logs
+    """
+    def __init__(self):
+        self.chunks = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        self.chunks.put(None)
+
+
+class FakeContainer:
+    name = "svxlink"
+
+    def __init__(self):
+        self.stream = FakeStream()
+
+    def logs(self, **kwargs):
+        return self.stream
+
+
+class TestLogPump(unittest.TestCase):
+    def setUp(self):
+        self.container = FakeContainer()
+        self.pump = LogPump(self.container, max_lines=3)
+        self.pump.start()
+
+    def tearDown(self):
+        self.pump.stop()
+
+    def send(self, data):
+        self.container.stream.chunks.put(data)
+
+    def test_expect_new_line(self):
+        future = self.pump.expect(["172.17.0.1:5211: RemoteTrx protocol", "Authentication failed"])
+        self.send(b"2023-06-01T12:34:56.123456789Z Connecting to 172.17.0.1:5211\n2023-06-01T12:34:57.5Z 172.17.0.1:52")
+        self.send(b"11: RemoteTrx protocol version 3.0\n")
+        match = future.result(2)
+        self.assertEqual(match.pattern, "172.17.0.1:5211: RemoteTrx protocol")
+        self.assertEqual(match.timestamp.microsecond, 500000)
+
+    def test_expect_history(self):
+        """
+        lines that were logged before the expectation was registered should match as well
+        """
+        self.send(b"2023-06-01T12:34:56Z started\n")
+        self.pump.expect("started").result(2)
+        self.assertTrue(self.pump.find("started"))
+        self.assertIsNotNone(self.pump.expect("start", regex=True).result(0))
+
+    def test_regex(self):
+        future = self.pump.expect([r"remote\d: (open|closed)"], regex=True)
+        self.send(b"2023-06-01T12:34:56Z remote2: closed\n")
+        self.assertEqual(future.result(2).line, "remote2: closed")
+
+    def test_not_found(self):
+        """
+        a line that doesn't match should not resolve the future (-1 from find() used to count as found)
+        """
+        future = self.pump.expect("RemoteTrx protocol")
+        self.send(b"2023-06-01T12:34:56Z something else\n")
+        with self.assertRaises(TimeoutError):
+            future.result(0.2)
+        self.assertFalse(self.pump.find("RemoteTrx"))
+
+    def test_cancelled_while_matching(self):
+        """
+        a waiter that gives up while its line is being matched should not end the log stream
+        """
+        future = self.pump.expect("started", history=False)
+        expectation = self.pump.expectations[0]
+        match = expectation.match
+
+        def cancel_then_match(line):
+            future.cancel()
+            return match(line)
+        expectation.match = cancel_then_match
+        self.send(b"2023-06-01T12:34:56Z started\n")
+        self.assertIsNotNone(self.pump.expect("started").result(2))
+        self.assertTrue(future.cancelled())
+        self.send(b"2023-06-01T12:34:57Z ready\n")
+        self.assertEqual(self.pump.expect("ready").result(2).line, "ready")
+
+    def test_bounded(self):
+        for i in range(10):
+            self.send("2023-06-01T12:34:56Z line {}\n".format(i).encode())
+        self.pump.expect("line 9").result(2)
+        self.assertEqual(len(self.pump.lines), 3)
+        self.assertFalse(self.pump.find("line 0"))
+
+    def test_timestamp(self):
+        self.assertIsNone(parse_docker_timestamp("garbage"))
+        self.assertEqual(parse_docker_timestamp("2023-06-01T12:34:56.000001Z").microsecond, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
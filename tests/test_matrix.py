@@ -0,0 +1,195 @@
+"""
+This file tests merging the results of the branch matrix, and the cache of passed results.
+These tests don't need docker.
+"""
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from matrix import BranchRun, Matrix, collect_args, junit_id, parse_junit
+from resultcache import ResultCache, image_identity
+
+JUNIT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites><testsuite name="pytest" tests="3">
+<testcase classname="tests.test_original.Test" name="test_switchover_with_squelch" time="12.5" />
+<testcase classname="tests.test_original.Test" name="test_reselect_open_disable_enable" time="30.1">
+<failure message="AssertionError: False != True : remote1 should become active">trace</failure>
+</testcase>
+<testcase classname="tests.test_original.Test" name="test_skipped" time="0.0"><skipped message="no" /></testcase>
+</testsuite></testsuites>
+"""
+
+
+class TestMatrix(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "master.xml")
+        with open(self.path, "w") as junit:
+            junit.write(JUNIT)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_parse_junit(self):
+        results = parse_junit(self.path)
+        self.assertEqual(len(results), 3)
+        failed = results["tests.test_original.Test::test_reselect_open_disable_enable"]
+        self.assertEqual(failed.outcome, "failed")
+        self.assertIn("remote1 should become active", failed.message)
+        self.assertEqual(results["tests.test_original.Test::test_switchover_with_squelch"].duration, 12.5)
+        self.assertEqual(results["tests.test_original.Test::test_skipped"].outcome, "skipped")
+
+    def test_merge(self):
+        """
+        the report should have a row per test, with a column per branch
+        """
+        matrix = Matrix(["master", "old"])
+        for slot, branch in enumerate(matrix.branches):
+            run = BranchRun(branch, slot, [])
+            run.duration = 45.0 + slot
+            matrix.runs[branch] = run
+        matrix.runs["master"].results = parse_junit(self.path)
+        matrix.duration = 46.0
+        report = matrix.text_report()
+        self.assertIn("test_reselect_open_disable_enable", report)
+        self.assertIn("failed 30.1s", report)
+        self.assertIn("wall clock 46.0s, sum of branches 91.0s", report)
+        data = matrix.as_dict()
+        self.assertIsNone(data["tests"]["tests.test_original.Test::test_skipped"]["old"])
+        self.assertIn("<th>old</th>", matrix.html_report())
+
+    def test_run_environment(self):
+        """
+        every branch should get its own stack
+        """
+        run = BranchRun("old", 2, ["-k", "switchover"])
+        env = run.environment()
+        self.assertEqual((env["BRANCH"], env["STACK_NAME"], env["STACK_SLOT"]), ("old", "old", "2"))
+        self.assertEqual(run.command()[-2:], ["-k", "switchover"])
+
+    def test_collect_args(self):
+        self.assertEqual(collect_args(["-n", "2", "-k", "switchover", "-n4", "--dist=load"]), ["-k", "switchover"])
+        self.assertEqual(junit_id("tests/test_original.py::Test::test_x[1]"), "tests.test_original.Test::test_x[1]")
+
+
+class TestResultCache(unittest.TestCase):
+    TESTS = ["tests/test_original.py::Test::test_switchover_with_squelch",
+             "tests/test_original.py::Test::test_reselect_open_disable_enable"]
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, "root")
+        for name, content in (("goertzel.py", "x = 1"), ("matrix.py", ""), ("configs/svxlink.conf", "[GLOBAL]"),
+                              ("tests/test_original.py", "def test(): pass")):
+            self.write(name, content)
+        self.environ = {"BACKEND": "sim"}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        os.makedirs(os.path.dirname(os.path.join(self.root, name)), exist_ok=True)
+        with open(os.path.join(self.root, name), "w") as output:
+            output.write(content)
+
+    def cache(self):
+        return ResultCache(os.path.join(self.directory.name, "cache"), self.root, self.environ)
+
+    def test_fingerprint(self):
+        """
+        the fingerprint should change with the image, the test, the harness, the configs and the environment,
+        and not with the tools that run the tests
+        """
+        key = self.cache().fingerprint("old", "sim", self.TESTS[0])
+        self.assertEqual(key, self.cache().fingerprint("old", "sim", self.TESTS[0]))
+        self.assertNotEqual(key, self.cache().fingerprint("old", "abc:def", self.TESTS[0]))
+        self.assertNotEqual(key, self.cache().fingerprint("old", "sim", self.TESTS[1]))
+        self.write("matrix.py", "changed")
+        self.assertEqual(key, self.cache().fingerprint("old", "sim", self.TESTS[0]))
+        for name in ("goertzel.py", "configs/svxlink.conf", "tests/test_original.py"):
+            self.write(name, "changed")
+            changed = self.cache().fingerprint("old", "sim", self.TESTS[0])
+            self.assertNotEqual(key, changed, name)
+            key = changed
+        self.environ["REMOTES"] = "16"
+        self.assertNotEqual(key, self.cache().fingerprint("old", "sim", self.TESTS[0]))
+
+    def test_only_passed(self):
+        cache = self.cache()
+        self.assertFalse(cache.put("a" * 64, "old", self.TESTS[1], "failed", 30.1, "remote1 should become active"))
+        self.assertIsNone(cache.get("a" * 64))
+        self.assertTrue(cache.put("b" * 64, "old", self.TESTS[0], "passed", 12.5))
+        self.assertEqual(cache.get("b" * 64)["duration"], 12.5)
+
+    def test_matrix(self):
+        """
+        a second run should only run the test that failed, and report the other one from the cache
+        """
+        self.enterContext(mock.patch.dict(os.environ, {"BACKEND": "sim"}))
+        matrix = Matrix(["old"], ["-k", "squelch"], self.cache())
+        run = BranchRun("old", 0, matrix.pytest_args)
+        matrix.lookup(run, self.TESTS)
+        self.assertEqual(len(run.keys), 2)
+        self.assertEqual(len(run.cached), 0)
+        run.results = run.merge(parse_junit(self.write_junit()))
+        matrix.store(run)
+
+        again = BranchRun("old", 0, matrix.pytest_args)
+        matrix.lookup(again, self.TESTS)
+        self.assertEqual(list(again.cached), self.TESTS[:1])
+        self.assertFalse(again.up_to_date)
+        self.assertEqual(again.command()[-2:], ["--deselect", self.TESTS[0]])
+        again.wait()
+        result = again.results["tests.test_original.Test::test_switchover_with_squelch"]
+        self.assertTrue(result.cached)
+        self.assertEqual(result.duration, 12.5)
+
+        matrix.force = True
+        forced = BranchRun("old", 0, matrix.pytest_args)
+        matrix.lookup(forced, self.TESTS)
+        self.assertEqual(len(forced.cached), 0)
+
+    def test_check(self):
+        """
+        with every result cached there is nothing to run, and the branch report isn't written
+        """
+        self.enterContext(mock.patch.dict(os.environ, {"BACKEND": "sim"}))
+        cache = self.cache()
+        for nodeid in self.TESTS:
+            cache.put(cache.fingerprint("old", "sim", nodeid), "old", nodeid, "passed", 1.0)
+        matrix = Matrix(["old"], [], cache)
+        matrix.collect = lambda: list(self.TESTS)
+        self.assertTrue(matrix.check())
+        matrix.runs.clear()
+        matrix.collect = lambda: list(self.TESTS) + ["tests/test_original.py::Test::test_new"]
+        self.assertFalse(matrix.check())
+
+    def test_identity_without_image(self):
+        """
+        without an image, the head of the branch and the Dockerfile identify what would be built
+        """
+        self.write("Dockerfile", "FROM debian")
+        revision = "0123456789abcdef0123456789abcdef01234567"
+
+        def run(command, **kwargs):
+            if command[0] == "docker":
+                raise subprocess.CalledProcessError(1, command)
+            self.assertEqual(command[-1], "refs/heads/old")
+            return subprocess.CompletedProcess(command, 0, "{}\trefs/heads/old\n".format(revision))
+        with mock.patch("resultcache.subprocess.run", run), \
+                mock.patch("resultcache.remote_identity.__defaults__", (self.root,)):
+            identity = image_identity("old")
+        self.assertTrue(identity.startswith(revision + ":"))
+        self.assertEqual(len(identity.split(":")[1]), 64)
+
+    def write_junit(self):
+        path = os.path.join(self.directory.name, "old.xml")
+        with open(path, "w") as junit:
+            junit.write(JUNIT)
+        return path
+
+
+if __name__ == '__main__':
+    unittest.main()
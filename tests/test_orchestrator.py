@@ -0,0 +1,134 @@
+"""
+This file tests the startup orchestration, with fake docker events instead of docker.
+"""
+import os
+import queue
+import tempfile
+import time
+import unittest
+
+from orchestrator import DockerEvents, ListenProbe, Orchestrator, PathProbe, Service
+
+
+class FakeStream:
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def __iter__(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self):
+        self.events.put(None)
+
+
+class FakeContainer:
+    """
+    runs `test -e` on the host
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def exec_run(self, command):
+        return type("ExecResult", (), {"exit_code": 0 if os.path.exists(command[-1]) else 1})
+
+
+class FakeClient:
+    """
+    emits a start event for every container that docker-compose is asked to bring up
+    """
+    def __init__(self):
+        self.stream = FakeStream()
+        self.containers = self
+
+    def events(self, **kwargs):
+        return self.stream
+
+    def get(self, name):
+        return FakeContainer(name)
+
+    def emit(self, name, action):
+        self.stream.events.put({"Action": action, "Actor": {"Attributes": {"name": name}}})
+
+
+class FakeLogs:
+    def attach(self, container):
+        pass
+
+
+class TestOrchestrator(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.events = DockerEvents(self.client)
+        self.events.start()
+
+    def tearDown(self):
+        self.events.stop()
+
+    def orchestrator(self, action="start"):
+        # the compose command is a shell that emits the docker events for the services it was given
+        orchestrator = Orchestrator(self.client, self.events, FakeLogs(), ["true"])
+        original = orchestrator.up_wave
+
+        def up_wave(wave, timeout):
+            for service in wave:
+                self.client.emit(service.container_name, action)
+            return original(wave, timeout)
+        orchestrator.up_wave = up_wave
+        return orchestrator
+
+    def test_waves(self):
+        """
+        all waves should start, with a timing per phase and per probe
+        """
+        orchestrator = self.orchestrator()
+        with tempfile.NamedTemporaryFile() as pty:
+            ready = orchestrator.up([
+                [Service("remote1", [PathProbe(pty.name)]), Service("remote2")],
+                [Service("svxlink", [lambda container: container.name == "svxlink"])],
+            ], timeout=5)
+        self.assertTrue(ready)
+        self.assertIn("remote1+remote2 create", orchestrator.timings)
+        self.assertIn("remote1 path {}".format(pty.name), orchestrator.timings)
+        self.assertIn("svxlink ready", orchestrator.timings)
+
+    def test_probe_timeout(self):
+        orchestrator = self.orchestrator()
+        self.assertFalse(orchestrator.up([[Service("remote1", [lambda container: False])]], timeout=0.3))
+
+    def test_died(self):
+        """
+        a container that dies during startup should fail the startup right away, not at the timeout
+        """
+        orchestrator = self.orchestrator()
+
+        def crash(container):
+            self.client.emit(container.name, "die")
+            return False
+        start = time.monotonic()
+        self.assertFalse(orchestrator.up([[Service("remote1", [crash])]], timeout=5))
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_listen_probe(self):
+        """
+        a port is only listened on when the process inside the container opened it, not when docker published it
+        """
+        table = (
+            "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode\n"
+            "   0: 0100007F:1452 0100007F:C350 01 00000000:00000000 00:00000000 00000000     0        0 1\n"
+        )
+        listening = "   1: 00000000:1452 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 2\n"
+        container = FakeContainer("remote1")
+        container.exec_run = lambda command: type("ExecResult", (), {"output": table.encode()})
+        probe = ListenProbe(5202)
+        self.assertFalse(probe(container))
+        table += listening
+        self.assertTrue(probe(container))
+        self.assertEqual(str(probe), "listen 5202")
+
+
+if __name__ == '__main__':
+    unittest.main()
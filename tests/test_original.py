@@ -3,26 +3,35 @@ This file tests the functions that we did not patch. Just to make sure these sti
 """
 import time
 
-from environment import Environment
+from environment import new_environment
+from pool import shared_pool
 import logging
 import unittest
 
 WAIT_TIME = 5
+POOL = shared_pool(new_environment)
 
 
 class Test(unittest.TestCase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.env = Environment()
+        self.env = None
         self.log = logging.getLogger(__class__.__name__)
 
     def setUp(self):
+        if POOL:
+            self.env = POOL.acquire(__name__)
+            return
+        self.env = new_environment()
         if not self.env.start():
             raise RuntimeError("failed to set up env")
 
     def tearDown(self):
         self.log.getChild("voter").info(self.env.voter_state)
         self.log.getChild("ptt").info(self.env.ptt_state)
+        if POOL:
+            POOL.release(self.env)
+            return
         self.env.stop()
 
     def test_switchover_with_squelch(self):
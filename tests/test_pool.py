@@ -0,0 +1,80 @@
+"""
+This file tests the environment pool, with a fake environment instead of docker.
+"""
+import unittest
+
+from pool import EnvironmentPool
+
+
+class FakeEnvironment:
+    instances = []
+
+    def __init__(self, converge=True):
+        self.converge = converge
+        self.started = False
+        self.resets = 0
+        FakeEnvironment.instances.append(self)
+
+    def start(self):
+        self.started = True
+        return True
+
+    def stop(self):
+        self.started = False
+
+    def fast_reset(self):
+        self.resets += 1
+        return self.converge
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        FakeEnvironment.instances = []
+
+    def test_session(self):
+        """
+        in session mode, the same stack should be reset and reused
+        """
+        pool = EnvironmentPool(FakeEnvironment, "session")
+        first = pool.acquire("tests.a")
+        pool.release(first)
+        second = pool.acquire("tests.b")
+        self.assertIs(first, second)
+        self.assertEqual(first.resets, 1)
+        pool.close()
+        self.assertFalse(first.started)
+        self.assertEqual((pool.starts, pool.resets, pool.stops), (1, 1, 1))
+
+    def test_module(self):
+        pool = EnvironmentPool(FakeEnvironment, "module")
+        first = pool.acquire("tests.a")
+        self.assertIs(pool.acquire("tests.a"), first)
+        second = pool.acquire("tests.b")
+        self.assertIsNot(first, second)
+        self.assertFalse(first.started)
+
+    def test_recycle(self):
+        """
+        a stack that doesn't reset should be replaced by a new one
+        """
+        pool = EnvironmentPool(lambda: FakeEnvironment(converge=False), "session")
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertFalse(first.started)
+        self.assertTrue(second.started)
+        self.assertEqual(pool.recycles, 1)
+
+    def test_saved(self):
+        pool = EnvironmentPool(FakeEnvironment, "session")
+        pool.acquire()
+        pool.start_time = 10.0
+        pool.acquire()
+        pool.acquire()
+        pool.reset_time = 1.0
+        self.assertAlmostEqual(pool.saved, 19.0)
+        self.assertIn("saved about 19.0s", pool.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,219 @@
+"""
+This file tests the pure-Python svxlink stand-in.
+These tests don't need docker, the tests in test_original.py can run against it with BACKEND=sim.
+"""
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from goertzel import SILENCE
+from simulator import SimEnvironment, SimReceiver, SimVoter, Simulator
+from stack import Stack
+from topology import Topology
+
+TIMING = {
+    "VOTING_DELAY": 0,
+    "HYSTERESIS": 20,
+    "SQL_CLOSE_REVOTE_DELAY": 20,
+    "RX_SWITCH_DELAY": 20,
+    "REVOTE_INTERVAL": 10,
+    "IDLE_TIMEOUT": 50,
+}
+
+
+class TestSimVoter(unittest.TestCase):
+    flavor = "hobbyscoop"
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.state = os.path.join(self.directory.name, "state")
+        self.ptt = os.path.join(self.directory.name, "ptt")
+        self.voter = SimVoter([SimReceiver("remote1", 1000, 300), SimReceiver("remote2", 30, 600)], TIMING,
+                              self.state, self.ptt, self.flavor)
+        self.voter.start()
+
+    def tearDown(self):
+        self.voter.stop()
+        self.directory.cleanup()
+
+    def last_state(self):
+        with open(self.state) as state:
+            return state.read().splitlines()[-1].split(" ", 2)[2]
+
+    def wait(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def test_switchover(self):
+        """
+        a stronger receiver should take over after the switch delay
+        """
+        self.voter.squelch("remote2", True)
+        self.assertTrue(self.wait(lambda: self.voter.active and self.voter.active.name == "remote2"))
+        self.assertTrue(self.voter.tx_on)
+        self.voter.squelch("remote1", True)
+        self.assertTrue(self.wait(lambda: self.voter.active.name == "remote1"))
+        self.voter.squelch("remote1", False)
+        self.voter.squelch("remote2", False)
+        self.assertTrue(self.wait(lambda: not self.voter.tx_on))
+        with open(self.ptt) as ptt:
+            self.assertEqual(ptt.read(), "TR")
+        state = {item["name"]: item for item in json.loads(self.last_state())}
+        self.assertFalse(state["remote1"]["active"])
+
+    def test_hysteresis(self):
+        """
+        a receiver that isn't HYSTERESIS stronger shouldn't take over
+        """
+        self.voter.receivers["remote1"].siglev = 40
+        self.voter.squelch("remote2", True)
+        self.assertTrue(self.wait(lambda: self.voter.active is not None))
+        self.voter.squelch("remote1", True)
+        time.sleep(0.1)
+        self.assertEqual(self.voter.active.name, "remote2")
+
+    def test_mute_forces_squelch_closed(self):
+        """
+        the hobbyscoop patch closes the squelch of a muted receiver, so enabling it doesn't reselect it
+        """
+        self.voter.squelch("remote1", True)
+        self.assertTrue(self.wait(lambda: self.voter.active is not None))
+        self.voter.command("MUTE remote1")
+        self.assertTrue(self.wait(lambda: self.voter.active is None))
+        self.voter.command("ENABLE remote1")
+        time.sleep(0.05)
+        self.assertIsNone(self.voter.active)
+        self.assertTrue(self.voter.receivers["remote1"].sql_open)
+
+
+class TestSimVoterOld(TestSimVoter):
+    flavor = "old"
+
+    def test_mute_forces_squelch_closed(self):
+        """
+        the 2018 patches keep the squelch state, so enabling reselects the receiver
+        """
+        self.voter.squelch("remote1", True)
+        self.assertTrue(self.wait(lambda: self.voter.active is not None))
+        self.voter.command("remote1:0")
+        self.assertTrue(self.wait(lambda: self.voter.active is None))
+        self.assertTrue(self.last_state().startswith("remote1#+1000 remote2_+030"))
+        self.voter.command("remote1:1")
+        self.assertTrue(self.wait(lambda: self.voter.active is not None))
+        self.assertEqual(self.last_state(), "remote1*+1000 remote2_+030")
+
+    def test_switchover(self):
+        pass
+
+
+class TestSimEnvironment(unittest.TestCase):
+    def test_switchover(self):
+        """
+        the whole chain: squelch, voter, PTT, audio, tone detection and the environment reading it all back
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            stack = Stack("sim-test")
+            stack.directory = directory
+            env = SimEnvironment(stack)
+            self.assertTrue(env.start())
+            try:
+                env.open_squelch("remote2", True)
+                self.assertTrue(env.wait_for_ptt(True, 2))
+                self.assertTrue(env.wait_for_remote_state("remote2", "active", True, 2))
+                self.assertTrue(env.wait_for_remote_by_tone("remote2", 2))
+                env.open_squelch("remote1", True)
+                self.assertTrue(env.wait_for_remote_state("remote1", "active", True, 2))
+                self.assertTrue(env.wait_for_remote_by_tone("remote1", 2))
+                # with the squelches closed the transmitter stays on a while, that's silence and not the nearest tone
+                env.open_squelch("remote1", False)
+                env.open_squelch("remote2", False)
+                self.assertTrue(env.wait_for_remote_by_tone(SILENCE, 2))
+                self.assertTrue(env.fast_reset(5))
+                self.assertEqual(env.voter_state, {})
+                # the next reset finds nothing to change, so the voter prints no state
+                env.reset = lambda: None
+                started = time.monotonic()
+                self.assertTrue(env.fast_reset(5))
+                self.assertLess(time.monotonic() - started, 1)
+            finally:
+                env.stop()
+
+    def test_fast_reset_not_idle(self):
+        """
+        a remote that stays disabled after the reset should fail it, and keep the captures for a look
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            stack = Stack("sim-test")
+            stack.directory = directory
+            env = SimEnvironment(stack)
+            self.assertTrue(env.start())
+            try:
+                env.disable_remote("remote2")
+                self.assertTrue(env.wait_for_remote_state("remote2", "enabled", False, 2))
+                self.assertFalse(env.idle)
+                env.reset = lambda: None
+                self.assertFalse(env.fast_reset(0.5))
+                self.assertNotEqual(env.voter_state, {})
+            finally:
+                env.stop()
+
+    def test_spectrum(self):
+        """
+        the audio of the active remote should be summarized every second, on both channels
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            stack = Stack("sim-test")
+            stack.directory = directory
+            env = SimEnvironment(stack)
+            self.assertTrue(env.start())
+            try:
+                env.open_squelch("remote2", True)
+                self.assertTrue(env.wait_for_remote_by_tone("remote2", 2))
+                self.assertTrue(env.watcher.wait_for(lambda: len(env.spectrum_summaries(0)) >= 2, 3))
+                summary, other = env.spectrum_summaries(0)[-1], env.spectrum_summaries(1)[-1]
+            finally:
+                env.stop()
+        self.assertAlmostEqual(summary["dominant"], 600, delta=1)
+        self.assertEqual(summary["clipped"], 0)
+        self.assertGreater(summary["snr_db"], 40)
+        # the simulator only sends audio on the first channel
+        self.assertEqual(other["silent"], other["windows"])
+
+    def test_many_remotes(self):
+        """
+        with 16 generated remotes, the loudest open one should be selected and recognised by its tone
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            stack = Stack("sim-test", topology=Topology.generate(16))
+            stack.directory = directory
+            env = SimEnvironment(stack)
+            self.assertTrue(env.start())
+            try:
+                self.assertEqual(len(env.simulator.receivers), 16)
+                env.open_squelch("remote12", True)
+                self.assertTrue(env.wait_for_remote_by_tone("remote12", 2))
+                env.open_squelch("remote9", True)
+                self.assertTrue(env.wait_for_remote_state("remote9", "active", True, 2))
+                self.assertTrue(env.wait_for_remote_by_tone("remote9", 2))
+            finally:
+                env.stop()
+
+    def test_configs(self):
+        """
+        the simulator should take the remotes and the timing from configs/
+        """
+        simulator = Simulator.from_configs("state", "ptt", "audio")
+        self.assertEqual({name: (rx.siglev, rx.tone) for name, rx in simulator.receivers.items()},
+                         {"remote1": (1000, 300), "remote2": (30, 600)})
+        self.assertEqual(simulator.voter.timing["RX_SWITCH_DELAY"], 250)
+        self.assertEqual(simulator.voter.timing["IDLE_TIMEOUT"], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
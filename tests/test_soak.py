@@ -0,0 +1,145 @@
+"""
+This file tests the squelch storm soak: the patterns, the correlation of events with the state, and a short run
+against the simulator. These tests don't need docker.
+"""
+import json
+import tempfile
+import unittest
+
+from simulator import SimEnvironment
+from soak import Injection, Soak, analyse, format_report, load_script, random_pattern
+from stack import Stack
+from tests.states import START, history
+
+
+def sent(at, kind, remote):
+    injection = Injection(at, kind, remote)
+    injection.sent = at
+    injection.wall = START + at
+    return injection
+
+
+class TestPatterns(unittest.TestCase):
+    def test_random_pattern(self):
+        pattern = random_pattern(["remote1", "remote2"], rate=200, duration=10, seed=1)
+        self.assertEqual([(i.at, i.kind, i.remote) for i in pattern],
+                         [(i.at, i.kind, i.remote) for i in random_pattern(["remote1", "remote2"], 200, 10, seed=1)])
+        self.assertAlmostEqual(len(pattern), 2000, delta=200)
+        self.assertEqual(pattern, sorted(pattern, key=lambda injection: injection.at))
+        # every remote flaps: open and close alternate
+        kinds = [injection.kind for injection in pattern if injection.remote == "remote1" and injection.kind in ("open", "close")]
+        self.assertEqual(kinds[:4], ["open", "close", "open", "close"])
+        self.assertTrue(any(injection.kind == "disable" for injection in pattern))
+
+    def test_script(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as script:
+            json.dump([[0.5, "close", "remote1"], [0.0, "open", "remote1"]], script)
+            script.flush()
+            self.assertEqual([(i.at, i.kind) for i in load_script(script.name)], [(0.0, "open"), (0.5, "close")])
+        with self.assertRaises(ValueError):
+            Injection(0.0, "flap", "remote1")
+
+
+class TestAnalyse(unittest.TestCase):
+    def test_transitions(self):
+        """
+        an event shown before the next one is seen, one undone before it was shown is coalesced,
+        one that stood long enough without being shown is missed
+        """
+        pattern = [
+            sent(0.0, "open", "remote1"),
+            sent(0.1, "close", "remote1"),
+            sent(0.11, "open", "remote1"),
+            sent(0.12, "close", "remote1"),
+            sent(0.2, "open", "remote2"),
+            sent(1.5, "close", "remote2"),
+        ]
+        states = history((0.005, "remote1*+1000 remote2_+030"), (0.105, "remote1_+1000 remote2_+030"),
+                         (0.125, "remote1_+1000 remote2_+030"), (2.0, "remote1_+1000 remote2_+030"))
+        report = analyse(pattern, states, [], ["remote1", "remote2"], START, 2.0)
+        self.assertEqual(dict(report["transitions"]), {"seen": 4, "coalesced": 1, "missed": 1, "masked": 0})
+        self.assertEqual(report["missed"], [{"at": 0.2, "kind": "open", "remote": "remote2"}])
+        self.assertEqual(report["throughput"]["state_lines"], 4)
+        # the close of remote2 only shows at the state line half a second later
+        self.assertAlmostEqual(report["state_delay_ms"]["max"], 500, delta=0.5)
+
+    def test_masked(self):
+        """
+        the squelch of a disabled remote isn't expected to show
+        """
+        pattern = [sent(0.0, "disable", "remote2"), sent(0.1, "open", "remote2"), sent(1.0, "enable", "remote2")]
+        states = history((0.01, "remote1_+1000 remote2#+030"), (1.01, "remote1_+1000 remote2:+030"))
+        report = analyse(pattern, states, [], ["remote1", "remote2"], START, 1.5)
+        self.assertEqual(dict(report["transitions"]), {"seen": 3, "coalesced": 0, "missed": 0, "masked": 0})
+        states = history((0.01, "remote1_+1000 remote2#+030"), (1.01, "remote1_+1000 remote2_+030"))
+        report = analyse(pattern[:2], states, [], ["remote1", "remote2"], START, 1.5)
+        self.assertEqual(dict(report["transitions"]), {"seen": 1, "coalesced": 0, "missed": 0, "masked": 1})
+
+    def test_ptt(self):
+        """
+        the PTT edge is expected when a remote becomes active after the voting delay, and when none is active anymore
+        """
+        pattern = [sent(0.0, "open", "remote1"), sent(1.0, "close", "remote1")]
+        states = history((0.005, "remote1:+1000 remote2_+030"), (0.105, "remote1*+1000 remote2_+030"),
+                         (1.005, "remote1_+1000 remote2_+030"))
+        report = analyse(pattern, states, [(START + 0.11, True), (START + 2.0, False)], ["remote1", "remote2"],
+                         START, 2.5)
+        self.assertEqual(dict(report["ptt"]), {"seen": 2, "held": 0, "missing": 0})
+        self.assertEqual([(event["ptt"], event["ptt_outcome"]) for event in report["events"]],
+                         [("on", "seen"), ("off", "seen")])
+        self.assertAlmostEqual(report["events"][0]["ptt_delay_ms"], 110, delta=0.5)
+        self.assertAlmostEqual(report["events"][1]["ptt_delay_ms"], 1000, delta=0.5)
+        # the transmitter never went off
+        report = analyse(pattern, states, [(START + 0.11, True)], ["remote1", "remote2"], START, 2.5)
+        self.assertEqual(report["ptt_missing"], [{"at": 1.0, "kind": "close", "remote": "remote1", "ptt": "off"}])
+        # reopened before the tail ended, so the transmitter stays on
+        pattern.append(sent(1.2, "open", "remote1"))
+        states = history((0.005, "remote1:+1000 remote2_+030"), (0.105, "remote1*+1000 remote2_+030"),
+                         (1.005, "remote1_+1000 remote2_+030"), (1.205, "remote1*+1000 remote2_+030"))
+        report = analyse(pattern, states, [(START + 0.11, True)], ["remote1", "remote2"], START, 2.5)
+        self.assertEqual(dict(report["ptt"]), {"seen": 1, "held": 2, "missing": 0})
+
+    def test_stuck(self):
+        """
+        a remote that stays active with its squelch closed is stuck, a short revote delay isn't
+        """
+        states = history((0.0, "remote1*+1000 remote2_+030"), (0.1, "remote1_+1000 remote2_+030"),
+                         (1.0, "remote1:+1000 remote2*+030"), (1.1, "remote1:+1000 remote2*+030"),
+                         (1.2, "remote1:+1000 remote2*+030"))
+        # remote2 is active with sql_open set in the old format, make its squelch closed from 1.1 on
+        states.columns["sql_open"][3:, 1] = 0
+        report = analyse([], states, [(START + 1.0, True)], ["remote1", "remote2"], START, 1.2, stuck_after=2.0)
+        self.assertEqual(list(report["stuck"]), ["remote2"])
+        self.assertTrue(report["stuck"]["remote2"][0]["until_end"])
+        self.assertTrue(report["ptt_on_at_end"])
+        self.assertTrue(any(line.startswith("STUCK remote2") for line in format_report(
+            dict(report, resources={}, injection={"events": 0, "late": 0, "max_late_ms": 0.0}))))
+
+
+class TestSoak(unittest.TestCase):
+    def test_run(self):
+        """
+        a short storm against the simulator should have every event accounted for, and leave the voter idle
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            stack = Stack("soak-test")
+            stack.directory = directory
+            env = SimEnvironment(stack)
+            self.assertTrue(env.start())
+            try:
+                pattern = random_pattern(env.remotes, rate=100, duration=1.0, seed=3)
+                report = Soak(env, pattern, settle=2.0, resource_interval=0.2).run()
+            finally:
+                env.stop()
+        self.assertEqual(sum(report["transitions"].values()), len(pattern) + 2 * len(env.remotes))
+        self.assertEqual(report["transitions"]["missed"], 0)
+        self.assertGreater(report["throughput"]["state_lines"], len(pattern) // 2)
+        self.assertEqual(report["stuck"], {})
+        self.assertFalse(report["ptt_on_at_end"])
+        self.assertIn("simulator", report["resources"])
+        self.assertEqual(report["ptt"]["missing"], 0)
+        self.assertEqual(len(format_report(report)), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
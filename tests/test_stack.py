@@ -0,0 +1,85 @@
+"""
+This file tests the per-worker stack descriptions.
+These tests don't need docker.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from stack import Stack
+from topology import MAX_REMOTES, PORT_BLOCK, SVXLINK_PORTS, Topology
+
+
+class TestStack(unittest.TestCase):
+    def test_default(self):
+        """
+        without any settings, the hand-written stack should be used
+        """
+        with mock.patch.dict(os.environ, {}, clear=True):
+            stack = Stack.from_env()
+        self.assertFalse(stack.sharded)
+        self.assertEqual(stack.container_name("svxlink"), "svxlink")
+        self.assertEqual(stack.remote_port("remote2"), 5212)
+        self.assertEqual(stack.capture_path("state"), os.path.join(".", "state"))
+        self.assertIn("docker-compose-old.yaml", stack.compose_command("old"))
+
+    def test_workers(self):
+        """
+        every xdist worker, in every slot, should get its own name and ports
+        """
+        stacks = []
+        for slot in ("0", "1"):
+            for worker in ("gw0", "gw1"):
+                with mock.patch.dict(os.environ, {"STACK_SLOT": slot, "PYTEST_XDIST_WORKER": worker}, clear=True):
+                    stacks.append(Stack.from_env())
+        self.assertEqual(len({stack.name for stack in stacks}), 4)
+        ports = [stack.remote_port(name) for stack in stacks for name in ("remote1", "remote2")]
+        ports += [stack.port(5200) for stack in stacks]
+        self.assertEqual(len(set(ports)), len(ports))
+        self.assertEqual(stacks[0].name, "svx-slot0-gw0")
+
+    def test_max_remotes(self):
+        """
+        stacks next to each other with the most remotes shouldn't share a port
+        """
+        topology = Topology.generate(MAX_REMOTES)
+        stacks = [Stack("gw{}".format(block), port_offset=PORT_BLOCK * block, topology=topology)
+                  for block in range(3)]
+        ports = [stack.remote_port(name) for stack in stacks for name in topology.names]
+        ports += [stack.port(port) for stack in stacks for port in SVXLINK_PORTS]
+        self.assertEqual(len(set(ports)), len(ports))
+
+    def test_names(self):
+        stack = Stack("svx-master-gw2", port_offset=300)
+        self.assertEqual(stack.container_name("remote1"), "svx-master-gw2-remote1")
+        self.assertEqual(stack.service_name("svx-master-gw2-remote1"), "remote1")
+        self.assertIsNone(stack.service_name("svx-master-gw1-remote1"))
+        self.assertIsNone(stack.service_name("remote1"))
+
+    def test_render(self):
+        """
+        the rendered config should point at the ports of the stack, and the compose file should use them
+        """
+        stack = Stack("svx-test-gw0", port_offset=100)
+        with tempfile.TemporaryDirectory() as directory:
+            stack.directory = directory
+            stack.render("hobbyscoop")
+            with open(stack.capture_path("svxlink.conf")) as config:
+                data = config.read()
+            self.assertIn("TCP_PORT=5311\n", data)
+            self.assertIn("TCP_PORT=5312\n", data)
+            self.assertNotIn("TCP_PORT=5211", data)
+            with open(stack.compose_file) as compose_file:
+                compose = json.load(compose_file)
+            self.assertEqual(compose["remote1"]["ports"], ["5311:5210"])
+            self.assertEqual(compose["svxlink"]["ports"][0], "5300:5200")
+            self.assertEqual(compose["svxlink"]["image"], "svxlink:hobbyscoop")
+            self.assertIn("{}:/state".format(stack.capture_path("state")), compose["svxlink"]["volumes"])
+            self.assertTrue(os.path.exists(stack.capture_path("audio")))
+            self.assertEqual(stack.compose_command("hobbyscoop")[:3], ["docker-compose", "-p", "svx-test-gw0"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""
+This file tests the voter state parser.
+These tests don't need docker.
+"""
+import json
+import time
+import unittest
+
+import numpy as np
+
+from stateparser import JSON, OLD, UNKNOWN, RemoteState, StateHistory, StateParser, parse_old
+
+OLD_LINES = [
+    "1690000000.000 Voter:sql_state remote1_+1000 remote2_+030",
+    "1690000000.500 Voter:sql_state remote1_+1000 remote2*+030",
+    "1690000001.000 Voter:sql_state remote1*+1000 remote2:+030",
+    "1690000003.000 Voter:sql_state remote1#+1000 remote2:+030",
+]
+
+
+def json_line(timestamp, active=None, disabled=()):
+    state = [{"active": name == active, "enabled": name not in disabled, "id": "?", "name": name,
+              "siglev": siglev, "sql_open": name == active} for name, siglev in (("remote1", 1000), ("remote2", 30))]
+    return "{:.3f} Voter:sql_state {}".format(timestamp, json.dumps(state))
+
+
+class TestStateParser(unittest.TestCase):
+    def test_old(self):
+        parser = StateParser()
+        timestamp, remotes = parser.parse_line(OLD_LINES[2])
+        self.assertEqual(parser.format, OLD)
+        self.assertEqual(timestamp, 1690000001.0)
+        self.assertEqual(remotes, [RemoteState("remote1", True, True, True, 1000),
+                                   RemoteState("remote2", True, True, False, 30)])
+        _, remotes = parser.parse_line(OLD_LINES[3])
+        self.assertEqual(remotes[0].as_dict(), {"name": "remote1", "enabled": False, "siglev": 1000})
+        self.assertIsNone(remotes[0].get("active"))
+        with self.assertRaises(KeyError):
+            remotes[0]["active"]
+        self.assertEqual(remotes[1]["sql_open"], True)
+
+    def test_json(self):
+        parser = StateParser()
+        _, remotes = parser.parse_line(json_line(1.0, active="remote2", disabled=("remote1",)))
+        self.assertEqual(parser.format, JSON)
+        self.assertEqual(remotes[1], RemoteState("remote2", True, True, True, 30))
+        self.assertFalse(remotes[0].get("enabled"))
+
+    def test_switch_format(self):
+        parser = StateParser()
+        parser.parse_line(json_line(1.0))
+        _, remotes = parser.parse_line(OLD_LINES[0])
+        self.assertEqual(parser.format, OLD)
+        self.assertEqual(len(remotes), 2)
+        with self.assertRaises(ValueError):
+            parser.parse_line("1.0 Voter:sql_state garbage")
+
+    def test_parse_old(self):
+        self.assertEqual(parse_old("remote1*+1000 remote12_-010")[1], RemoteState("remote12", True, False, False, -10))
+
+
+class TestStateHistory(unittest.TestCase):
+    def check(self, history):
+        self.assertEqual(history.names, ["remote1", "remote2"])
+        self.assertEqual(len(history), 4)
+        self.assertEqual(list(history.active_remote()), [-1, 1, 0, -1])
+        self.assertEqual(list(history.column("remote1", "enabled")), [1, 1, 1, 0])
+        times, values = history.changes("remote2", "sql_open")
+        self.assertEqual(list(times), [1690000000.5])
+        self.assertEqual(list(values), [1])
+        self.assertEqual(history.active_time(), {"remote1": 2.0, "remote2": 0.5})
+
+    def test_old(self):
+        history = StateHistory.parse("\n".join(OLD_LINES) + "\n")
+        self.check(history)
+        self.assertEqual(history.column("remote1", "active")[3], UNKNOWN)
+
+    def test_old_irregular(self):
+        """
+        lines with different remotes take the slow path, and broken lines are skipped
+        """
+        lines = OLD_LINES[:2] + ["1690000000.700 Voter:sql_state broken"] + OLD_LINES[2:]
+        lines.append("1690000004.000 Voter:sql_state remote3*+050")
+        history = StateHistory.parse("\n".join(lines))
+        self.assertEqual(history.names, ["remote1", "remote2", "remote3"])
+        self.assertEqual(len(history), 5)
+        self.assertEqual(list(history.active_remote()), [-1, 1, 0, -1, 2])
+
+    def test_json(self):
+        lines = [json_line(1690000000.0), json_line(1690000000.5, active="remote2"),
+                 json_line(1690000001.0, active="remote1"), json_line(1690000003.0, disabled=("remote1",))]
+        history = StateHistory.parse("\n".join(lines))
+        # the json format tells sql_open of the second remote was closed again on the last line
+        self.assertEqual(list(history.column("remote2", "sql_open")), [0, 1, 0, 0])
+        self.assertEqual(list(history.active_remote()), [-1, 1, 0, -1])
+        self.assertEqual(history.active_time(), {"remote1": 2.0, "remote2": 0.5})
+
+    def test_empty(self):
+        history = StateHistory.parse("")
+        self.assertEqual(len(history), 0)
+        self.assertEqual(history.active_time(), {})
+
+    def test_timing(self):
+        """
+        a multi-megabyte capture should be parsed well within a second
+        """
+        rng = np.random.default_rng(1)
+        statuses = np.array(list("_:*#"))[rng.integers(0, 4, (50000, 2))]
+        text = "".join("{:.3f} Voter:sql_state remote1{}+1000 remote2{}+030\n".format(1690000000 + row * 0.1, *status)
+                       for row, status in enumerate(statuses))
+        self.assertGreater(len(text), 2 * 1024 * 1024)
+        start = time.perf_counter()
+        history = StateHistory.parse(text)
+        duration = time.perf_counter() - start
+        self.assertEqual(len(history), 50000)
+        self.assertEqual(int((history.column("remote2", "enabled") == 0).sum()), int((statuses[:, 1] == "#").sum()))
+        self.assertLess(duration, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
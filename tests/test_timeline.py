@@ -0,0 +1,150 @@
+"""
+This file tests the timeline of a run and the properties checked over it, on made up captures and against the
+simulator. These tests don't need docker.
+"""
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from goertzel import MIXED, SILENCE, SIGNATURE_VALUES
+from simulator import SimEnvironment
+from stack import Stack
+from timeline import Condition, Signal, Timeline
+from tests.states import START, history
+
+
+def audio(*windows):
+    """
+    audio records from (seconds, tone or label) pairs
+    """
+    records = np.zeros(len(windows), dtype=[("time", "<f8"), ("tone", "<f4")])
+    records["time"] = [START + at for at, _ in windows]
+    records["tone"] = [SIGNATURE_VALUES.get(value, value) for _, value in windows]
+    return records
+
+
+class TestConditions(unittest.TestCase):
+    def test_signal(self):
+        signal = Signal("x", [0, 1, 2, 3], [0, 0, 1, 1])
+        self.assertEqual(list(signal.times), [0, 2])
+        self.assertIsNone(signal.at(-1))
+        self.assertEqual(signal.at(2.5), 1)
+        self.assertEqual(list(signal.transitions()), [2])
+
+    def test_combine(self):
+        first = Condition([0, 2, 4], [True, False, True], "first")
+        second = Condition([1, 3], [True, False], "second")
+        both = first & second
+        self.assertEqual(both.intervals(0, 5).tolist(), [[1, 2]])
+        self.assertEqual((first | second).intervals(0, 5).tolist(), [[0, 3], [4, 5]])
+        self.assertEqual((~first).intervals(-1, 5).tolist(), [[-1, 0], [2, 4]])
+        self.assertEqual(both.name, "(first & second)")
+
+
+class TestTimeline(unittest.TestCase):
+    def setUp(self):
+        # remote1 shows active for 20 ms while it is disabled
+        states = history((0.0, "remote1_+1000 remote2_+030"), (1.0, "remote1*+1000 remote2_+030"),
+                         (2.0, "remote1#+1000 remote2_+030"), (2.02, "remote1#+1000 remote2*+030"),
+                         (3.0, "remote1_+1000 remote2_+030"))
+        # the old format doesn't show active on a disabled remote, the json format does: make it so
+        states.columns["active"][2, 0] = 1
+        self.timeline = Timeline(states, [(START + 1.01, True), (START + 3.5, False)],
+                                 audio((1.0, SILENCE), (1.05, 300), (2.0, MIXED), (2.05, 600), (3.0, SILENCE)),
+                                 {300: "remote1", 600: "remote2"})
+
+    def active(self, remote):
+        return self.timeline.state(remote, "active").equals(1)
+
+    def test_never(self):
+        disabled = self.timeline.state("remote1", "enabled").equals(0)
+        check = self.timeline.never(self.active("remote1") & disabled)
+        self.assertFalse(check)
+        self.assertEqual(len(check.violations), 1)
+        self.assertAlmostEqual(check.violations[0][0], 2.0)
+        self.assertAlmostEqual(check.violations[0][1] - check.violations[0][0], 0.02)
+        self.assertIn("1 violations, at 2.000s for 20.0ms", repr(check))
+        self.assertTrue(self.timeline.never(self.active("remote1") & disabled, longer_than=0.05))
+        self.assertTrue(self.timeline.never(self.active("remote1") & self.active("remote2")))
+
+    def test_always(self):
+        ptt = self.timeline.ptt.equals(1)
+        self.assertTrue(self.timeline.always(ptt, START + 1.01, START + 3.5))
+        self.assertFalse(self.timeline.always(ptt, START + 1.0, START + 3.5))
+        self.assertFalse(self.timeline.always(ptt))
+
+    def test_within(self):
+        self.assertTrue(self.timeline.within(self.active("remote1"), self.timeline.heard("remote1"), 0.1))
+        self.assertFalse(self.timeline.within(self.active("remote1"), self.timeline.heard("remote1"), 0.01))
+        self.assertTrue(self.timeline.within(self.active("remote2"), self.timeline.heard("remote2"), 0.1))
+        check = self.timeline.within(self.active("remote2"), self.timeline.heard("remote1"), 0.1)
+        self.assertEqual(len(check.violations), 1)
+
+    def test_at_most(self):
+        self.assertTrue(self.timeline.at_most(self.timeline.ptt, 2))
+        self.assertFalse(self.timeline.at_most(self.timeline.state("remote1", "active"), 1))
+        self.assertTrue(self.timeline.at_most(self.timeline.heard(MIXED), 2))
+
+    def test_events(self):
+        events = self.timeline.events()
+        self.assertTrue(np.all(np.diff(events["time"]) >= 0))
+        names = [signal.name for signal in self.timeline.signals]
+        self.assertEqual(names[:2], ["ptt", "audio"])
+        within = self.timeline.events(START + 1.0, START + 1.01)
+        self.assertEqual(sorted(names[index] for index in within["signal"]), ["audio", "ptt", "remote1.active",
+                                                                               "remote1.sql_open"])
+
+    def test_long_run(self):
+        """
+        dozens of properties over an hour of state changes, every 100 ms, should take well under a second
+        """
+        lines = ["remote1*+1000 remote2_+030", "remote1_+1000 remote2*+030", "remote1_+1000 remote2_+030"]
+        states = history(*((index / 10, lines[index % 3]) for index in range(36000)))
+        timeline = Timeline(states)
+        start = time.perf_counter()
+        for _ in range(10):
+            first, second = timeline.state("remote1", "active").equals(1), timeline.state("remote2", "active").equals(1)
+            self.assertTrue(timeline.never(first & second))
+            self.assertTrue(timeline.within(first, second, 0.15))
+            self.assertFalse(timeline.at_most(timeline.state("remote1", "active"), 100))
+        self.assertLess(time.perf_counter() - start, 1.0)
+
+
+class TestEnvironmentTimeline(unittest.TestCase):
+    def test_switchover(self):
+        """
+        the timeline of the simulator: no two remotes active at once, the voter's choice heard soon after
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            stack = Stack("timeline-test")
+            stack.directory = directory
+            env = SimEnvironment(stack)
+            self.assertTrue(env.start())
+            try:
+                env.open_squelch("remote2", True)
+                self.assertTrue(env.wait_for_remote_by_tone("remote2", 2))
+                env.open_squelch("remote1", True)
+                self.assertTrue(env.wait_for_remote_by_tone("remote1", 2))
+                time.sleep(0.1)
+                timeline = env.timeline()
+            finally:
+                env.stop()
+        first, second = (timeline.state(name, "active").equals(1) for name in ("remote1", "remote2"))
+        self.assertTrue(timeline.never(first & second))
+        self.assertTrue(timeline.within(second, timeline.heard("remote2"), 0.5))
+        self.assertTrue(timeline.within(first, timeline.heard("remote1"), 0.5))
+        self.assertTrue(timeline.at_most(timeline.ptt, 1))
+        self.assertTrue(timeline.always(timeline.ptt.equals(1), start=float(timeline.ptt.transitions()[0])))
+        self.assertTrue(timeline.never(timeline.heard("unknown")))
+        # the audio switched once, from remote2 to remote1, right when remote1 became active
+        switches = timeline.tone_events("switch")
+        self.assertEqual([switch["remotes"] for switch in switches], [["remote2", "remote1"]])
+        selected = first.rises(timeline.start, timeline.end)[0]
+        self.assertLess(abs(switches[0]["end"] - selected), 0.5)
+        self.assertLess(abs(switches[0]["duration_ms"]), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
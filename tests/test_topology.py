@@ -0,0 +1,79 @@
+"""
+This file tests the declaration of the remotes, and what is generated from it.
+These tests don't need docker.
+"""
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from stack import ROOT, Stack
+from topology import Topology
+
+
+def read(path):
+    with open(path) as data:
+        return data.read()
+
+
+class TestTopology(unittest.TestCase):
+    def test_default(self):
+        """
+        the default declaration should describe the hand-written configs
+        """
+        topology = Topology.load()
+        self.assertTrue(topology.is_default)
+        self.assertEqual(topology.tones, {300: "remote1", 600: "remote2"})
+        self.assertEqual(topology.ports, {"remote1": 5211, "remote2": 5212})
+        for remote in topology.remotes:
+            self.assertEqual(topology.remote_config(remote),
+                             read(os.path.join(ROOT, "configs", remote.name + ".conf")))
+        self.assertEqual(topology.svxlink_config(topology.ports).strip(),
+                         read(os.path.join(ROOT, "configs", "svxlink.conf")).strip())
+
+    def test_generate(self):
+        self.assertEqual(Topology.generate(2).remotes, Topology.load().remotes)
+        topology = Topology.generate(64)
+        self.assertEqual(len(set(topology.tones)), 64)
+        self.assertEqual(topology.remotes[0].siglev, 1000)
+        self.assertEqual(topology.remotes[-1].siglev, 30)
+        topology.check_tones(16000, 1024)
+        with self.assertRaises(ValueError):
+            topology.check_tones(16000, 256)
+        with self.assertRaises(ValueError):
+            Topology.generate(100)
+
+    def test_from_env(self):
+        with mock.patch.dict(os.environ, {"REMOTES": "16"}):
+            self.assertEqual(len(Topology.from_env().remotes), 16)
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as declaration:
+            json.dump([{"name": "north", "siglev": 50, "tone": 440}], declaration)
+            declaration.flush()
+            with mock.patch.dict(os.environ, {"REMOTES": declaration.name}):
+                self.assertEqual(Topology.from_env().names, ["north"])
+
+    def test_render(self):
+        """
+        every remote should get a compose service, a config and a receiver section, on its own port
+        """
+        with mock.patch.dict(os.environ, {"REMOTES": "16"}, clear=True):
+            stack = Stack.from_env()
+        self.assertTrue(stack.sharded)
+        with tempfile.TemporaryDirectory() as directory:
+            stack.directory = directory
+            stack.render("hobbyscoop")
+            svxlink = read(stack.config_path("svxlink.conf"))
+            self.assertIn("RECEIVERS=" + ",".join("remote{}".format(index) for index in range(1, 17)) + "\n", svxlink)
+            self.assertIn("[remote16]\nTYPE=Net\nHOST=172.17.0.1\nTCP_PORT={}\n".format(stack.remote_port("remote16")), svxlink)
+            self.assertIn("SIM_TONE_FQ={}\n".format(stack.topology.remotes[15].tone), read(stack.config_path("remote16.conf")))
+            with open(stack.compose_file) as compose_file:
+                compose = json.load(compose_file)
+            self.assertEqual(len(compose), 17)
+            self.assertEqual(compose["remote16"]["ports"], ["{}:5210".format(stack.remote_port("remote16"))])
+            self.assertEqual(compose["remote16"]["volumes"],
+                             ["{}:/etc/svxlink/remotetrx.conf".format(stack.config_path("remote16.conf"))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+This file tests the tracing of docker calls, capture reads and wait loops.
+These tests don't need docker.
+"""
+import json
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from capture import TailReader
+from latency import current_test
+from tracing import Tracer, format_summary, summarize
+import tracing
+from watcher import FileWatcher
+
+
+class TestTracer(unittest.TestCase):
+    def test_spans(self):
+        tracer = Tracer()
+        with tracer.span("read state", "read") as span:
+            span.args["bytes"] = 10
+        with self.assertRaises(ValueError):
+            with tracer.span("containers.list", "docker"):
+                raise ValueError()
+        self.assertEqual([span.name for span in tracer.spans], ["read state", "containers.list"])
+        self.assertEqual(tracer.spans[1].args, {"error": "ValueError"})
+        self.assertGreaterEqual(tracer.spans[0].duration, 0)
+        # outside of a test run by pytest the spans belong to no test, inside they belong to this one
+        nodeid = tracer.spans[0].test
+        self.assertEqual(len(tracer.for_test(nodeid)), 2)
+        self.assertEqual(len(tracer.take(nodeid)), 2)
+        self.assertEqual(tracer.spans, [])
+
+    def test_disabled(self):
+        tracer = Tracer(enabled=False)
+        with tracer.span("read state", "read") as span:
+            span.args["bytes"] = 10
+        self.assertEqual(tracer.spans, [])
+
+    def test_only_in_test_runs(self):
+        """
+        nothing takes the spans outside of pytest, so the shared tracer is only on once conftest.py enabled it
+        """
+        self.assertTrue(tracing.tracer().enabled)
+        with mock.patch.dict(os.environ, {"TRACE": "0"}), mock.patch.object(tracing.tracer(), "enabled"):
+            tracing.enable()
+            self.assertFalse(tracing.tracer().enabled)
+
+    def test_chrome_trace(self):
+        """
+        the trace should have a complete event per span, on the thread it ran on, and the thread names
+        """
+        tracer = Tracer()
+        with tracer.span("compose up", "subprocess", services="svxlink"):
+            pass
+        thread = threading.Thread(target=lambda: tracer.span("read ptt", "read").__enter__().__exit__(None, None, None),
+                                  name="watcher")
+        thread.start()
+        thread.join()
+        with tempfile.TemporaryDirectory() as directory:
+            path = tracer.save(tracer.spans, "tests/test_tracing.py::Test::test (call)", directory)
+            self.assertEqual(os.path.basename(path), "tests_test_tracing.py_Test_test_call.json")
+            with open(path) as trace:
+                events = json.load(trace)["traceEvents"]
+        complete = [event for event in events if event["ph"] == "X"]
+        self.assertEqual([event["name"] for event in complete], ["compose up", "read ptt"])
+        self.assertEqual(complete[0]["args"]["services"], "svxlink")
+        self.assertNotEqual(complete[0]["tid"], complete[1]["tid"])
+        names = {event["tid"]: event["args"]["name"] for event in events if event["ph"] == "M"}
+        self.assertEqual(names[complete[1]["tid"]], "watcher")
+        self.assertIsNone(tracer.save([], "empty", directory))
+
+    def test_summary(self):
+        tracer = Tracer()
+        for size in (10, 20):
+            with tracer.span("read state", "read") as span:
+                span.args["bytes"] = size
+        summary = summarize(tracer.spans)
+        self.assertEqual(summary[("read", "read state")]["count"], 2)
+        self.assertEqual(summary[("read", "read state")]["bytes"], 30)
+        self.assertEqual(len(format_summary(summary)), 2)
+
+    def test_instrumented(self):
+        """
+        capture reads should record the bytes they read, waits the number of times they evaluated their predicate
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ptt")
+            with open(path, "w") as ptt:
+                ptt.write("TR")
+            TailReader(path, lines=False).poll()
+            watcher = FileWatcher(directory, ["ptt"])
+            self.assertFalse(watcher.wait_for(lambda: False, 0.12, "wait_for_ptt"))
+        spans = tracing.tracer().for_test(current_test()[0])
+        read = [span for span in spans if span.name == "read ptt"][-1]
+        self.assertEqual(read.args["bytes"], 2)
+        wait = [span for span in spans if span.name == "wait_for_ptt"][-1]
+        self.assertEqual(wait.args["met"], False)
+        # not watching, so the predicate is evaluated every poll interval
+        self.assertGreaterEqual(wait.args["iterations"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+"""
+This file tests the file watcher the environment uses to wait for the capture files.
+These tests don't need docker.
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from watcher import FileWatcher
+
+
+class TestWatcher(unittest.TestCase):
+    use_inotify = True
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "ptt")
+        open(self.path, "w").close()
+        self.watcher = FileWatcher(self.directory.name, ["ptt"], use_inotify=self.use_inotify)
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.path, "r") as ptt:
+            return ptt.read()
+
+    def write_later(self, data, delay):
+        def write():
+            time.sleep(delay)
+            with open(self.path, "a") as ptt:
+                ptt.write(data)
+        thread = threading.Thread(target=write)
+        thread.start()
+        return thread
+
+    def test_wakes_up_on_write(self):
+        """
+        a waiter should return as soon as the file is written, not at the end of the timeout
+        """
+        thread = self.write_later("T", 0.1)
+        start = time.monotonic()
+        self.assertTrue(self.watcher.wait_for(lambda: self.read().endswith("T"), 5))
+        self.assertLess(time.monotonic() - start, 1)
+        thread.join()
+
+    def test_sub_second_timeout(self):
+        start = time.monotonic()
+        self.assertFalse(self.watcher.wait_for(lambda: self.read().endswith("T"), 0.2))
+        self.assertAlmostEqual(time.monotonic() - start, 0.2, delta=0.15)
+
+    def test_predicate_only_on_change(self):
+        """
+        the predicate should be evaluated on changes, not in a busy loop
+        """
+        calls = []
+        thread = self.write_later("R", 0.3)
+        self.watcher.wait_for(lambda: calls.append(1) and False, 0.6)
+        thread.join()
+        self.assertLess(len(calls), 10)
+
+    def test_listener(self):
+        """
+        listeners are called for every change, before the waiters wake up
+        """
+        seen = []
+        self.watcher.add_listener(lambda name: seen.append((name, self.read())))
+        thread = self.write_later("T", 0.05)
+        self.assertTrue(self.watcher.wait_for(lambda: bool(seen), 2))
+        thread.join()
+        self.assertEqual(seen[0], ("ptt", "T"))
+
+
+class TestWatcherPolling(TestWatcher):
+    use_inotify = False
+
+
+class TestWatcherStopped(unittest.TestCase):
+    def test_wait_without_thread(self):
+        """
+        waiting on a watcher that isn't started should still see changes
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            watcher = FileWatcher(directory, ["state"])
+            state = []
+            threading.Timer(0.1, state.append, args=(1,)).start()
+            self.assertTrue(watcher.wait_for(lambda: state, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,310 @@
+"""
+This module merges what a run recorded into one timeline, to check properties over all of it instead of only the
+latest state: the voter state per remote from the state capture, the PTT edges and the decoded audio.
+
+Every source becomes a Signal: a step function with the times its value changed. Comparing a signal to a value gives
+a Condition, and conditions combine with &, | and ~. The checks run on these arrays with searchsorted, so a test can
+check many properties against a long run without reading the captures again:
+- never: a condition is never true, not even for a moment
+- always: a condition holds all the time, optionally between two moments
+- within: every time a condition becomes true, another one is true within a delay
+- at_most: a signal or condition changes at most a number of times
+
+All times are wall clock times: svxlink's timestamps for the state, the time the detector published a window for the
+audio, and the time the harness read an edge for the PTT, as its capture has no timestamps.
+Next to the signals, the tone changes the detector tracked (see ToneTracker) are kept as they are, to tell how long
+the audio took to switch from one remote to another to the millisecond.
+"""
+import numpy as np
+
+from goertzel import SIGNATURE_VALUES
+from stateparser import StateHistory
+
+
+class Signal:
+    """
+    A step function: the value at times[i] holds until times[i + 1]. Only the changes are kept.
+    """
+    __slots__ = ("name", "times", "values")
+
+    def __init__(self, name, times, values):
+        times = np.asarray(times, dtype=np.float64)
+        values = np.asarray(values)
+        keep = np.ones(len(values), dtype=bool)
+        keep[1:] = values[1:] != values[:-1]
+        self.name = name
+        self.times = times[keep]
+        self.values = values[keep]
+
+    def __len__(self):
+        return len(self.times)
+
+    def at(self, time):
+        """
+        :return: the value at a moment, or None before the first one
+        """
+        index = int(np.searchsorted(self.times, time, side="right")) - 1
+        return self.values[index] if index >= 0 else None
+
+    def transitions(self, start=None, end=None):
+        """
+        :return: the times the value changed, not counting the first value
+        """
+        return _between(self.times[1:], start, end)
+
+    def equals(self, value):
+        return Condition(self.times, self.values == value, "{} == {}".format(self.name, value))
+
+    def isin(self, values):
+        return Condition(self.times, np.isin(self.values, list(values)), "{} in {}".format(self.name, list(values)))
+
+    def where(self, predicate, name=None):
+        """
+        :param predicate: takes the array of values, returns an array of booleans
+        """
+        return Condition(self.times, predicate(self.values), name or "{} where {}".format(self.name, predicate))
+
+    def __repr__(self):
+        return "Signal({!r}, {} changes)".format(self.name, len(self))
+
+
+class Condition(Signal):
+    """
+    A signal of booleans, false before its first time unless `initial` says otherwise
+    """
+    __slots__ = ("initial",)
+
+    def __init__(self, times, values, name, initial=False):
+        super().__init__(name, times, np.asarray(values, dtype=bool))
+        self.initial = initial
+
+    def sample(self, times):
+        """
+        :return: the value at each of the times
+        """
+        index = np.searchsorted(self.times, times, side="right") - 1
+        return np.where(index >= 0, self.values[np.maximum(index, 0)] if len(self) else False, self.initial)
+
+    def _combine(self, other, operator, symbol):
+        times = np.union1d(self.times, other.times)
+        return Condition(times, operator(self.sample(times), other.sample(times)),
+                         "({} {} {})".format(self.name, symbol, other.name),
+                         bool(operator(self.initial, other.initial)))
+
+    def __and__(self, other):
+        return self._combine(other, np.logical_and, "&")
+
+    def __or__(self, other):
+        return self._combine(other, np.logical_or, "|")
+
+    def __invert__(self):
+        return Condition(self.times, ~self.values, "~{}".format(self.name), not self.initial)
+
+    def intervals(self, start, end):
+        """
+        :return: the (start, end) of every stretch the condition is true, clipped to `start` and `end`
+        """
+        times = np.concatenate(([start], self.times[(self.times > start) & (self.times < end)]))
+        values = self.sample(times)
+        edges = np.diff(np.concatenate(([0], values.astype(np.int8), [0])))
+        rises = np.flatnonzero(edges == 1)
+        falls = np.flatnonzero(edges == -1)
+        bounds = np.concatenate((times, [end]))
+        return np.stack((bounds[rises], bounds[falls]), axis=1) if len(rises) else np.zeros((0, 2))
+
+    def rises(self, start, end):
+        """
+        :return: the times the condition became true, also at `start` when it was true then
+        """
+        return self.intervals(start, end)[:, 0]
+
+
+class Check:
+    """
+    The outcome of a property: true when it holds, otherwise the violations as (start, end) in seconds since the
+    start of the timeline, so it can be used as the message of an assertion.
+    """
+
+    def __init__(self, description, violations, origin):
+        self.description = description
+        self.violations = [(float(start) - origin, float(end) - origin) for start, end in violations]
+
+    def __bool__(self):
+        return not self.violations
+
+    def __repr__(self):
+        if not self.violations:
+            return "{}: holds".format(self.description)
+        shown = ", ".join("{:.3f}s for {:.1f}ms".format(start, (end - start) * 1000)
+                          for start, end in self.violations[:5])
+        more = ", ..." if len(self.violations) > 5 else ""
+        return "{}: {} violations, at {}{}".format(self.description, len(self.violations), shown, more)
+
+
+class Timeline:
+    """
+    The state, PTT and audio of a run, merged in time.
+
+    Example of usage :
+
+        timeline = env.timeline()
+        active = timeline.state("remote1", "active").equals(1)
+        disabled = timeline.state("remote1", "enabled").equals(0)
+        self.assertTrue(timeline.never(active & disabled), "remote1 active while disabled")
+        self.assertTrue(timeline.at_most(timeline.ptt, 2))
+        self.assertTrue(timeline.within(active, timeline.heard("remote1"), 0.5))
+    """
+
+    def __init__(self, history, ptt_edges=(), audio=None, tones=None, start=None, end=None, tracked=()):
+        """
+        :param history: a StateHistory
+        :param ptt_edges: (time, state) per PTT edge, the PTT is off before the first one
+        :param audio: audio ring records, with their time and tone
+        :param tones: the remote name per tone
+        :param start: when the run started, defaults to the first thing recorded
+        :param end: when the run ended, defaults to the last thing recorded
+        :param tracked: the tone events, see Environment.tone_events
+        """
+        self.history = history
+        self.tracked = sorted(tracked, key=lambda event: event["start"])
+        self.tones = dict(tones or {})
+        edges = np.array([(time, bool(state)) for time, state in ptt_edges], dtype=np.float64).reshape(-1, 2)
+        audio = audio if audio is not None else np.zeros(0, dtype=[("time", "<f8"), ("tone", "<f4")])
+        times = [history.times, edges[:, 0], audio["time"], [event["start"] for event in self.tracked]]
+        known = np.concatenate([np.asarray(t, dtype=np.float64) for t in times])
+        self.start = start if start is not None else (float(known.min()) if len(known) else 0.0)
+        self.end = end if end is not None else (float(known.max()) if len(known) else self.start)
+        self.ptt = Signal("ptt", np.concatenate(([self.start], edges[:, 0])), np.concatenate(([0], edges[:, 1])).astype(np.int8))
+        self.audio = Signal("audio", audio["time"], np.asarray(audio["tone"], dtype=np.float64))
+        self._signals = {}
+
+    @classmethod
+    def from_environment(cls, env, start=None, end=None):
+        """
+        the timeline of everything an environment recorded since its captures were last truncated
+        """
+        history = StateHistory.from_file(env.state_reader.path)
+        audio = np.concatenate(env.audio_records) if env.audio_records else None
+        return cls(history, list(env.ptt_edges), audio, env.remote_tones, start, end, env.tone_events())
+
+    def state(self, remote, field):
+        """
+        :param remote: remote name
+        :param field: enabled, sql_open, active or siglev
+        """
+        key = (remote, field)
+        if key not in self._signals:
+            self._signals[key] = Signal("{}.{}".format(remote, field), self.history.times,
+                                        self.history.column(remote, field))
+        return self._signals[key]
+
+    def heard(self, name):
+        """
+        :param name: a remote, or silence, mixed or unknown
+        :return: the condition that the audio was decoded as that
+        """
+        if name in SIGNATURE_VALUES:
+            value = SIGNATURE_VALUES[name]
+        else:
+            value = next((tone for tone, remote in self.tones.items() if remote == name), None)
+            if value is None:
+                raise ValueError("no tone for {}".format(name))
+        return Condition(self.audio.times, self.audio.values == value, "heard {}".format(name))
+
+    @property
+    def signals(self):
+        """
+        :return: every signal of the timeline: ptt, audio and each field of each remote
+        """
+        fields = self.history.columns.keys()
+        return [self.ptt, self.audio] + [self.state(name, field) for name in self.history.names for field in fields]
+
+    def events(self, start=None, end=None):
+        """
+        all changes of all signals in time order
+        :return: a structured array of time, signal (the index in `signals`) and value
+        """
+        signals = self.signals
+        events = np.zeros(sum(len(signal) for signal in signals),
+                          dtype=[("time", "<f8"), ("signal", "<i4"), ("value", "<f8")])
+        offset = 0
+        for index, signal in enumerate(signals):
+            events["time"][offset:offset + len(signal)] = signal.times
+            events["signal"][offset:offset + len(signal)] = index
+            events["value"][offset:offset + len(signal)] = signal.values
+            offset += len(signal)
+        events = events[np.argsort(events["time"], kind="stable")]
+        first = np.searchsorted(events["time"], self._start(start), side="left")
+        last = np.searchsorted(events["time"], self._end(end), side="right")
+        return events[first:last]
+
+    def tone_events(self, kind=None, start=None, end=None):
+        """
+        :param kind: start, stop, switch, gap or overlap, or None for all
+        :return: the tracked tone events that started between `start` and `end`
+        """
+        start, end = self._start(start), self._end(end)
+        return [event for event in self.tracked
+                if (kind is None or event["kind"] == kind) and start <= event["start"] <= end]
+
+    def never(self, condition, start=None, end=None, longer_than=0.0):
+        """
+        :param condition: a Condition
+        :param start: only from this time on
+        :param end: only up to this time
+        :param longer_than: ignore stretches of up to this many seconds
+        :return: a Check, with the stretches the condition was true
+        """
+        intervals = condition.intervals(self._start(start), self._end(end))
+        violations = intervals[intervals[:, 1] - intervals[:, 0] > longer_than]
+        return Check("never {}".format(condition.name), violations, self.start)
+
+    def always(self, condition, start=None, end=None, longer_than=0.0):
+        """
+        :return: a Check, with the stretches the condition wasn't true
+        """
+        check = self.never(~condition, start, end, longer_than)
+        check.description = "always {}".format(condition.name)
+        return check
+
+    def within(self, trigger, response, delay, start=None, end=None):
+        """
+        every time `trigger` becomes true, `response` should be true within `delay` seconds.
+        A trigger less than `delay` before the end is only a violation when the response never came.
+        :return: a Check, with the time from every trigger to the end of its `delay` when the response didn't come
+        """
+        start, end = self._start(start), self._end(end)
+        triggers = trigger.rises(start, end)
+        responses = response.intervals(start, np.inf)
+        # the first stretch of the response that hasn't ended at the trigger
+        index = np.searchsorted(responses[:, 1], triggers, side="right")
+        found = index < len(responses)
+        first = np.where(found, responses[np.minimum(index, len(responses) - 1), 0] if len(responses) else np.inf,
+                         np.inf)
+        late = np.where(found, first > triggers + delay, triggers + delay <= end)
+        violations = np.stack((triggers[late], triggers[late] + delay), axis=1) if late.any() else []
+        return Check("{} within {:.0f}ms after {}".format(response.name, delay * 1000, trigger.name), violations,
+                     self.start)
+
+    def at_most(self, signal, count, start=None, end=None):
+        """
+        :param signal: a Signal or Condition
+        :param count: the number of changes allowed
+        :return: a Check, with every change after the first `count`
+        """
+        transitions = signal.transitions(self._start(start), self._end(end))
+        extra = transitions[count:]
+        return Check("{} changes at most {} times".format(signal.name, count), np.stack((extra, extra), axis=1),
+                     self.start)
+
+    def _start(self, start):
+        return self.start if start is None else start
+
+    def _end(self, end):
+        return self.end if end is None else end
+
+
+def _between(times, start=None, end=None):
+    first = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+    last = len(times) if end is None else int(np.searchsorted(times, end, side="right"))
+    return times[first:last]
@@ -0,0 +1,176 @@
+"""
+This module declares the remotes: their name, siglev and tone. Everything else about them is derived from here:
+the compose services, the remotetrx configs, the RECEIVERS of the voter, the ports and the tones the detector listens for.
+
+The default declaration is configs/remotes.json, which matches the hand-written configs.
+To run with more remotes, set REMOTES to a number, like REMOTES=16, or to the path of another declaration.
+"""
+import json
+import os
+import re
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DECLARATION = os.path.join(ROOT, "configs", "remotes.json")
+# the first remote listens on this host port, the next ones on the ports after it
+BASE_PORT = 5211
+# ports are given out in blocks of PORT_BLOCK per stack, svxlink uses SVXLINK_PORTS of each block
+PORT_BLOCK = 100
+SVXLINK_PORTS = (5198, 5199, 5200)
+# the ports of the remotes of a stack end before the svxlink ports of the next one
+MAX_REMOTES = min(SVXLINK_PORTS) + PORT_BLOCK - BASE_PORT
+# generated tones and siglevs are spread over these ranges
+TONE_RANGE = (300, 5000)
+SIGLEV_RANGE = (1000, 30)
+
+
+class Remote:
+    """
+    a remote receiver
+    """
+    __slots__ = ("name", "siglev", "tone")
+
+    def __init__(self, name, siglev, tone):
+        self.name = name
+        self.siglev = siglev
+        self.tone = tone
+
+    def as_dict(self):
+        return {"name": self.name, "siglev": self.siglev, "tone": self.tone}
+
+    def __eq__(self, other):
+        return isinstance(other, Remote) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return "Remote({name!r}, {siglev}, {tone})".format(**self.as_dict())
+
+
+class Topology:
+    """
+    The remotes of a stack, in the order the voter lists them.
+
+    Example of usage :
+
+        topology = Topology.generate(16)
+        topology.remote_config(topology.remotes[0])
+        topology.tones   # {300: "remote1", 374: "remote2", ...}
+    """
+
+    def __init__(self, remotes):
+        self.remotes = list(remotes)
+        if not self.remotes:
+            raise ValueError("at least one remote is needed")
+        if len(self.remotes) > MAX_REMOTES:
+            raise ValueError("at most {} remotes are supported".format(MAX_REMOTES))
+        if len({remote.name for remote in self.remotes}) != len(self.remotes):
+            raise ValueError("remote names should be unique")
+        if len(self.tones) != len(self.remotes):
+            raise ValueError("remote tones should be unique")
+
+    @classmethod
+    def load(cls, path=DECLARATION):
+        with open(path, "r") as declaration:
+            return cls(Remote(item["name"], int(item["siglev"]), int(item["tone"])) for item in json.load(declaration))
+
+    @classmethod
+    def generate(cls, count):
+        """
+        `count` remotes, with tones and siglevs spread evenly, the first remote being the loudest.
+        Two remotes are the same as the default declaration.
+        :param count:
+        :return:
+        """
+        if count < 1:
+            raise ValueError("at least one remote is needed")
+        steps = max(count - 1, 1)
+        tone_step = min(300, (TONE_RANGE[1] - TONE_RANGE[0]) // steps)
+        return cls(
+            Remote("remote{}".format(index + 1),
+                   round(SIGLEV_RANGE[0] + (SIGLEV_RANGE[1] - SIGLEV_RANGE[0]) * index / steps),
+                   TONE_RANGE[0] + tone_step * index)
+            for index in range(count)
+        )
+
+    @classmethod
+    def from_env(cls):
+        """
+        the remotes for this process, from REMOTES: a number of remotes to generate, or the path to a declaration
+        :return:
+        """
+        remotes = os.environ.get("REMOTES", "")
+        if not remotes:
+            return cls.load()
+        if remotes.isdigit():
+            return cls.generate(int(remotes))
+        return cls.load(remotes)
+
+    @property
+    def is_default(self):
+        """
+        whether these are the remotes the hand-written configs and compose files describe
+        :return:
+        """
+        return self.remotes == Topology.load().remotes
+
+    @property
+    def names(self):
+        return [remote.name for remote in self.remotes]
+
+    @property
+    def tones(self):
+        """
+        :return: the name of the remote per tone
+        """
+        return {remote.tone: remote.name for remote in self.remotes}
+
+    @property
+    def ports(self):
+        """
+        :return: the host port per remote name, before any stack offset
+        """
+        return {remote.name: BASE_PORT + index for index, remote in enumerate(self.remotes)}
+
+    def check_tones(self, sample_rate, window_size):
+        """
+        make sure the detector can tell all tones apart: the main lobe of the hamming window is 4 bins wide
+        :param sample_rate:
+        :param window_size:
+        :return:
+        """
+        tones = sorted(self.tones)
+        spacing = 4 * sample_rate / float(window_size)
+        for low, high in zip(tones, tones[1:]):
+            if high - low < spacing:
+                raise ValueError("tones {} and {} are closer than {:.1f} Hz".format(low, high, spacing))
+        if tones[-1] >= sample_rate / 2:
+            raise ValueError("tone {} is above the nyquist frequency".format(tones[-1]))
+
+    def remote_config(self, remote):
+        """
+        the remotetrx config for a remote, based on configs/remote1.conf
+        :param remote:
+        :return:
+        """
+        with open(os.path.join(ROOT, "configs", "remote1.conf"), "r") as config:
+            data = config.read()
+        data = re.sub(r"^SIM_TONE_FQ=\d+", "SIM_TONE_FQ={}".format(remote.tone), data, flags=re.MULTILINE)
+        return re.sub(r"^SIGLEV_DEFAULT=\d+", "SIGLEV_DEFAULT={}".format(remote.siglev), data, flags=re.MULTILINE)
+
+    def svxlink_config(self, ports):
+        """
+        the svxlink config, with a receiver section for every remote, based on configs/svxlink.conf
+        :param ports: the host port per remote name
+        :return:
+        """
+        with open(os.path.join(ROOT, "configs", "svxlink.conf"), "r") as config:
+            data = config.read()
+        # drop the hand-written receiver sections, and take the first one as the template for the others
+        sections = re.split(r"^(?=\[)", data, flags=re.MULTILINE)
+        receivers = [section for section in sections if re.match(r"^\[remote\d+\]", section)]
+        data = "".join(section for section in sections if section not in receivers).rstrip("\n") + "\n"
+        data = re.sub(r"^RECEIVERS=.*$", "RECEIVERS=" + ",".join(self.names), data, flags=re.MULTILINE)
+        template = receivers[0].rstrip("\n") + "\n"
+        for remote in self.remotes:
+            section = re.sub(r"^\[\w+\]", "[{}]".format(remote.name), template)
+            section = re.sub(r"^TCP_PORT=\d+", "TCP_PORT={}".format(ports[remote.name]), section, flags=re.MULTILINE)
+            data += "\n" + section
+        return data
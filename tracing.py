@@ -0,0 +1,198 @@
+"""
+This module traces where the wall time of a test goes: docker calls, compose subprocesses, reads of the captures
+and wait loops each record a span, with their duration and what they did (bytes read, loop iterations).
+
+The spans of each test are exported as a Chrome trace under runs/traces/<branch>/, to be opened in Perfetto
+(https://ui.perfetto.dev) or chrome://tracing, and summarized per span name in the pytest-html report.
+Tracing is on in test runs, where tests/conftest.py takes the spans of every test, TRACE=0 turns it off.
+Outside of pytest, like in soak.py, nothing takes the spans, so it stays off.
+"""
+from collections import OrderedDict
+import json
+import os
+import re
+from threading import Lock, current_thread, get_native_id
+from time import monotonic, time
+
+from latency import current_test
+from stack import ROOT
+
+OUTPUT_DIR = os.path.join(ROOT, "runs", "traces")
+# the arguments that are added up in the summary
+TOTALS = ("bytes", "iterations")
+
+
+class Span:
+    """
+    one timed piece of work, use it as a context manager
+    """
+    __slots__ = ("tracer", "name", "category", "start", "duration", "thread", "thread_name", "test", "phase", "args")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+        self.duration = None
+        self.test, self.phase = current_test()
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = monotonic() - self.start
+        thread = current_thread()
+        self.thread = get_native_id()
+        self.thread_name = thread.name
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add(self)
+        return False
+
+
+class NullSpan:
+    """
+    what a disabled tracer hands out, arguments set on it go nowhere
+    """
+    __slots__ = ("args",)
+
+    def __init__(self):
+        self.args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+class Tracer:
+    """
+    Collects the spans of this process, for all threads and environments, like the latency log does.
+
+    Example of usage :
+
+        with tracer().span("containers.list", "docker"):
+            client.containers.list()
+        with tracer().span("read state", "read") as span:
+            span.args["bytes"] = len(data)
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = Lock()
+        self.spans = []
+        # monotonic and wall clock at the same moment, so traces line up with the svxlink timestamps
+        self.origin = (monotonic(), time())
+
+    def span(self, name, category, **args):
+        if not self.enabled:
+            return NullSpan()
+        return Span(self, name, category, args)
+
+    def add(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def take(self, nodeid):
+        """
+        remove and return the spans of a test, of all its phases
+        :param nodeid: the test, or None for the spans outside of tests
+        :return:
+        """
+        with self.lock:
+            taken = [span for span in self.spans if span.test == nodeid]
+            self.spans = [span for span in self.spans if span.test != nodeid]
+        return taken
+
+    def for_test(self, nodeid, phase=None):
+        with self.lock:
+            return [span for span in self.spans if span.test == nodeid and (phase is None or span.phase == phase)]
+
+    def chrome_trace(self, spans):
+        """
+        :return: the spans in the Chrome trace event format, with timestamps in microseconds since the epoch
+        """
+        pid = os.getpid()
+        offset = self.origin[1] - self.origin[0]
+        events = []
+        threads = {}
+        for span in spans:
+            threads[span.thread] = span.thread_name
+            args = dict(span.args)
+            if span.phase:
+                args["phase"] = span.phase
+            events.append({
+                "name": span.name, "cat": span.category, "ph": "X", "pid": pid, "tid": span.thread,
+                "ts": (span.start + offset) * 1e6, "dur": span.duration * 1e6, "args": args,
+            })
+        for thread, name in threads.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread, "args": {"name": name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, spans, name, directory):
+        """
+        :return: the path of the trace, or None when there were no spans
+        """
+        if not spans:
+            return None
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, re.sub(r"[^\w.-]+", "_", name).strip("_") + ".json")
+        with open(path, "w") as output:
+            json.dump(self.chrome_trace(spans), output)
+        return path
+
+
+def summarize(spans):
+    """
+    :param spans: a list of Span
+    :return: count, total seconds, and the totals of bytes and iterations per category and name, slowest first
+    """
+    summary = {}
+    for span in spans:
+        stats = summary.setdefault((span.category, span.name), {"count": 0, "seconds": 0.0})
+        stats["count"] += 1
+        stats["seconds"] += span.duration
+        for key in TOTALS:
+            if key in span.args:
+                stats[key] = stats.get(key, 0) + span.args[key]
+    return OrderedDict(sorted(summary.items(), key=lambda item: -item[1]["seconds"]))
+
+
+def format_summary(summary):
+    """
+    :return: the summary as lines of text, in milliseconds
+    """
+    lines = ["{:10} {:40} {:>6} {:>10} {:>10} {:>10}".format("category", "name", "count", "total ms", "bytes",
+                                                             "iterations")]
+    for (category, name), stats in summary.items():
+        lines.append("{:10} {:40} {:>6} {:>10.1f} {:>10} {:>10}".format(
+            category, name, stats["count"], stats["seconds"] * 1000, stats.get("bytes", ""),
+            stats.get("iterations", "")))
+    return lines
+
+
+def html_summary(summary):
+    rows = "".join(
+        "<tr><td>{}</td><td>{}</td><td>{}</td><td>{:.1f}</td><td>{}</td><td>{}</td></tr>".format(
+            category, name, stats["count"], stats["seconds"] * 1000, stats.get("bytes", ""),
+            stats.get("iterations", ""))
+        for (category, name), stats in summary.items())
+    return ("<table border=\"1\"><tr><th>category</th><th>name</th><th>count</th><th>total ms</th><th>bytes</th>"
+            "<th>iterations</th></tr>{}</table>").format(rows)
+
+
+_tracer = Tracer(enabled=False)
+
+
+def tracer():
+    return _tracer
+
+
+def enable():
+    """
+    turn tracing on, unless TRACE=0, for a process that takes the spans
+    """
+    _tracer.enabled = os.environ.get("TRACE", "1") != "0"
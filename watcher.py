@@ -0,0 +1,203 @@
+"""
+This module watches the capture files that svxlink and the sidecars write to (state, ptt, audio),
+and wakes up anyone waiting for them to change.
+It uses inotify on Linux, and falls back to polling the files when inotify isn't available.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+from threading import Condition, Thread
+from time import monotonic, sleep
+
+from tracing import tracer
+
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event: int wd, uint32 mask, uint32 cookie, uint32 len, char name[len]
+EVENT = struct.Struct("iIII")
+
+
+def load_inotify():
+    """
+    load the inotify functions from libc
+    :return: libc, or None when inotify isn't available
+    """
+    name = ctypes.util.find_library("c")
+    if not name:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """
+    Watches a set of files in a directory, and notifies waiters through a condition variable when one changes.
+
+    Example of usage :
+
+        watcher = FileWatcher(".", ["state", "ptt", "audio"])
+        watcher.start()
+        watcher.wait_for(lambda: read_ptt() == "T", 2.5)
+    """
+
+    def __init__(self, directory, names, poll_interval=0.05, use_inotify=True):
+        self.log = logging.getLogger(__class__.__name__)
+        self.directory = directory
+        self.names = list(names)
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify
+        self.condition = Condition()
+        self.versions = {name: 0 for name in self.names}
+        self.listeners = []
+        self._thread = None
+        self._running = False
+        self._wakeup = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """
+        start watching, using inotify if possible
+        :return:
+        """
+        if self._running:
+            return
+        libc = load_inotify() if self.use_inotify else None
+        fd = -1
+        if libc:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(self.directory), WATCH_MASK) < 0:
+                os.close(fd)
+                fd = -1
+        self._running = True
+        if fd >= 0:
+            self._wakeup = os.pipe()
+            self._thread = Thread(target=self._inotify_loop, args=(fd,), name="watcher", daemon=True)
+        else:
+            self.log.info("inotify not available, polling %s every %.3fs", self.directory, self.poll_interval)
+            self._thread = Thread(target=self._poll_loop, name="watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        if self._wakeup:
+            os.write(self._wakeup[1], b"x")
+        self._thread.join()
+        if self._wakeup:
+            for fd in self._wakeup:
+                os.close(fd)
+            self._wakeup = None
+        self._thread = None
+
+    def add_listener(self, callback):
+        """
+        call a function for every change, before the waiters are woken up
+        :param callback: called with the name of the changed file, from the watcher thread
+        :return:
+        """
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def changed(self, name):
+        """
+        mark a file as changed, tell the listeners and wake up all waiters
+        :param name:
+        :return:
+        """
+        for callback in list(self.listeners):
+            try:
+                callback(name)
+            except Exception as e:
+                self.log.error("listener for %s failed: %s", name, e)
+        with self.condition:
+            self.versions[name] += 1
+            self.condition.notify_all()
+
+    def wait_for(self, predicate, timeout, name="wait_for"):
+        """
+        wait until predicate() returns True, evaluating it only when a watched file has changed
+        :param predicate: function without arguments
+        :param timeout: in seconds, fractions allowed
+        :param name: what is waited for, for the trace
+        :return: True when the predicate became True, False on timeout
+        """
+        deadline = monotonic() + timeout
+        with self.condition, tracer().span(name, "wait", timeout=timeout) as span:
+            span.args["iterations"] = 0
+            while True:
+                span.args["iterations"] += 1
+                if predicate():
+                    span.args["met"] = True
+                    return True
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    span.args["met"] = False
+                    return False
+                if not self._running:
+                    # nothing will notify us, so check again after a poll interval
+                    remaining = min(remaining, self.poll_interval)
+                self.condition.wait(remaining)
+
+    def _inotify_loop(self, fd):
+        try:
+            while self._running:
+                readable, _, _ = select.select([fd, self._wakeup[0]], [], [])
+                if fd not in readable:
+                    continue
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                changed = set()
+                offset = 0
+                while offset < len(data):
+                    _, _, _, length = EVENT.unpack_from(data, offset)
+                    offset += EVENT.size
+                    name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                    offset += length
+                    if name in self.versions:
+                        changed.add(name)
+                for name in changed:
+                    self.changed(name)
+        finally:
+            os.close(fd)
+
+    def _poll_loop(self):
+        def signature(name):
+            try:
+                info = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                return None
+            return info.st_ino, info.st_size, info.st_mtime_ns
+
+        last = {name: signature(name) for name in self.names}
+        while self._running:
+            for name in self.names:
+                current = signature(name)
+                if current != last[name]:
+                    last[name] = current
+                    self.changed(name)
+            sleep(self.poll_interval)